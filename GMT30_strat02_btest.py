@@ -11,6 +11,10 @@ from indicators.heikin_patterns_01 import HeikinPatterns
 from indicators.movavs import MovAverages
 from indicators.ta_patterns_02 import TaPatterns
 from indicators.pivot_point import MyPivotPoint
+from indicators.registry import IndicatorRegistry
+from trade_stats import TradeStats
+from indicators.precompute import SIGNAL_COLUMNS, PrecomputedPivot, PrecomputedTaPatterns
+from types import SimpleNamespace
 
 class HeikinAshiStrategy(bt.Strategy):        
     params = {
@@ -50,6 +54,9 @@ class HeikinAshiStrategy(bt.Strategy):
         'trade_coef': 0.5,
         'use_kelly': False,
         'num_past_trades': 10,
+        'use_ta_patterns': False,   # TA-Lib candlestick patterns (TaPatterns, ta_threshold) as an entry signal, fed once per bar when precomputed
+
+        'precomputed': False,   # Experimental, signals on completed bars only: data1 is a PrecomputedData feed carrying the indicator lines, data0 a PartialBarData feed (indicators/precompute.py)
     }
 
     def log(self, txt, dt=None):
@@ -69,11 +76,17 @@ class HeikinAshiStrategy(bt.Strategy):
         self.in_position = 0       
         self.kelly_coef = 0        
         self.pp = []        
-        self.past_trades = deque(maxlen=self.params.num_past_trades)  # Store the past trades   
+        self.trade_stats = TradeStats(self.params.num_past_trades)  # Win rate and Kelly coef of the past trades
+        self.order = None        
+        self.entry_price = None        
+        self.registry = IndicatorRegistry()  # Indicators shared with the sub-indicators (HeikinAshi, MAs)
 
+        if self.params.precomputed:
+            self.init_precomputed()
+            return
                
         # HeikinAshi
-        self.ha = bt.indicators.HeikinAshi(self.data1)
+        self.ha = self.registry.get(bt.indicators.HeikinAshi, self.data1)
         self.ha.plotlines.ha_high._plotskip=True 
         self.ha.plotlines.ha_low._plotskip=True
         self.ha.plotlines.ha_open._plotskip=True
@@ -93,10 +106,11 @@ class HeikinAshiStrategy(bt.Strategy):
         self.pattern_stopBuy1 = (self.patterns.lines.stop_signal == 1)
         self.pattern_stopSell1 = (self.patterns.lines.stop_signal == -1)
 
-        # # TA-lib Patterns
-        # self.ta_patterns = TaPatterns(self.data0, 
-        #                               threshold=self.params.ta_threshold*100, 
-        #                               plot=False)
+        # TA-lib Patterns
+        if self.params.use_ta_patterns:
+            self.ta_patterns = TaPatterns(self.data1, 
+                                          threshold=self.params.ta_threshold*100, 
+                                          plot=False)
 
         # Moving averages
         self.movav = MovAverages(self.data1.close, 
@@ -116,20 +130,24 @@ class HeikinAshiStrategy(bt.Strategy):
         self.mas_stop_buy = (self.movav.lines.stop_signal == 1)
         self.mas_stop_sell = (self.movav.lines.stop_signal == -1)        
 
-        # # Hull MA Oscillator
-        self.hmo = bt.indicators.HullMovingAverageOscillator(self.data1.close, 
-                                                             period=self.params.hma_length, 
-                                                             plot=False)
-        self.hmo_buy1 = (self.hmo.hma > 0.0)
-        self.hmo_sell1 = (self.hmo.hma < 0.0)
-
-        # Dicson Moving Average Oscillator
-        self.dma_osc = bt.indicators.DMAOscillator(self.data1.close,
-                                                    period=self.params.dma_period,
-                                                    gainlimit =self.params.dma_gainlimit,
-                                                    hperiod = self.params.dma_hperiod, 
-                                                    plot=False
-                                                    )
+        # # Hull MA Oscillator, around the Hull MA of MovAverages
+        self.hmo = bt.indicators.Oscillator(self.data1.close,
+                                            self.registry.get(bt.indicators.HullMovingAverage,
+                                                              self.data1.close,
+                                                              period=self.params.hma_length),
+                                            plot=False)
+        self.hmo_buy1 = (self.hmo.osc > 0.0)
+        self.hmo_sell1 = (self.hmo.osc < 0.0)
+
+        # Dicson Moving Average Oscillator, around the DMA of MovAverages
+        self.dma_osc = bt.indicators.Oscillator(self.data1.close,
+                                                self.registry.get(bt.indicators.DMA,
+                                                                  self.data1.close,
+                                                                  period=self.params.dma_period,
+                                                                  gainlimit=self.params.dma_gainlimit,
+                                                                  hperiod=self.params.dma_hperiod),
+                                                plot=False
+                                                )
         self.dma_osc_buy = (self.dma_osc > 0.0)
         self.dma_osc_sell = (self.dma_osc < 0.0)        
 
@@ -246,16 +264,41 @@ class HeikinAshiStrategy(bt.Strategy):
         self.pivot = MyPivotPoint(self.data1)
         # self.p, self.r1, self.r2, self.s1, self.s2 = self.pivot.lines
 
-        self.order = None        
-        self.entry_price = None        
+    def init_precomputed(self):
+        ''' Take the indicator lines from the precomputed columns of data1 instead of building the indicators'''
+        self.ha = self.data1  # ha_open, ha_high, ha_low, ha_close lines
+        self.ha_green = (self.ha.lines.ha_close > self.ha.lines.ha_open)
+        self.ha_red = (self.ha.lines.ha_close < self.ha.lines.ha_open)
+
+        # Heikin Ashi Patterns
+        self.patterns = HeikinPatterns(self.data1, plot=False)
+        self.pattern_buy1 = (self.patterns.lines.signal == 1)
+        self.pattern_sell1 = (self.patterns.lines.signal == -1)
+        self.pattern_stopBuy1 = (self.patterns.lines.stop_signal == 1)
+        self.pattern_stopSell1 = (self.patterns.lines.stop_signal == -1)
+        self.ta_patterns = PrecomputedTaPatterns(self.data1, threshold=self.params.ta_threshold*100)
+
+        # mas_buy, apo_buy, mfi_sell, ... under the same names as in __init__
+        for name in SIGNAL_COLUMNS:
+            setattr(self, name, getattr(self.data1.lines, name))
+
+        self.dmi = self.data1  # DIplus, DIminus lines
+        self.adx = SimpleNamespace(real=self.data1.lines.adxr)
+        self.pivot = PrecomputedPivot(self.data1)
     
     def adx_growing(self):
         return (self.adx.real[-1] < self.adx.real[0]) and \
                 (self.adx.real[-2] <= self.adx.real[-1]) #and \
                 # (self.adx.real[-3] >= self.adx.real[-2])
         
+    def ta_pattern_buy(self):
+        return self.params.use_ta_patterns and self.ta_patterns.signal_buy()
+
+    def ta_pattern_sell(self):
+        return self.params.use_ta_patterns and self.ta_patterns.signal_sell()
+
     def check_buy_condition(self):        
-        condition1 = (self.mas_buy[0] or self.pivot.buy() or self.mama_buy[0] or self.sma_buy[0]) and self.apo_buy[0] #or self.pattern_buy())
+        condition1 = (self.mas_buy[0] or self.pivot.buy() or self.mama_buy[0] or self.sma_buy[0] or self.ta_pattern_buy()) and self.apo_buy[0]
         condition2 = (self.cmo_buy[0] or self.adx_buy[0]) and self.mfi_buy[0] and self.dma_osc_buy[0]
         condition3 = self.high_volatility[0] and (self.ad_osc_buy1[0] or self.volume_filter[0]) and self.hmo_buy1[0] #   # 
         condition4 = (self.stoch_buy1[0] or self.stoch_buy1[-1])
@@ -263,28 +306,43 @@ class HeikinAshiStrategy(bt.Strategy):
         return check_buy_condition
 
     def check_sell_condition(self):        
-        condition1 = (self.mas_sell[0] or self.pivot.sell() or self.mama_sell[0] or self.sma_sell[0]) and self.apo_sell[0]# or self.pattern_sell())
+        condition1 = (self.mas_sell[0] or self.pivot.sell() or self.mama_sell[0] or self.sma_sell[0] or self.ta_pattern_sell()) and self.apo_sell[0]
         condition2 = (self.cmo_sell[0] or self.adx_sell[0]) and self.mfi_sell[0] and self.dma_osc_sell[0]
         condition3 = self.high_volatility[0] and (self.ad_osc_sell1[0] or self.volume_filter[0]) and self.hmo_sell1[0]
         condition4 = (self.stoch_sell1[0] or self.stoch_sell1[-1])
         check_sell_condition = (condition1 and condition2 and condition3 and condition4)
         return check_sell_condition
 
-    def check_stop_buy_condition(self):        
+    def check_stop_buy_condition(self, buy=None):        
         condition1 = (self.pattern_stopBuy1[0] or self.pattern_sell1[0] or self.mas_stop_buy[0] or self.mama_sell[0]) #  or self.pivot_stop_buy())
         condition2 = self.mfi_sell[0] and (self.ad_osc_sell1[0] or self.volume_filter[0])
         condition3 = ((self.dmi.DIminus[-1] < self.dmi.DIminus[0]) and self.adx_growing()) or \
                       (self.stoch_sell1[0] or self.stoch_sell1[-1])
         check_stop_buy_condition = (condition1 and condition2 and condition3) or self.pivot.sell() or self.sma_sell[0]
-        return check_stop_buy_condition and not self.check_buy_condition()
+        if buy is None:
+            buy = self.check_buy_condition()
+        return check_stop_buy_condition and not buy
     
-    def check_stop_sell_condition(self):
+    def check_stop_sell_condition(self, sell=None):
         condition1 = (self.pattern_stopSell1[0] or self.pattern_buy1[0] or self.mas_stop_sell[0] or self.mama_buy[0]) #  or self.pivot_stop_sell())
         condition2 = self.mfi_buy[0] and (self.ad_osc_sell1[0] or self.volume_filter[0])
         condition3 = ((self.dmi.DIplus[0] > self.dmi.DIplus[-1]) and self.adx_growing()) or \
                       (self.stoch_buy1[0] or self.stoch_buy1[-1])
         check_stop_sell_condition = (condition1 and condition2 and condition3) or self.pivot.buy() or self.sma_buy[0]
-        return check_stop_sell_condition and not self.check_sell_condition()
+        if sell is None:
+            sell = self.check_sell_condition()
+        return check_stop_sell_condition and not sell
+
+    def bar_signals(self):
+        ''' Signals of the current bar, evaluated once and shared by the entry, exit and sizing code.
+        The stop signals are only evaluated for the side of the open position, they stay False otherwise.'''
+        buy = self.check_buy_condition()
+        sell = self.check_sell_condition()
+        stop_buy = self.in_position > 0 and self.check_stop_buy_condition(buy)
+        stop_sell = self.in_position < 0 and self.check_stop_sell_condition(sell)
+        return SimpleNamespace(buy=buy, sell=sell, stop_buy=stop_buy, stop_sell=stop_sell,
+                               win_rate=self.trade_stats.win_rate, win_loss_ratio=self.trade_stats.win_loss_ratio,
+                               kelly_coef=self.trade_stats.kelly_coef)
 
     
     def notify_trade(self, trade):
@@ -296,7 +354,7 @@ class HeikinAshiStrategy(bt.Strategy):
         self.log('TRADE PROFIT: GROSS:  %.2f, NET:  %.2f, COMM:  %.2f' %
                  (trade.pnl, trade.pnlcomm, commission))
         
-        self.past_trades.append(trade.pnlcomm)
+        self.trade_stats.add(trade.pnlcomm)
     
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
@@ -329,7 +387,7 @@ class HeikinAshiStrategy(bt.Strategy):
                     profit_loss = (order.executed.price - self.long_entry_price) * closed_size
                     self.log(f"Closed LONG position, Price: {order.executed.price:.4f},\t ----- PnL = {profit_loss:.2f} $")
                                     
-                # self.past_trades.append(profit_loss)
+                # self.trade_stats.add(profit_loss)
 
         elif order.status in [order.Canceled, order.Rejected]:
             self.log('Order Canceled/Rejected')            
@@ -343,6 +401,8 @@ class HeikinAshiStrategy(bt.Strategy):
     def next(self): 
         if len(self.data0) < 5:
             return  
+        if self.params.precomputed and not self.data1.ready[0]:
+            return  # the indicators have not reached their minimum period yet
         
         # Define your timezone
         kiev_tz = pytz.timezone('Europe/Kiev')
@@ -371,32 +431,17 @@ class HeikinAshiStrategy(bt.Strategy):
         if price == 0:           
             return         
         
-        # Calculate the size for the trade using the Kelly Criterion
-        wins = [trade for trade in self.past_trades if trade > 0]  # Wins are trades with positive profit
-        losses = [trade for trade in self.past_trades if trade < 0]  # Losses are trades with negative profit
-        average_win = sum(wins) / len(wins) if wins else 0.0
-        average_loss = abs(sum(losses)) / abs(len(losses)) if losses else 0.0
-        win_rate = len(wins) / len(self.past_trades) if self.past_trades else 0.0
-        win_loss_ratio1 = average_win / average_loss if average_loss != 0 else 1.0
-        # win_rate = len(wins) / len(self.past_trades) if self.past_trades else 0.0
-        # win_loss_ratio2 = abs(sum(wins)) / abs(sum(losses)) if losses else float('inf')
-        win_loss_ratio = win_loss_ratio1 #+ win_loss_ratio2) / 2        
-        if len(self.past_trades) == self.params.num_past_trades:                   
-            kelly_coef = (win_rate - ((1 - win_rate) / win_loss_ratio)) if win_loss_ratio != 0.0 else 0.5
-        else:
-            kelly_coef = 0.5
-        if kelly_coef < 0:
-            kelly_coef = 0.0
+        signals = self.bar_signals()
                 
-        if self.in_position == 0 and \
-            (self.check_buy_condition() or self.check_sell_condition()):            
+        if self.in_position == 0 and (signals.buy or signals.sell):            
                     
-            if self.check_buy_condition():
-                price = self.data1.high[0]  
+            if signals.buy:
+                # High of the forming 30m bar, which the replayed data1 holds
+                price = self.data0.partial_high[0] if self.params.precomputed else self.data1.high[0]
                 cash = self.broker.getcash() 
                 if self.params.use_kelly:
                     trade_amount1 = self.params.trade_coef / 2
-                    free_money = cash * (trade_amount1 + (trade_amount1 * kelly_coef))
+                    free_money = cash * (trade_amount1 + (trade_amount1 * signals.kelly_coef))
                 else:                        
                     free_money = cash * self.params.trade_coef
 
@@ -407,15 +452,15 @@ class HeikinAshiStrategy(bt.Strategy):
                 print("-" * 50)                
                 print(f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\t ---- LONG ---- size = {size:.2f} at price = {price:.4f} //// ----- value: {value:.2f} $")                
                 if self.params.use_kelly:               
-                    print(f"win rate: {win_rate:.2f}, win loss ratio: {win_loss_ratio:.2f},\t Kelly coef: {kelly_coef:.2f}")
+                    print(f"win rate: {signals.win_rate:.2f}, win loss ratio: {signals.win_loss_ratio:.2f},\t Kelly coef: {signals.kelly_coef:.2f}")
                 
 
-            elif self.check_sell_condition():
-                price = self.data1.low[0]
+            elif signals.sell:
+                price = self.data0.partial_low[0] if self.params.precomputed else self.data1.low[0]
                 cash = self.broker.getcash()
                 if self.params.use_kelly:
                     trade_amount1 = self.params.trade_coef / 2
-                    free_money = cash * (trade_amount1 + (trade_amount1 * kelly_coef))
+                    free_money = cash * (trade_amount1 + (trade_amount1 * signals.kelly_coef))
                 else:
                     free_money = cash * self.params.trade_coef
                 size = self.broker.getcommissioninfo(self.data).getsize(price=price, cash=free_money) #* (kelly_coef)
@@ -425,15 +470,15 @@ class HeikinAshiStrategy(bt.Strategy):
                 print("-" * 50)
                 print(f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\t ---- SHORT ---- size = {size:.2f} at price = {price:.4f} //// ----- Value: {value:.2f} $")                
                 if self.params.use_kelly:
-                    print(f"win rate: {win_rate:.2f}, win\loss ratio: {win_loss_ratio:.2f},\t Kelly coef: {kelly_coef:.2f}")
+                    print(f"win rate: {signals.win_rate:.2f}, win\loss ratio: {signals.win_loss_ratio:.2f},\t Kelly coef: {signals.kelly_coef:.2f}")
                 
-        elif ((self.in_position > 0) and (self.check_sell_condition() or self.check_stop_buy_condition())):            
+        elif ((self.in_position > 0) and (signals.sell or signals.stop_buy)):            
             self.order = self.close()
             cash = self.broker.getcash()
             msg = f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}  CLOSED     ---- LONG ----  ////  \t  CASH: {cash:.2f} $"
             print(msg)
                         
-        elif ((self.in_position < 0) and (self.check_buy_condition() or self.check_stop_sell_condition())):            
+        elif ((self.in_position < 0) and (signals.buy or signals.stop_sell)):            
             self.order = self.close()  
             cash = self.broker.getcash()
             msg = f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}  CLOSED     ---- SHORT ----  ////  \t  CASH: {cash:.2f} $"
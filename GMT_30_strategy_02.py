@@ -8,10 +8,13 @@ import numpy as np
 import datetime as dtime
 import pytz
 import asyncio
+from types import SimpleNamespace
 from indicators.heikin_patterns_01 import HeikinPatterns
 from indicators.movavs import MovAverages
 from indicators.ta_patterns_02 import TaPatterns
 from indicators.pivot_point import MyPivotPoint
+from indicators.registry import IndicatorRegistry
+from trade_stats import TradeStats
 from TGnotify import TG_Notifier
 import api_config
 
@@ -74,7 +77,7 @@ class HeikinAshiStrategy(bt.Strategy):
         self.in_position = 0
         self.kelly_coef = 0        
         self.pp = []        
-        self.past_trades = deque(maxlen=self.params.num_past_trades)  # Store the past trades    
+        self.trade_stats = TradeStats(self.params.num_past_trades)  # Win rate and Kelly coef of the past trades
 
         # Telegram notifier
         self.notifier = TG_Notifier(token=api_config.TG_BOT_API, chat_id=api_config.TG_BOT_ID) 
@@ -90,9 +93,11 @@ class HeikinAshiStrategy(bt.Strategy):
         #  Live ploting
         self.datafile = open('data.csv', 'w')
         self.datafile.write('datetime,open,high,low,close,volume\n')
+
+        self.registry = IndicatorRegistry()  # Indicators shared with the sub-indicators (HeikinAshi, MAs)
        
         # HeikinAshi
-        self.ha = bt.indicators.HeikinAshi(self.data1)
+        self.ha = self.registry.get(bt.indicators.HeikinAshi, self.data1)
         self.ha.plotlines.ha_high._plotskip=True 
         self.ha.plotlines.ha_low._plotskip=True
         self.ha.plotlines.ha_open._plotskip=True
@@ -135,20 +140,24 @@ class HeikinAshiStrategy(bt.Strategy):
         self.mas_stop_buy = (self.movav.lines.stop_signal == 1)
         self.mas_stop_sell = (self.movav.lines.stop_signal == -1)        
 
-        # # Hull MA Oscillator
-        self.hmo = bt.indicators.HullMovingAverageOscillator(self.data1.close, 
-                                                             period=self.params.hma_length, 
-                                                             plot=False)
-        self.hmo_buy1 = (self.hmo.hma > 0.0)
-        self.hmo_sell1 = (self.hmo.hma < 0.0)
-
-        # Dicson Moving Average Oscillator
-        self.dma_osc = bt.indicators.DMAOscillator(self.data1.close,
-                                                    period=self.params.dma_period,
-                                                    gainlimit =self.params.dma_gainlimit,
-                                                    hperiod = self.params.dma_hperiod, 
-                                                    plot=False
-                                                    )
+        # # Hull MA Oscillator, around the Hull MA of MovAverages
+        self.hmo = bt.indicators.Oscillator(self.data1.close,
+                                            self.registry.get(bt.indicators.HullMovingAverage,
+                                                              self.data1.close,
+                                                              period=self.params.hma_length),
+                                            plot=False)
+        self.hmo_buy1 = (self.hmo.osc > 0.0)
+        self.hmo_sell1 = (self.hmo.osc < 0.0)
+
+        # Dicson Moving Average Oscillator, around the DMA of MovAverages
+        self.dma_osc = bt.indicators.Oscillator(self.data1.close,
+                                                self.registry.get(bt.indicators.DMA,
+                                                                  self.data1.close,
+                                                                  period=self.params.dma_period,
+                                                                  gainlimit=self.params.dma_gainlimit,
+                                                                  hperiod=self.params.dma_hperiod),
+                                                plot=False
+                                                )
         self.dma_osc_buy = (self.dma_osc > 0.0)
         self.dma_osc_sell = (self.dma_osc < 0.0)        
 
@@ -289,21 +298,36 @@ class HeikinAshiStrategy(bt.Strategy):
         check_sell_condition = (condition1 and condition2 and condition3 and condition4)
         return check_sell_condition
 
-    def check_stop_buy_condition(self):        
+    def check_stop_buy_condition(self, buy=None):        
         condition1 = (self.pattern_stopBuy1[0] or self.pattern_sell1[0] or self.mas_stop_buy[0] or self.mama_sell[0]) #  or self.pivot_stop_buy())
         condition2 = self.mfi_sell[0] and (self.ad_osc_sell1[0] or self.volume_filter[0])
         condition3 = ((self.dmi.DIminus[-1] < self.dmi.DIminus[0]) and self.adx_growing()) or \
                       (self.stoch_sell1[0] or self.stoch_sell1[-1])
         check_stop_buy_condition = (condition1 and condition2 and condition3) or self.pivot.sell() or self.sma_sell[0]
-        return check_stop_buy_condition and not self.check_buy_condition()
+        if buy is None:
+            buy = self.check_buy_condition()
+        return check_stop_buy_condition and not buy
     
-    def check_stop_sell_condition(self):
+    def check_stop_sell_condition(self, sell=None):
         condition1 = (self.pattern_stopSell1[0] or self.pattern_buy1[0] or self.mas_stop_sell[0] or self.mama_buy[0]) #  or self.pivot_stop_sell())
         condition2 = self.mfi_buy[0] and (self.ad_osc_sell1[0] or self.volume_filter[0])
         condition3 = ((self.dmi.DIplus[0] > self.dmi.DIplus[-1]) and self.adx_growing()) or \
                       (self.stoch_buy1[0] or self.stoch_buy1[-1])
         check_stop_sell_condition = (condition1 and condition2 and condition3) or self.pivot.buy() or self.sma_buy[0]
-        return check_stop_sell_condition and not self.check_sell_condition()
+        if sell is None:
+            sell = self.check_sell_condition()
+        return check_stop_sell_condition and not sell
+
+    def bar_signals(self):
+        ''' Signals of the current bar, evaluated once and shared by the entry, exit and sizing code.
+        The stop signals are only evaluated for the side of the open position, they stay False otherwise.'''
+        buy = self.check_buy_condition()
+        sell = self.check_sell_condition()
+        stop_buy = self.in_position > 0 and self.check_stop_buy_condition(buy)
+        stop_sell = self.in_position < 0 and self.check_stop_sell_condition(sell)
+        return SimpleNamespace(buy=buy, sell=sell, stop_buy=stop_buy, stop_sell=stop_sell,
+                               win_rate=self.trade_stats.win_rate, win_loss_ratio=self.trade_stats.win_loss_ratio,
+                               kelly_coef=self.trade_stats.kelly_coef)
     
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:            
@@ -359,9 +383,9 @@ class HeikinAshiStrategy(bt.Strategy):
         dt = dtime.datetime.now()
         msg= 'Data Status: {}'.format(data._getstatusname(status))
         print(dt,dn,msg)
-        asyncio.run(self.notifier.send_message(f"{dt.isoformat(sep=' ')}\n"
-                                               f"{dn}\n"
-                                               f"{msg}"))
+        self.notifier.notify(f"{dt.isoformat(sep=' ')}\n"
+                             f"{dn}\n"
+                             f"{msg}")
         if data._getstatusname(status) == 'LIVE':            
             self.live_data = True
             # print(f"{dt} {dn} Data is live.")                       
@@ -379,35 +403,35 @@ class HeikinAshiStrategy(bt.Strategy):
         self.log('OPERATION PROFIT: GROSS:  %.2f, NET:  %.2f, COMM:  %.2f' %
                  (trade.pnl, trade.pnlcomm, commission))
                     
-        asyncio.run(self.notifier.send_message(f"CLOSED TRADE\n"
-                                               f"---------------------------------------\n"
-                                               f"Direction: \t{self.stats.trade_list.dir[0]}\n"
-                                               f"Price in: \t{self.stats.trade_list.pricein[0]:.4f}\n"
-                                               f"Price out: \t{self.stats.trade_list.priceout[0]:.4f}\n"
-                                               f"Size: \t{self.stats.trade_list.size[0]:.1f}\n"
-                                               f"Value: \t{self.stats.trade_list.value[0]:.2f}\n"
-                                               f"---------------------------------------\n"
-                                               f"PnL: \t{trade.pnl[0]:.2f}\n"
-                                               f"Net profit: \t{trade.pnlcomm[0]:.2f}\n"
-                                               f"Commission: \t{commission[0]:.2f}\n"
-                                               f"Bars in trade: \t{self.stats.trade_list.barlen[0]}\n"
-                                               f"PnL/bar: \t{self.stats.trade_list.pbar[0]:.2f}\n"
-                                               f"---------------------------------------\n"
-                                               f"Drawdown: {self.stats.drawdown.drawdown[-1]:.2f} $"
-                                               f"Max drawdown: {self.stats.drawdown.maxdrawdown[-1]:.2f} $"
-                                               f"---------------------------------------\n"
-                                               f" Portfolio value: {self.broker.getvalue():.2f} $")) 
+        self.notifier.notify(f"CLOSED TRADE\n"
+                             f"---------------------------------------\n"
+                             f"Direction: \t{self.stats.trade_list.dir[0]}\n"
+                             f"Price in: \t{self.stats.trade_list.pricein[0]:.4f}\n"
+                             f"Price out: \t{self.stats.trade_list.priceout[0]:.4f}\n"
+                             f"Size: \t{self.stats.trade_list.size[0]:.1f}\n"
+                             f"Value: \t{self.stats.trade_list.value[0]:.2f}\n"
+                             f"---------------------------------------\n"
+                             f"PnL: \t{trade.pnl[0]:.2f}\n"
+                             f"Net profit: \t{trade.pnlcomm[0]:.2f}\n"
+                             f"Commission: \t{commission[0]:.2f}\n"
+                             f"Bars in trade: \t{self.stats.trade_list.barlen[0]}\n"
+                             f"PnL/bar: \t{self.stats.trade_list.pbar[0]:.2f}\n"
+                             f"---------------------------------------\n"
+                             f"Drawdown: {self.stats.drawdown.drawdown[-1]:.2f} $"
+                             f"Max drawdown: {self.stats.drawdown.maxdrawdown[-1]:.2f} $"
+                             f"---------------------------------------\n"
+                             f" Portfolio value: {self.broker.getvalue():.2f} $") 
 
         self.daily_trades += 1
         self.total_trades += 1
         
-        self.past_trades.append(trade.pnlcomm)
+        self.trade_stats.add(trade.pnlcomm)
 
     def start(self):
         self.daily_value = self.broker.getvalue()  # Store the initial portfolio value
         self.start_value = self.broker.getvalue()  # Store the initial portfolio value
 
-    async def send_daily_summary(self):
+    def send_daily_summary(self):
         # Calculate daily PnL
         current_value = self.broker.getvalue()
         daily_pnl = current_value - self.daily_value
@@ -432,7 +456,7 @@ class HeikinAshiStrategy(bt.Strategy):
         self.daily_trades = 0
 
         # Send the summary via Telegram
-        await self.notifier.send_message(summary)
+        self.notifier.notify(summary)
     
     def next(self): 
         if len(self.data0) < 5:
@@ -491,17 +515,17 @@ class HeikinAshiStrategy(bt.Strategy):
         self.log('**************************'*2)
 
         if self.first_run:
-            asyncio.run(self.notifier.send_message(f"Received LIVE data...\n"
-                                                   f"---------------------------------------\n"
-                                                   f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\n"
-                                                   f"Open: \t{self.data0.open[0]:.4f}\n"
-                                                   f"High: \t{self.data0.high[0]:.4f}\n"
-                                                   f"Low: \t{self.data0.low[0]:.4f}\n"
-                                                   f"Close: \t{self.data0.close[0]:.4f}\n"
-                                                   f"Volume: {self.data0.volume[0]:.0f}\n"
-                                                   f"  {status}\n"
-                                                   f"---------------------------------------\n"
-                                                   f" Portfolio value: {value:.2f} $")) 
+            self.notifier.notify(f"Received LIVE data...\n"
+                                 f"---------------------------------------\n"
+                                 f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\n"
+                                 f"Open: \t{self.data0.open[0]:.4f}\n"
+                                 f"High: \t{self.data0.high[0]:.4f}\n"
+                                 f"Low: \t{self.data0.low[0]:.4f}\n"
+                                 f"Close: \t{self.data0.close[0]:.4f}\n"
+                                 f"Volume: {self.data0.volume[0]:.0f}\n"
+                                 f"  {status}\n"
+                                 f"---------------------------------------\n"
+                                 f" Portfolio value: {value:.2f} $") 
             self.first_run = False
         
         # if self.data.haslivedata:
@@ -519,32 +543,16 @@ class HeikinAshiStrategy(bt.Strategy):
         if price == 0:           
             return         
         
-        # Calculate the size for the trade using the Kelly Criterion
-        wins = [trade for trade in self.past_trades if trade > 0]  # Wins are trades with positive profit
-        losses = [trade for trade in self.past_trades if trade < 0]  # Losses are trades with negative profit
-        average_win = sum(wins) / len(wins) if wins else 0.0
-        average_loss = abs(sum(losses)) / abs(len(losses)) if losses else 0.0
-        win_rate = len(wins) / len(self.past_trades) if self.past_trades else 0.0
-        win_loss_ratio1 = average_win / average_loss if average_loss != 0 else 1.0
-        # win_rate = len(wins) / len(self.past_trades) if self.past_trades else 0.0
-        # win_loss_ratio2 = abs(sum(wins)) / abs(sum(losses)) if losses else float('inf')
-        win_loss_ratio = win_loss_ratio1 #+ win_loss_ratio2) / 2        
-        if len(self.past_trades) == self.params.num_past_trades:                   
-            kelly_coef = (win_rate - ((1 - win_rate) / win_loss_ratio)) if win_loss_ratio != 0.0 else 0.5
-        else:
-            kelly_coef = 0.5
-        if kelly_coef < 0:
-            kelly_coef = 0.0
+        signals = self.bar_signals()
                 
-        if self.in_position == 0 and \
-            (self.check_buy_condition() or self.check_sell_condition()):            
+        if self.in_position == 0 and (signals.buy or signals.sell):            
                     
-            if self.check_buy_condition():
+            if signals.buy:
                 price = self.data1.high[0]  
                 cash = self.broker.getvalue() 
                 if self.params.use_kelly:
                     trade_amount1 = self.params.trade_coef / 2
-                    free_money = cash * (trade_amount1 + (trade_amount1 * kelly_coef))
+                    free_money = cash * (trade_amount1 + (trade_amount1 * signals.kelly_coef))
                 else:                        
                     free_money = cash * self.params.trade_coef
 
@@ -555,19 +563,19 @@ class HeikinAshiStrategy(bt.Strategy):
                 print("-" * 50)                
                 print(f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\t ---- LONG ---- size = {size:.2f} at price = {price:.4f} //// ----- value: {value:.2f} $")
                 if self.tg_notifications:
-                    asyncio.run(self.notifier.send_message(f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\n"
-                                                           f" ---- LONG ---- size = {size:.2f} at price = {price:.4f}\n"
-                                                           f" Portfolio value: {value:.2f} $")) 
+                    self.notifier.notify(f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\n"
+                                         f" ---- LONG ---- size = {size:.2f} at price = {price:.4f}\n"
+                                         f" Portfolio value: {value:.2f} $") 
                 if self.params.use_kelly:               
-                    print(f"win rate: {win_rate:.2f}, win loss ratio: {win_loss_ratio:.2f},\t Kelly coef: {kelly_coef:.2f}")
+                    print(f"win rate: {signals.win_rate:.2f}, win loss ratio: {signals.win_loss_ratio:.2f},\t Kelly coef: {signals.kelly_coef:.2f}")
                 
 
-            elif self.check_sell_condition():
+            elif signals.sell:
                 price = self.data1.low[0]
                 cash = self.broker.getvalue()
                 if self.params.use_kelly:
                     trade_amount1 = self.params.trade_coef / 2
-                    free_money = cash * (trade_amount1 + (trade_amount1 * kelly_coef))
+                    free_money = cash * (trade_amount1 + (trade_amount1 * signals.kelly_coef))
                 else:
                     free_money = cash * self.params.trade_coef
                 size = self.broker.getcommissioninfo(self.data).getsize(price=price, cash=free_money) #* (kelly_coef)
@@ -576,14 +584,14 @@ class HeikinAshiStrategy(bt.Strategy):
                 print("-" * 50)
                 print(f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\t ---- SHORT ---- size = {size:.2f} at price = {price:.4f} //// ----- Value: {value:.2f} $")
                 if self.tg_notifications: 
-                    asyncio.run(self.notifier.send_message(f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\n"
-                                                           f" ---- SHORT ---- size = {size:.2f} at price = {price:.4f}\n"
-                                                           f" Portfolio value: {value:.2f} $"))               
+                    self.notifier.notify(f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\n"
+                                         f" ---- SHORT ---- size = {size:.2f} at price = {price:.4f}\n"
+                                         f" Portfolio value: {value:.2f} $")               
                 if self.params.use_kelly:
-                    print(f"win rate: {win_rate:.2f}, win\loss ratio: {win_loss_ratio:.2f},\t Kelly coef: {kelly_coef:.2f}")
+                    print(f"win rate: {signals.win_rate:.2f}, win\loss ratio: {signals.win_loss_ratio:.2f},\t Kelly coef: {signals.kelly_coef:.2f}")
                 
                         
-        elif ((self.in_position > 0) and (self.check_sell_condition() or self.check_stop_buy_condition())):            
+        elif ((self.in_position > 0) and (signals.sell or signals.stop_buy)):            
             self.order = self.close()
             cash = self.broker.getvalue()
             msg = f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}  CLOSED     ---- LONG ----  ////  \t  CASH: {cash:.2f} $"
@@ -593,7 +601,7 @@ class HeikinAshiStrategy(bt.Strategy):
             #                                            f" CLOSED     ---- LONG ----    \n"
             #                                            f" CASH: {cash:.2f} $"))
             
-        elif ((self.in_position < 0) and (self.check_buy_condition() or self.check_stop_sell_condition())):            
+        elif ((self.in_position < 0) and (signals.buy or signals.stop_sell)):            
             self.order = self.close()  
             cash = self.broker.getvalue()
             msg = f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}  CLOSED     ---- SHORT ----  ////  \t  CASH: {cash:.2f} $"
@@ -612,9 +620,9 @@ class HeikinAshiStrategy(bt.Strategy):
                 self.order = self.close()
                 self.log(f"Price: {current_price:.4f}, SL %: {self.params.sl_percent:.2f} \t !!! STOP-LOSS !!!")                
                 if self.tg_notifications:
-                    asyncio.run(self.notifier.send_message(f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\n"
-                                                           f"Price: {current_price:.4f}, SL %: {self.params.sl_percent:.2f} \n"
-                                                           f" !!! STOP-LOSS !!!"))
+                    self.notifier.notify(f"{bt.num2date(self.data0.datetime[0], tz=kiev_tz)}\n"
+                                         f"Price: {current_price:.4f}, SL %: {self.params.sl_percent:.2f} \n"
+                                         f" !!! STOP-LOSS !!!")
                                             
             # print("-" * 50)
             # self.log('DrawDown: %.2f' % self.stats.drawdown.drawdown[-1])
@@ -627,7 +635,7 @@ class HeikinAshiStrategy(bt.Strategy):
         if current_datetime.time() >= dtime.time(23, 59) and not self.daily_summary_sent:
             # Send the daily summary
             if self.tg_notifications:
-                asyncio.run(self.send_daily_summary())
+                self.send_daily_summary()
             self.daily_summary_sent = True  # Set the flag to True after sending the summary
 
         # Reset the flag at the start of a new trading day
@@ -639,8 +647,8 @@ class HeikinAshiStrategy(bt.Strategy):
 
     def stop(self):
         kiev_tz = pytz.timezone('Europe/Kiev')
-        asyncio.run(self.notifier.send_message(f"Strategy stopped at {bt.num2date(self.data0.datetime[0], tz=kiev_tz)}"))
+        self.notifier.notify(f"Strategy stopped at {bt.num2date(self.data0.datetime[0], tz=kiev_tz)}")
         # Closing the notifier connections
-        asyncio.run(self.notifier.close())
+        self.notifier.close()
         self.datafile.close()
 
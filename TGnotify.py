@@ -1,11 +1,123 @@
 # TGnotify.py
 
+# Telegram notifications. notify() only puts the message in a bounded queue and returns, a background thread
+# with its own event loop sends the queued messages in batches and retries them, so a slow or unreachable
+# Telegram never holds up the strategy or the orders.
+
+import asyncio
+import queue
+import threading
+import time
 from aiogram import Bot
 
+MAX_MESSAGE_LENGTH = 4096  # Telegram's limit for one message
+BATCH_SEPARATOR = '\n\n'
+_STOP = object()  # sentinel that ends the sender thread
+
+
 class TG_Notifier:
-    def __init__(self, token, chat_id):
+    ''' Messages to one Telegram chat through a background sender.
+    The queue holds "max_queue" messages, when it is full the oldest one is dropped (and counted) instead of
+    blocking the caller. The sender joins the waiting messages into batches up to Telegram's message length
+    and retries a failed batch "retries" times with exponential backoff (or Telegram's retry_after).'''
+
+    def __init__(self, token, chat_id, max_queue=100, retries=5, retry_delay=1.0):
         self.bot = Bot(token=token)
         self.chat_id = chat_id
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.dropped = 0  # messages dropped since the last batch
+        self._pending = None  # message taken from the queue that did not fit in the last batch
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def notify(self, text):
+        ''' Queue "text" for the sender and return at once, False if an older message had to be dropped'''
+        if self._closed:
+            return False
+        self._start()
+        return self._put(str(text))
+
+    def _put(self, item):
+        with self._lock:
+            dropped = False
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return not dropped
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()  # back-pressure: the oldest message makes room
+                        self.dropped += 1
+                        dropped = True
+                    except queue.Empty:
+                        pass
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='TG_Notifier', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                loop.run_until_complete(self._send_batch(batch))
+            loop.run_until_complete(self.bot.close())
+        finally:
+            loop.close()
+
+    def _next_batch(self):
+        ''' Waiting messages joined up to MAX_MESSAGE_LENGTH, blocks until there is one, None once stopped'''
+        item = self._pending if self._pending is not None else self.queue.get()
+        self._pending = None
+        if item is _STOP:
+            return None
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        parts = [f"({dropped} notifications dropped)"] if dropped else []
+        parts.append(item[:MAX_MESSAGE_LENGTH])
+        length = sum(len(part) for part in parts) + len(BATCH_SEPARATOR) * (len(parts) - 1)
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP or length + len(BATCH_SEPARATOR) + len(item) > MAX_MESSAGE_LENGTH:
+                self._pending = item
+                break
+            parts.append(item)
+            length += len(BATCH_SEPARATOR) + len(item)
+        return BATCH_SEPARATOR.join(parts)[:MAX_MESSAGE_LENGTH]
+
+    async def _send_batch(self, text):
+        for attempt in range(self.retries + 1):
+            try:
+                await self.send_message(text)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    print(f"Telegram notification dropped after {attempt + 1} attempts: {e}")
+                    return
+                await asyncio.sleep(getattr(e, 'retry_after', None) or self.retry_delay * 2 ** attempt)
+
+    def close(self, timeout=10.0):
+        ''' Send what is still queued (waiting at most "timeout" seconds) and stop the sender'''
+        self._closed = True
+        if self._thread is None:
+            return
+        started = time.monotonic()
+        try:
+            self.queue.put(_STOP, timeout=timeout)  # waits for room, the queued messages are not dropped
+        except queue.Full:
+            return  # the sender is stuck, it is a daemon thread and ends with the program
+        self._thread.join(max(timeout - (time.monotonic() - started), 0.0))
 
     async def send_message(self, text):
         await self.bot.send_message(chat_id=self.chat_id, text=text)
@@ -21,6 +133,3 @@ class TG_Notifier:
     async def send_error_notification(self, error):
         text = f"An error occurred:\n{error}"
         await self.send_message(text)
-
-    async def close(self):
-        await self.bot.close()
@@ -0,0 +1,295 @@
+# benchmark.py
+# Throughput benchmark for the backtest and the optimizer.
+# Every case runs in a fresh process on a 5m GMTUSDT fixture (synthetic, seeded, or recorded candles from the
+# data cache) and reports bars/sec or evaluations/sec and the peak RSS of the process and its pool workers.
+# The live case times live_runner.SignalEngine per closed candle, against the 5 minutes until the next one:
+#
+#   python benchmark.py                      # run and compare with benchmark_baseline.json
+#   python benchmark.py --save-baseline      # run and store the results as the new baseline
+#   python benchmark.py --days 1 10 --modes precomputed vectorized --pools 1 4 --recorded
+#
+# --recorded needs enough cached candles and a baseline of the recorded cases on this machine, a missing one
+# fails the run.
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from queue import Empty
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from data_feed import BinanceFuturesData
+from GMT30_strat02_btest import HeikinAshiStrategy
+import optimizer_01
+
+SYMBOL = 'GMTUSDT'
+MODES = ('replay', 'precomputed', 'vectorized')
+# GA parameters of the backtest and evaluate cases: the strategy defaults, in optimizer order
+DEFAULT_PARAMS = [getattr(HeikinAshiStrategy.params, name) for name in list(HeikinAshiStrategy.params._getkeys())[:29]]
+
+
+def synthetic_ohlcv(days, seed=0):
+    ''' Seeded random walk of 5m candles around the GMT price, with volatility regimes so the strategy trades'''
+    rng = np.random.default_rng(seed)
+    n = days * 288
+    volatility = 0.004 * np.repeat(rng.uniform(0.5, 2.0, n // 48 + 1), 48)[:n]
+    close = 0.2 * np.exp(np.cumsum(rng.normal(0, 1, n) * volatility))
+    open_ = np.r_[close[0], close[:-1]]
+    index = pd.date_range('2023-06-01', periods=n, freq='5min', tz='UTC', name='datetime')
+    return pd.DataFrame({
+        'open': open_,
+        'high': np.maximum(open_, close) * (1 + rng.uniform(0, 0.003, n)),
+        'low': np.minimum(open_, close) * (1 - rng.uniform(0, 0.003, n)),
+        'close': close,
+        'volume': rng.uniform(1e5, 1e6, n),
+    }, index=index)
+
+
+def recorded_ohlcv(days):
+    ''' Last "days" of cached 5m candles, or None if the data cache does not hold that many'''
+    records = BinanceFuturesData.load_cache(SYMBOL, '5m')
+    if len(records) < days * 288:
+        return None
+    return BinanceFuturesData._to_frame(records[-days * 288:])
+
+
+def date_range(data):
+    ''' Naive UTC start and end dates of a fixture, like the settings in main.py'''
+    return data.index[0].tz_localize(None).to_pydatetime(), data.index[-1].tz_localize(None).to_pydatetime()
+
+
+def peak_rss_mb(who):
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10  # bytes on macOS, KB elsewhere
+
+
+def init_quiet_worker(*args):
+    ''' init_worker for the pool cases, the evaluate prints would flood the report'''
+    sys.stdout = open(os.devnull, 'w')
+    optimizer_01.init_worker(*args)
+
+
+def run_case(case, data, repeat, results):
+    ''' Child process: time one case and put its measurements in "results"'''
+    start_date, end_date = date_range(data)
+    precomputed = case['mode'] != 'replay'
+    vectorized = case['mode'] == 'vectorized'
+    timings = []
+
+    if case['kind'] == 'generation':
+        random.seed(42)
+        population = [list(optimizer_01.toolbox.individual()) for _ in range(case['population'])]
+        shm = optimizer_01.publish_data(data)
+        pool = multiprocessing.get_context('spawn').Pool(
+            case['pool'], initializer=init_quiet_worker,
+            initargs=(shm.name, len(data), start_date, end_date, bt.TimeFrame.Minutes, 5, precomputed, vectorized))
+        try:
+            pool.map(abs, range(case['pool']))  # wait until every worker is up
+            for _ in range(repeat):
+                started = time.perf_counter()
+                pool.map(optimizer_01.evaluate_worker, population)
+                timings.append(time.perf_counter() - started)
+        finally:
+            pool.close()
+            pool.join()
+            shm.close()
+            shm.unlink()
+        evals = len(population)
+        bars = len(data) * evals
+    elif case['kind'] == 'live':
+        from live_runner import CANDLE_MS, SignalEngine, closed_candles, load_params
+        rows = closed_candles(data)
+        timed = rows[-288:]  # the last day, after a full window of candles
+        for _ in range(repeat):
+            engine = SignalEngine(load_params())
+            engine.warm_up(rows[:-len(timed)])
+            started = time.perf_counter()
+            for row in timed:
+                engine.add(row)
+            timings.append(time.perf_counter() - started)
+        evals = bars = len(timed)  # one candle per signal evaluation
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(repeat):
+                started = time.perf_counter()
+                if case['kind'] == 'backtest':
+                    optimizer_01.run_backtest(*DEFAULT_PARAMS, data, start_date, end_date, bt.TimeFrame.Minutes, 5,
+                                              precomputed=precomputed)
+                else:
+                    optimizer_01.evaluate(DEFAULT_PARAMS, data, start_date, end_date, bt.TimeFrame.Minutes, 5,
+                                          precomputed=precomputed, vectorized=vectorized)
+                timings.append(time.perf_counter() - started)
+        evals = 1
+        bars = len(data)
+
+    seconds = min(timings)
+    extra = {}
+    if case['kind'] == 'live':
+        extra['ms_per_candle'] = 1000 * seconds / evals
+        extra['interval_share'] = seconds / evals / (CANDLE_MS / 1000)
+    results.put(dict(
+        extra,
+        seconds=seconds,
+        bars_per_sec=bars / seconds,
+        evals_per_sec=evals / seconds,
+        peak_rss_mb=peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        workers_peak_rss_mb=peak_rss_mb(resource.RUSAGE_CHILDREN) if resource and case['kind'] == 'generation' else None,
+    ))
+
+
+def wait_case(process, results, timeout):
+    ''' Result of a case process, or (None, reason) if it exits without one or runs longer than "timeout"'''
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = results.get(timeout=1.0)
+            process.join()
+            return result, None
+        except Empty:
+            pass
+        if not process.is_alive():
+            try:
+                return results.get(timeout=1.0), None  # put just before exiting
+            except Empty:
+                return None, f"the case process exited with code {process.exitcode}"
+        if time.monotonic() > deadline:
+            process.terminate()
+            process.join()
+            return None, f"timed out after {timeout:.0f} s"
+
+
+def build_cases(args):
+    cases = []
+    for source in ('synthetic', 'recorded') if args.recorded else ('synthetic',):
+        for days in args.days:
+            for mode in args.modes:
+                if mode != 'vectorized':  # run_backtest is the Cerebro run only
+                    cases.append(dict(kind='backtest', mode=mode, source=source, days=days))
+                cases.append(dict(kind='evaluate', mode=mode, source=source, days=days))
+        for pool in args.pools:
+            cases.append(dict(kind='generation', mode=args.generation_mode, source=source, days=args.generation_days,
+                              pool=pool, population=args.population))
+        if args.live_days:
+            cases.append(dict(kind='live', mode='signals', source=source, days=args.live_days))
+    for case in cases:
+        case['name'] = ':'.join(str(case[key]) for key in ('kind', 'mode', 'source', 'days', 'pool') if key in case)
+    return cases
+
+
+def compare(results, baseline, tolerance):
+    ''' Throughput of every case against the baseline, returns the names of the cases slower than tolerance allows'''
+    regressions = []
+    for name, result in results.items():
+        metric = 'bars_per_sec' if name.startswith('backtest') else 'evals_per_sec'
+        if name not in baseline:
+            result['vs_baseline'] = None
+            continue
+        ratio = result[metric] / baseline[name][metric]
+        result['vs_baseline'] = ratio
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def print_report(results, regressions):
+    print(f"{'case':<42} {'seconds':>9} {'bars/s':>10} {'evals/s':>9} {'RSS MB':>8} {'workers MB':>10} {'vs base':>8}")
+    for name, r in results.items():
+        rss = f"{r['peak_rss_mb']:.0f}" if r['peak_rss_mb'] is not None else '?'
+        workers = f"{r['workers_peak_rss_mb']:.0f}" if r['workers_peak_rss_mb'] is not None else '-'
+        ratio = f"{r['vs_baseline']:.2f}x" if r.get('vs_baseline') is not None else '-'
+        flag = '  REGRESSION' if name in regressions else ''
+        print(f"{name:<42} {r['seconds']:>9.3f} {r['bars_per_sec']:>10.0f} {r['evals_per_sec']:>9.2f} {rss:>8} "
+              f"{workers:>10} {ratio:>8}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark backtest and optimizer throughput.')
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 10, 60], help='Fixture lengths in days')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES, help='Backtest modes')
+    parser.add_argument('--pools', type=int, nargs='+', default=[1, 2, 4], help='Pool sizes of the GA generation')
+    parser.add_argument('--population', type=int, default=16, help='Individuals in the GA generation')
+    parser.add_argument('--generation-days', type=int, default=10, help='Fixture length of the GA generation')
+    parser.add_argument('--generation-mode', default='precomputed', choices=MODES, help='Mode of the GA generation')
+    parser.add_argument('--live-days', type=int, default=12,
+                        help='Fixture length of the live signal case, the last day is timed (0 = skip)')
+    parser.add_argument('--recorded', action='store_true', help='Also run on the cached GMTUSDT candles')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case, the fastest one counts')
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='Baseline results file')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed throughput loss before a regression')
+    parser.add_argument('--output', default='benchmark_results.json', help='Results file')
+    parser.add_argument('--timeout', type=float, default=3600, help='Seconds a case may run before it fails')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    fixtures = {}
+    results = {}
+    failures = {}  # case name: why it has no result
+    for case in build_cases(args):
+        key = (case['source'], case['days'])
+        if key not in fixtures:
+            fixtures[key] = synthetic_ohlcv(case['days']) if case['source'] == 'synthetic' else recorded_ohlcv(case['days'])
+        if fixtures[key] is None:
+            # --recorded asks for these cases, they fail instead of being left out of the report
+            failures[case['name']] = f"the data cache holds less than {case['days']} days of {SYMBOL} 5m candles"
+            print(f"{case['name']}: FAILED, {failures[case['name']]}")
+            continue
+
+        queue = ctx.Queue()
+        process = ctx.Process(target=run_case, args=(case, fixtures[key], args.repeat, queue))
+        process.start()
+        result, error = wait_case(process, queue, args.timeout)
+        if error is not None:
+            failures[case['name']] = error
+            print(f"{case['name']}: FAILED, {error}")
+            continue
+        results[case['name']] = result
+        print(f"{case['name']}: {result['seconds']:.3f} s")
+        if 'ms_per_candle' in result:
+            print(f"  {result['ms_per_candle']:.1f} ms per candle, {result['interval_share']:.3%} of the candle interval")
+
+    baseline = {}
+    if os.path.isfile(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if args.recorded and not args.save_baseline:
+        # Recorded candles differ from machine to machine, a recorded case is only useful against a baseline
+        for name in results:
+            if ':recorded:' in name and name not in baseline:
+                failures[name] = f"no baseline in {args.baseline}, run with --recorded --save-baseline first"
+    print()
+    print_report(results, regressions)
+    for name, error in failures.items():
+        print(f"{name:<42} FAILED: {error}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}")
+    if failures:
+        print(f"{len(failures)} case(s) failed")
+    if regressions or failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
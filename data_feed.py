@@ -1,38 +1,244 @@
 # data_feed.py
 
+import json
+import os
+import tempfile
+import threading
+import time
 import ccxt
+import numpy as np
 import pandas as pd
 import backtrader as bt
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import pytz
 
+timeframe_minutes = {
+        '1m': 1,
+        '3m': 3,
+        '5m': 5,
+        '15m': 15,
+        '30m': 30,
+        '1h': 60,
+        '2h': 120,
+        '4h': 240,
+        '1d': 1440,
+    }
+
+# Layout of the local OHLCV cache: one record per candle, 'datetime' is the open time in ms (UTC)
+CACHE_DTYPE = np.dtype([
+    ('datetime', 'i8'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('volume', 'f8'),
+])
+
+# Candles per request in the concurrent download mode, and the request weight Binance charges for it
+PAGE_LIMIT = 1000
+PAGE_WEIGHT = 5
+
+
+class RateLimiter:
+    ''' Thread-safe limiter that spaces request starts at least "interval" seconds apart'''
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class CandleBuffer:
+    ''' Growing NumPy buffer of candle records.
+    Rows are only accepted if their timestamp is past the last stored one, so pages that
+    overlap or repeat candles are deduplicated without sorting.'''
+    def __init__(self, capacity=PAGE_LIMIT):
+        self.records = np.empty(max(capacity, 1), dtype=CACHE_DTYPE)
+        self.size = 0
+
+    def _reserve(self, count):
+        if self.size + count > len(self.records):
+            records = np.empty(max(2 * len(self.records), self.size + count), dtype=CACHE_DTYPE)
+            records[:self.size] = self.records[:self.size]
+            self.records = records
+
+    def _keep(self, timestamps):
+        last = self.records['datetime'][self.size - 1] if self.size else np.iinfo(np.int64).min
+        previous = np.maximum.accumulate(np.concatenate(([last], timestamps[:-1])))
+        return timestamps > previous
+
+    def append(self, ohlcv):
+        ''' Append raw fetch_ohlcv rows: [timestamp ms, open, high, low, close, volume]'''
+        if len(ohlcv) == 0:
+            return
+        page = np.asarray(ohlcv, dtype=np.float64)
+        timestamps = page[:, 0].astype(np.int64)
+        keep = self._keep(timestamps)
+        count = int(keep.sum())
+        self._reserve(count)
+        rows = self.records[self.size:self.size + count]
+        rows['datetime'] = timestamps[keep]
+        for column, name in enumerate(CACHE_DTYPE.names[1:], start=1):
+            rows[name] = page[keep, column]
+        self.size += count
+
+    def append_records(self, records):
+        if len(records) == 0:
+            return
+        keep = self._keep(np.asarray(records['datetime']))
+        count = int(keep.sum())
+        self._reserve(count)
+        self.records[self.size:self.size + count] = records[keep]
+        self.size += count
+
+    def view(self):
+        return self.records[:self.size]
+
+
 class BinanceFuturesData(bt.feeds.PandasData):
+    # Directory for the per (symbol, timeframe) candle store
+    cache_dir = 'data_cache'
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     @classmethod
-    def fetch_data(cls, symbol, startdate, enddate, binance_timeframe):
-        exchange = ccxt.binanceusdm({
-            'rateLimit': 1200,
-            'enableRateLimit': True,
-        })
+    def cache_path(cls, symbol, binance_timeframe):
+        symbol_name = symbol.replace('/', '_')
+        return os.path.join(cls.cache_dir, f'{symbol_name}_{binance_timeframe}.npy')
+
+    @classmethod
+    def load_cache(cls, symbol, binance_timeframe):
+        ''' Memory-map the cached candles, or return an empty array if there is no cache yet'''
+        path = cls.cache_path(symbol, binance_timeframe)
+        if not os.path.isfile(path):
+            return np.empty(0, dtype=CACHE_DTYPE)
+        return np.load(path, mmap_mode='r')
+
+    @classmethod
+    def save_cache(cls, symbol, binance_timeframe, records):
+        path = cls.cache_path(symbol, binance_timeframe)
+        cls._write_file(path, 'wb', lambda f: np.save(f, records))
+
+    @classmethod
+    def load_meta(cls, symbol, binance_timeframe):
+        ''' Metadata of the cached candles: "first" (open time of the first cached candle, ms) and
+        "checked_from" (the exchange has no candle from this time up to "first"). Empty if there is none.'''
+        path = os.path.splitext(cls.cache_path(symbol, binance_timeframe))[0] + '.json'
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @classmethod
+    def save_meta(cls, symbol, binance_timeframe, meta):
+        path = os.path.splitext(cls.cache_path(symbol, binance_timeframe))[0] + '.json'
+        cls._write_file(path, 'w', lambda f: json.dump(meta, f))
+
+    @classmethod
+    def _write_file(cls, path, mode, write):
+        os.makedirs(cls.cache_dir, exist_ok=True)
+        # Write to a temporary file of this process first, so an interrupted run never leaves a broken cache and
+        # workers saving the same cache at once (distributed.py --processes, a shared cache_dir) do not collide
+        fd, tmp_path = tempfile.mkstemp(dir=cls.cache_dir, prefix=os.path.basename(path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _create_exchange(concurrent=False):
+        if concurrent:
+            # Requests are throttled by our own RateLimiter using the exchange's published rate limit
+            exchange = ccxt.binanceusdm({
+                'enableRateLimit': False,
+            })
+        else:
+            exchange = ccxt.binanceusdm({
+                'rateLimit': 1200,
+                'enableRateLimit': True,
+            })
         exchange.load_markets()
+        return exchange
 
+    @staticmethod
+    def _download(exchange, symbol, binance_timeframe, since, until):
+        ''' Page through fetch_ohlcv from "since" until "until" (both in ms) and return the candles as records'''
+        buffer = CandleBuffer()
+
+        while True:
+            ohlcv = exchange.fetch_ohlcv(
+                symbol,
+                timeframe=binance_timeframe,
+                since=since,
+                limit=None,
+            )
+
+            if len(ohlcv) == 0:
+                break
+
+            buffer.append(ohlcv)
+
+            since = int(ohlcv[-1][0]) + timeframe_minutes[binance_timeframe] * 60 * 1000
+
+            if since > until:
+                break
+
+        return buffer.view()
+
+    @staticmethod
+    def _download_concurrent(exchange, symbol, binance_timeframe, since, until, max_workers):
+        ''' Split [since, until] into page-sized slices up front and fetch them with a pool of threads'''
+        step = timeframe_minutes[binance_timeframe] * 60 * 1000
+        slices = [(start, min(PAGE_LIMIT, (until - start) // step + 1))
+                  for start in range(since, until + 1, PAGE_LIMIT * step)]
+        limiter = RateLimiter(exchange.rateLimit * PAGE_WEIGHT / 1000)
+
+        def fetch_slice(page):
+            start, limit = page
+            limiter.wait()
+            return exchange.fetch_ohlcv(symbol, timeframe=binance_timeframe, since=start, limit=limit)
+
+        buffer = CandleBuffer(capacity=len(slices) * PAGE_LIMIT)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for ohlcv in executor.map(fetch_slice, slices):  # map keeps the slices in time order
+                buffer.append(ohlcv)
+
+        return buffer.view()
+
+    @staticmethod
+    def _merge(*parts):
+        ''' Join candle records that are already in time order, dropping overlapping timestamps'''
+        buffer = CandleBuffer(capacity=sum(len(part) for part in parts))
+        for part in parts:
+            buffer.append_records(part)
+        return buffer.view()
+
+    @staticmethod
+    def _to_frame(records):
+        df = pd.DataFrame({name: np.array(records[name]) for name in CACHE_DTYPE.names[1:]},
+                          index=pd.to_datetime(np.array(records['datetime']), unit='ms', utc=True))
+        df.index.name = 'datetime'
+        return df
+
+    @classmethod
+    def fetch_data(cls, symbol, startdate, enddate, binance_timeframe, use_cache=True, concurrent=False, max_workers=4):
         if enddate is None:
             enddate = datetime.now()
 
-        timeframe_minutes = {
-                '1m': 1,
-                '3m': 3,
-                '5m': 5,
-                '15m': 15,
-                '30m': 30,
-                '1h': 60,
-                '2h': 120,
-                '4h': 240,
-                '1d': 1440,
-            }
-
         # Convert startdate and enddate to timezone-aware datetime objects, if they aren't already
         if not pd.to_datetime(startdate).tzinfo:
             startdate = pd.to_datetime(startdate).tz_localize('UTC')
@@ -44,35 +250,56 @@ class BinanceFuturesData(bt.feeds.PandasData):
         else:
             enddate = pd.to_datetime(enddate)
 
-        timeframe_str = binance_timeframe
-        all_data = []
+        start_ms = int(startdate.timestamp() * 1000)
+        end_ms = int(enddate.timestamp() * 1000)
+        step = timeframe_minutes[binance_timeframe] * 60 * 1000
 
-        start_date = startdate  # Use the timezone-aware startdate
+        cached = cls.load_cache(symbol, binance_timeframe) if use_cache else np.empty(0, dtype=CACHE_DTYPE)
+        meta = cls.load_meta(symbol, binance_timeframe) if use_cache else {}
 
-        while True:
-            since = int(start_date.timestamp() * 1000)
-            ohlcv = exchange.fetch_ohlcv(
-                symbol,
-                timeframe=timeframe_str,
-                since=since,
-                limit=None,
-            )
+        # Only the ranges that are not in the cache yet are requested from the exchange
+        head, tail = None, None
+        if len(cached) == 0:
+            tail = (start_ms, end_ms)
+        else:
+            first, last = int(cached['datetime'][0]), int(cached['datetime'][-1])
+            # A start before the symbol's first candle was already requested: nothing to fetch before "first"
+            checked_from = meta.get('checked_from', first) if meta.get('first') == first else first
+            if start_ms < checked_from:
+                head = (start_ms, first - step)
+            if end_ms > last:
+                tail = (last + step, end_ms)
 
-            if len(ohlcv) == 0:
-                break
+        if head or tail:
+            exchange = cls._create_exchange(concurrent)
 
-            df = pd.DataFrame(ohlcv, columns=['datetime', 'open', 'high', 'low', 'close', 'volume'])
-            df['datetime'] = pd.to_datetime(df['datetime'], unit='ms', utc=True)
-            df.set_index('datetime', inplace=True)
-            all_data.append(df)
+            def download(since, until):
+                if concurrent:
+                    return cls._download_concurrent(exchange, symbol, binance_timeframe, since, until, max_workers)
+                return cls._download(exchange, symbol, binance_timeframe, since, until)
 
-            start_date = df.index[-1] + pd.Timedelta(minutes=timeframe_minutes[timeframe_str])
+            # Parts are merged in time order: head, cached candles, tail
+            parts = [download(*head) if head else cached[:0], cached, download(*tail) if tail else cached[:0]]
+            records = cls._merge(*parts)
+            from_start = head is not None or len(cached) == 0  # start_ms was requested from the exchange
+            del cached, parts  # release the memory map before the cache file is replaced
 
-            if start_date > enddate:  # Use the timezone-aware enddate
-                break
+            if use_cache:
+                # Never store the candle that is still open, it would be frozen in the cache
+                now_ms = int(datetime.now(tz=pytz.utc).timestamp() * 1000)
+                closed = records[records['datetime'] + step <= now_ms]
+                if len(closed):
+                    cls.save_cache(symbol, binance_timeframe, closed)
+                    # The download from start_ms returns the candles from start_ms on, there is none before
+                    # the first one it got
+                    if from_start:
+                        cls.save_meta(symbol, binance_timeframe,
+                                      dict(first=int(closed['datetime'][0]), checked_from=start_ms))
+        else:
+            records = cached
 
-        df = pd.concat(all_data).sort_index()
-        df = df.loc[startdate:enddate]  # Use the timezone-aware startdate and enddate for slicing
-        df = df[~df.index.duplicated(keep='first')]  # Drop potential duplicates
-        
-        return df
+        # Use the timezone-aware startdate and enddate for slicing
+        lo = np.searchsorted(records['datetime'], start_ms, side='left')
+        hi = np.searchsorted(records['datetime'], end_ms, side='right')
+
+        return cls._to_frame(records[lo:hi])
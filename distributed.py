@@ -0,0 +1,255 @@
+# distributed.py
+# Runs the optimizer's backtests on worker processes of other hosts.
+# The optimizer (coordinator) listens on a TCP port with a RemotePool, workers connect to it:
+#
+#   GMT_REMOTE_AUTHKEY=<secret> python distributed.py --connect 192.168.1.10:6000 --processes 8 --cache_dir /mnt/shared/data_cache
+#
+# Every worker runs the pool initializer once per optimization (optimizer_01.init_remote_worker: the first
+# process of a host loads the candles from its data cache into shared memory, the others attach to it), then
+# evaluates one parameter vector at a time. Connections are authenticated
+# with a shared key, the messages are pickled (multiprocessing.connection), so anyone holding the key can run
+# code on the coordinator and the workers: there is no default key, and the coordinator only listens on
+# localhost unless it is given a host.
+
+import argparse
+import os
+import queue
+import threading
+import time
+import traceback
+import multiprocessing
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+# Set by run_worker: lock of the worker processes of this host, so the first one loads the data for the others
+host_state = {}
+
+AUTHKEY_ENV = 'GMT_REMOTE_AUTHKEY'  # environment variable holding the shared key
+DEFAULT_HOST = '127.0.0.1'  # interface the coordinator listens on when it is only given a port
+
+
+class RemoteJob:
+    ''' Results of one RemotePool.map or apply_async call, filled in by the worker connections'''
+    def __init__(self, size, callback=None, error_callback=None):
+        self.results = [None] * size
+        self.remaining = size
+        self.errors = []
+        self.callback = callback
+        self.error_callback = error_callback
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if not size:
+            self.finished.set()
+
+    def done(self, index, result=None, error=None):
+        with self.lock:
+            if error is not None:
+                self.errors.append(error)
+            else:
+                self.results[index] = result
+            self.remaining -= 1
+            if self.remaining:
+                return
+        if self.errors:
+            if self.error_callback is not None:
+                self.error_callback(RuntimeError(f"Remote task failed:\n{self.errors[0]}"))
+        elif self.callback is not None:
+            self.callback(self.results[0])
+        self.finished.set()
+
+
+class RemotePool:
+    ''' Stand-in for multiprocessing.Pool whose map() runs the tasks on the workers connected over TCP.
+    "address" is (host, port), or a port to listen on DEFAULT_HOST only.
+    A worker that drops out mid-generation puts its task back in the queue for the others, map() fails once
+    no worker has been connected for "worker_timeout" seconds.'''
+    def __init__(self, address, authkey, initializer=None, initargs=(), worker_timeout=600):
+        if not authkey:
+            raise ValueError(f"RemotePool needs an authkey (e.g. from ${AUTHKEY_ENV}), workers run what it sends")
+        self.address = (DEFAULT_HOST, address) if isinstance(address, int) else tuple(address)
+        self.listener = Listener(self.address, authkey=authkey)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.worker_timeout = worker_timeout
+        self.tasks = queue.Queue()
+        self.workers = 0
+        self.idle_since = time.monotonic()  # when the last worker left (or the pool started)
+        self.lock = threading.Lock()
+        self.closed = False
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while not self.closed:
+            try:
+                conn = self.listener.accept()
+                peer = self.listener.last_accepted
+            except AuthenticationError as e:
+                print(f"Rejected worker connection: {e}")
+                continue
+            except (OSError, AttributeError):
+                break  # listener closed
+            threading.Thread(target=self._serve, args=(conn, peer), daemon=True).start()
+
+    def _serve(self, conn, peer):
+        ''' Feed tasks to one worker until it disconnects or the pool is closed'''
+        try:
+            conn.send(('init', self.initializer, self.initargs))
+            status = conn.recv()
+        except (EOFError, OSError) as e:
+            print(f"Worker {peer} dropped during initialization: {e}")
+            conn.close()
+            return
+        if status[0] != 'ready':
+            print(f"Worker {peer} failed to initialize:\n{status[1]}")
+            conn.close()
+            return
+
+        with self.lock:
+            self.workers += 1
+            print(f"Worker {peer} connected ({self.workers} workers)")
+        try:
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    break  # pool closed
+                job, index, func, args = task
+                try:
+                    conn.send(('task', func, args))
+                    status, value = conn.recv()
+                except (EOFError, OSError) as e:
+                    print(f"Worker {peer} dropped ({type(e).__name__}), its task goes back to the queue")
+                    self.tasks.put(task)  # another worker picks it up
+                    break
+                if status == 'result':
+                    job.done(index, result=value)
+                else:
+                    job.done(index, error=value)
+        finally:
+            with self.lock:
+                self.workers -= 1
+                if not self.workers:
+                    self.idle_since = time.monotonic()
+            conn.close()
+
+    def map(self, func, iterable):
+        items = list(iterable)
+        job = RemoteJob(len(items))
+        for index, item in enumerate(items):
+            self.tasks.put((job, index, func, (item,)))
+        if items and not self.workers:
+            print(f"Waiting for workers on {self.address}")
+        while not job.finished.wait(1.0):
+            with self.lock:
+                idle = 0.0 if self.workers else time.monotonic() - self.idle_since
+            if idle > self.worker_timeout:
+                self._discard(job)
+                raise RuntimeError(f"No worker connected to {self.address} for {self.worker_timeout} s, "
+                                   f"{job.remaining} of {len(items)} task(s) left")
+        if job.errors:
+            raise RuntimeError(f"{len(job.errors)} remote task(s) failed, first error:\n{job.errors[0]}")
+        return job.results
+
+    def _discard(self, job):
+        ''' Take the tasks of "job" out of the queue, so workers that connect later do not run them'''
+        kept = []
+        while True:
+            try:
+                task = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is None or task[0] is not job:
+                kept.append(task)
+        for task in kept:
+            self.tasks.put(task)
+
+    def apply_async(self, func, args=(), callback=None, error_callback=None):
+        ''' Queue func(*args) for the next free worker, the callbacks run in that worker's connection thread'''
+        job = RemoteJob(1, callback, error_callback)
+        self.tasks.put((job, 0, func, args))
+        return job
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            workers = self.workers
+        for _ in range(workers):
+            self.tasks.put(None)
+        self.listener.close()
+
+    def join(self):
+        pass
+
+
+def host_lock():
+    ''' Lock shared by the worker processes of this host, None outside run_worker'''
+    return host_state.get('lock')
+
+
+def serve(address, authkey):
+    ''' One optimization: initialize, then evaluate tasks until the coordinator closes the connection.
+    Returns False if the initializer failed.'''
+    conn = Client(address, authkey=authkey)
+    try:
+        _, initializer, initargs = conn.recv()
+        try:
+            if initializer is not None:
+                initializer(*initargs)
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+            return False
+        conn.send(('ready', None))
+
+        while True:
+            try:
+                _, func, args = conn.recv()
+            except EOFError:
+                break  # optimization finished
+            try:
+                conn.send(('result', func(*args)))
+            except Exception:
+                conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+    return True
+
+
+def run_worker(address, authkey, cache_dir=None, retry_interval=5, lock=None):
+    ''' Keep serving the coordinator at "address", reconnecting for every new optimization.
+    "lock" is shared by the worker processes of this host (see host_lock).'''
+    host_state['lock'] = lock
+    if cache_dir:
+        from data_feed import BinanceFuturesData
+        BinanceFuturesData.cache_dir = cache_dir
+    while True:
+        try:
+            if not serve(address, authkey):
+                # The coordinator keeps running without this worker: wait before trying its initializer again
+                time.sleep(retry_interval)
+        except (OSError, EOFError):
+            time.sleep(retry_interval)  # coordinator not started yet or gone
+        except AuthenticationError as e:
+            print(f"Coordinator rejected the authkey: {e}")
+            return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run optimizer backtests for a remote coordinator.')
+    parser.add_argument('--connect', required=True, help='Coordinator address in HOST:PORT format')
+    parser.add_argument('--authkey', default=os.environ.get(AUTHKEY_ENV),
+                        help=f'Shared secret of the coordinator (default: ${AUTHKEY_ENV})')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help='Worker processes')
+    parser.add_argument('--cache_dir', help='Candle cache directory, e.g. on a shared drive')
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error(f"no authkey: set ${AUTHKEY_ENV} or pass --authkey, the same key as the coordinator's")
+
+    host, port = args.connect.rsplit(':', 1)
+    # The workers share the data block one of them publishes: start the resource tracker here so they all use
+    # this one and the block is only released when the last worker process has ended
+    resource_tracker.ensure_running()
+    worker_args = ((host, int(port)), args.authkey.encode(), args.cache_dir, 5, multiprocessing.Lock())
+    processes = [multiprocessing.Process(target=run_worker, args=worker_args) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -1,14 +1,57 @@
 # indicators\heikin_patterns_01.py
 
 import backtrader as bt
+import numpy as np
+from indicators.registry import shared_indicator
 from matplotlib.pyplot import plot
 
+
+def pattern_signals(o, h, l, c, o1, h1, l1, c1, o2, c2):
+    ''' Buy, sell, stop buy and stop sell signals of HeikinPatterns from the Heikin Ashi open/high/low/close
+    of the bar, the previous bar (o1, h1, l1, c1) and the one before (o2, c2).
+    Takes NumPy arrays (every bar at once, see precompute.heikin_patterns) or NumPy scalars (one bar in next).
+    The pattern methods ignore their "index" argument, so every pattern looks at the current bar.'''
+    green, red = c > o, c < o
+    falling_star = red & (o - l > 2 * (c - o)) & ((c - l) < (h - c))
+    bullish_engulfing = (c > o1) & (o < c1) & (c > (o + (o1 - c1)))
+    bearish_engulfing = (c < o1) & (o > c1) & (c < (o - (c1 - o1)))
+    bullish_harami = (o1 > c1) & (o < c) & (c <= o1) & (c1 <= o) & ((c - o) < (o1 - c1))
+    bearish_harami = (o1 < c1) & (o > c) & (c1 >= o) & (c >= o1) & ((o - c) > (c1 - o1))
+    bullish_hammer = green & (c > (h + l) / 2) & ((h - l) > 2 * (o - c)) & ((c - o) <= 0.2 * (h - l))
+    bearish_hanging_man = red & (c < (h + l) / 2) & ((h - l) >= 2 * (o - c)) & ((o - c) <= 0.1 * (h - l))
+    inside_bar = (h < h1) & (l > l1)
+    doji = abs(c - o) <= 0.1 * (h - l)
+    morning_star = (c2 < o2) & (c1 < o1) & green & (c > c2) & (o < o2)
+    evening_star = (c2 > o2) & (c1 > o1) & red & (c < c2) & (o > o2)
+    higher, lower = (h > h1) & (l > l1), (h < h1) & (l < l1)
+
+    bullish_pattern = bullish_engulfing | bullish_hammer | bullish_harami | morning_star
+    bearish_pattern = bearish_engulfing | bearish_hanging_man | evening_star | bearish_harami
+
+    pattern_buy1 = (bullish_hammer | morning_star | bullish_harami) & bullish_engulfing
+    pattern_buy2 = (green & bullish_engulfing) & (bullish_hammer | bullish_harami | morning_star)
+    pattern_sell2 = (red & ((bearish_engulfing | bearish_hanging_man | bearish_harami) &
+                            (falling_star | evening_star))) & ~inside_bar
+    buy_signal = (pattern_buy2 | pattern_buy1) & ~bearish_pattern
+    sell_signal = pattern_sell2 & ~bullish_pattern
+
+    stop_buy = (red & (bearish_engulfing | bearish_harami | bearish_hanging_man) & doji) & \
+               (red & (lower | doji) & evening_star)
+    stop_sell = (green & (bullish_engulfing | bullish_harami | bullish_hammer) & doji) & \
+                (green & (higher | doji) & morning_star)
+    stop_buy_signal = stop_buy & ~(bullish_pattern | buy_signal)
+    stop_sell_signal = stop_sell & ~(bearish_pattern | sell_signal)
+    return buy_signal, sell_signal, stop_buy_signal, stop_sell_signal
+
+
 class HeikinPatterns(bt.Indicator): 
     lines = ('signal', 'stop_signal',)   
+    # fast: one pattern_signals pass over the last three bars per next, instead of the pattern methods below
+    params = (('fast', True),)
         
     def __init__(self):
         
-        self.ha = bt.indicators.HeikinAshi(self.data, plot=False)
+        self.ha = shared_indicator(self, bt.indicators.HeikinAshi, self.data, plot=False)
         
         self.ha_close = self.ha.lines.ha_close
         self.ha_open = self.ha.lines.ha_open
@@ -257,6 +300,16 @@ class HeikinPatterns(bt.Indicator):
     def next(self):
         if len(self.data) < 5:
             return      
+        if self.p.fast:
+            o, h, l, c = self.ha_open, self.ha_high, self.ha_low, self.ha_close
+            buy, sell, stop_buy, stop_sell = pattern_signals(
+                np.float64(o[0]), np.float64(h[0]), np.float64(l[0]), np.float64(c[0]),
+                np.float64(o[-1]), np.float64(h[-1]), np.float64(l[-1]), np.float64(c[-1]),
+                np.float64(o[-2]), np.float64(c[-2]))
+            self.lines.signal[0] = 1 if buy else -1 if sell else 0
+            self.lines.stop_signal[0] = 1 if stop_buy else -1 if stop_sell else 0
+            return
+
         if self.pattern_buy_signal() == 1:
             self.lines.signal[0] = 1
         elif self.pattern_sell_signal() == 1:
@@ -1,5 +1,6 @@
 import backtrader as bt
 import talib
+from indicators.registry import shared_indicator
 
 class MovAverages(bt.Indicator):
     lines = ('signal', 'stop_signal',)
@@ -15,8 +16,8 @@ class MovAverages(bt.Indicator):
 
     def __init__(self):
         # EMAs signals
-        self.fma = bt.talib.EMA(self.data, timeperiod=self.params.fast_ema, plot=False)
-        self.sma = bt.talib.EMA(self.data, timeperiod=self.params.slow_ema, plot=False)
+        self.fma = shared_indicator(self, bt.talib.EMA, self.data, timeperiod=self.params.fast_ema, plot=False)
+        self.sma = shared_indicator(self, bt.talib.EMA, self.data, timeperiod=self.params.slow_ema, plot=False)
 
         self.ema2_cross = bt.ind.CrossOver(self.fma, self.sma, plot=False)
         self.ema_cross = bt.ind.CrossOver(self.data, self.sma, plot=False)
@@ -28,7 +29,7 @@ class MovAverages(bt.Indicator):
         self.ema_sell = bt.Or(self.ema_sell1, self.ema_sell2)
         
         # Hull moving average
-        self.hma = bt.indicators.HullMovingAverage(self.data, period=self.params.hma_length).lines.hma        
+        self.hma = shared_indicator(self, bt.indicators.HullMovingAverage, self.data, period=self.params.hma_length).lines.hma
         self.hma_cross = bt.ind.CrossOver(self.data, self.hma, plot=False)
         self.hma_cross.plotinfo.plotname = 'HMA cross'
         self.hma_buy1 = (self.hma_cross == 1)
@@ -40,7 +41,7 @@ class MovAverages(bt.Indicator):
         # self.hmo_sell1 = (self.hmo.hma < 0.0)
 
         # Dickson Moving Average
-        self.dma = bt.indicators.DMA(self.data, 
+        self.dma = shared_indicator(self, bt.indicators.DMA, self.data, 
                                      period=self.params.dma_period, 
                                      gainlimit=self.params.dma_gainlimit, 
                                      hperiod=self.params.dma_hperiod, 
@@ -60,7 +61,7 @@ class MovAverages(bt.Indicator):
         
 
         # KAMA
-        self.kama = bt.talib.KAMA(self.data, timeperiod=self.params.kama_period)
+        self.kama = shared_indicator(self, bt.talib.KAMA, self.data, timeperiod=self.params.kama_period)
         self.kama_cross = bt.ind.CrossOver(self.data, self.kama.real, plot=False)
 
         self.kama_buy1 =  (self.kama_cross == 1)
@@ -1,61 +1,131 @@
+import math
+from datetime import datetime, time, timedelta
+import numpy as np
 import backtrader as bt
+from indicators.registry import shared_indicator
+
+
+def pivot_levels(high, low, close):
+    ''' Floor pivot levels pp, s1, s2, r1, r2 of a day's high, low and close (floats or arrays)'''
+    pp = (high + low + close) / 3
+    return pp, 2.0 * pp - high, pp - (high - low), 2.0 * pp - low, pp + (high - low)
+
+
+def day_numbers(datetimes, tz=None):
+    ''' Integer day of every backtrader datetime number, in the timezone "tz" (UTC if None)'''
+    if tz is None:
+        return np.floor(datetimes).astype(np.int64)
+    return np.array([bt.num2date(dt, tz=tz).toordinal() for dt in datetimes], dtype=np.int64)
+
+
+def pivot_lines(days, high, low, close, calls=None):
+    ''' Batch mode of MyPivotPoint: the pp, s1, s2, r1, r2 lines for every bar from the day number of each bar.
+    "calls" is how many times the indicator runs on each bar (once per base candle in a replay, 1 if None).
+    MyPivotPoint sets new levels on the first call of a day and keeps the previous bar's levels on every
+    other call, so the levels of a day only survive when its first bar gets a single call.
+    On the very first call the levels come from that bar alone.'''
+    length = len(close)
+    lines = [np.full(length, np.nan) for _ in range(5)]
+    first = 1  # the indicator starts on the second bar
+    if length > first:
+        starts = np.flatnonzero(np.r_[True, days[first + 1:] != days[first:-1]]) + first
+        day_high = np.maximum.reduceat(high[first:], starts - first)
+        day_low = np.minimum.reduceat(low[first:], starts - first)
+        day_close = close[np.r_[starts[1:], length] - 1]
+
+        levels = pivot_levels(np.r_[high[first], day_high[:-1]],
+                              np.r_[low[first], day_low[:-1]],
+                              np.r_[close[first], day_close[:-1]])
+
+        kept = calls[starts] == 1 if calls is not None else np.ones(len(starts), dtype=bool)
+        marks = np.zeros(length, dtype=np.int64)
+        marks[starts[kept]] = np.flatnonzero(kept) + 1
+        day_index = np.maximum.accumulate(marks) - 1  # last day whose levels were kept, -1 for none
+        set_bars = day_index >= 0
+        for line, level in zip(lines, levels):
+            line[set_bars] = level[day_index[set_bars]]
+    return lines
 
-class MyPivotPoint(bt.Indicator):
-    lines = ('pp', 's1', 's2', 'r1', 'r2')
-    plotinfo = dict(subplot=False)  # Plot on the same subplot as the data
+
+class DailyPivot:
+    ''' Day accumulators and levels of MyPivotPoint, fed one call at a time with update().
+    A new day is found by comparing the datetime number with the end of the current day, which is
+    computed once a day in the timezone "tz". Also used on its own by live_runner.py.'''
 
     def __init__(self):
-        self.ha = bt.indicators.HeikinAshi(self.data, plot=False)        
-        self.ha.plotlines.ha_high._plotskip=True 
-        self.ha.plotlines.ha_low._plotskip=True
-        self.ha.plotlines.ha_open._plotskip=True
-        self.ha.plotlines.ha_close._plotskip=True
+        self.day_end = -math.inf  # datetime number where the current day ends
+        self.day_high = None
+        self.day_low = None
+        self.day_close = None
+        self.bar = 0  # bar of the last call, a replayed bar gets one call per base candle
+        self.levels = self.prev_levels = (math.nan,) * 5
 
-        self.addminperiod(2)
+    @staticmethod
+    def end_of_day(dt, tz=None):
+        ''' Datetime number of the midnight after "dt" in the timezone "tz" (UTC if None)'''
+        if tz is None:
+            return math.floor(dt) + 1.0
+        midnight = datetime.combine(bt.num2date(dt, tz=tz).date() + timedelta(days=1), time())
+        midnight = tz.localize(midnight) if hasattr(tz, 'localize') else midnight.replace(tzinfo=tz)
+        return bt.date2num(midnight)
 
-        # Initialize the variables
-        self.current_day = None  # Initialize as None
-        self.prev_data_high = None
-        self.prev_data_low = None
-        self.prev_data_close = None
-        self.first_call = True  # Flag to indicate the first call to next
+    def update(self, bar, dt, high, low, close, tz=None):
+        ''' Levels pp, s1, s2, r1, r2 after a call on bar number "bar" with its datetime number and values'''
+        if bar != self.bar:
+            # First call on this bar: the levels so far are the previous bar's
+            self.bar = bar
+            self.prev_levels = self.levels
 
-    def next(self):        
-        
-        # Check if we're on a new day
-        if self.data.datetime.date(0) != self.current_day:
-            # We have a new day, so calculate the PivotPoint indicator
-            # using the complete OHLC values from the previous day
-            if self.data_high is not None and self.data_low is not None and self.data_close is not None:
-                self.lines.pp[0] = (self.data_high + self.data_low + self.data_close) / 3
-                self.lines.s1[0] = 2.0 * self.lines.pp[0] - self.data_high
-                self.lines.s2[0] = self.lines.pp[0] - (self.data_high - self.data_low)
-                self.lines.r1[0] = 2.0 * self.lines.pp[0] - self.data_low
-                self.lines.r2[0] = self.lines.pp[0] + (self.data_high - self.data_low)
-
-            # Update the current day to the new day
-            self.current_day = self.data.datetime.date(0)
-
-            # Reset the OHLC values for the new day
-            self.data_high = self.data.high[0]
-            self.data_low = self.data.low[0]
-            self.data_close = self.data.close[0]
+        if dt >= self.day_end:
+            # We have a new day, so calculate the levels using the complete values from the previous day
+            if self.day_high is None:
+                self.levels = pivot_levels(high, low, close)
+            else:
+                self.levels = pivot_levels(self.day_high, self.day_low, self.day_close)
+            self.day_end = self.end_of_day(dt, tz)
+
+            # Reset the values for the new day
+            self.day_high = high
+            self.day_low = low
+            self.day_close = close
         else:
-            # We're still on the same day, so update the OHLC values
-            self.data_high = max(self.data_high, self.data.high[0])
-            self.data_low = min(self.data_low, self.data.low[0])
-            self.data_close = self.data.close[0]
+            # We're still on the same day, so update the values and keep the previous bar's levels
+            self.day_high = max(self.day_high, high)
+            self.day_low = min(self.day_low, low)
+            self.day_close = close
+            self.levels = self.prev_levels
+        return self.levels
+
 
-            self.lines.pp[0] = self.lines.pp[-1]
-            self.lines.s1[0] = self.lines.s1[-1]
-            self.lines.s2[0] = self.lines.s2[-1]
-            self.lines.r1[0] = self.lines.r1[-1]
-            self.lines.r2[0] = self.lines.r2[-1]
+class MyPivotPoint(bt.Indicator):
+    ''' Daily pivot levels from the previous day's high, low and close (DailyPivot on every call)'''
+    lines = ('pp', 's1', 's2', 'r1', 'r2')
+    plotinfo = dict(subplot=False)  # Plot on the same subplot as the data
+
+    def __init__(self):
+        self.addminperiod(2)
+        self.ha = shared_indicator(self, bt.indicators.HeikinAshi, self.data, plot=False)
+        self.daily = DailyPivot()
 
-        # if self.lines.pp[0] != self.lines.pp[-1]:
-        #     # Print the values of the lines
-        #     print(f'pp: {self.lines.pp[0]:.4f}, s1: {self.lines.s1[0]:.4f}, s2: {self.lines.s2[0]:.4f}, r1: {self.lines.r1[0]:.4f}, r2: {self.lines.r2[0]:.4f}')
+    def next(self):
+        pp, s1, s2, r1, r2 = self.daily.update(len(self), self.data.datetime[0], self.data.high[0],
+                                               self.data.low[0], self.data.close[0], self.data.datetime._tz)
+        self.lines.pp[0] = pp
+        self.lines.s1[0] = s1
+        self.lines.s2[0] = s2
+        self.lines.r1[0] = r1
+        self.lines.r2[0] = r2
 
+    def once(self, start, end):
+        datetimes = np.asarray(self.data.datetime.array[:end])
+        lines = pivot_lines(day_numbers(datetimes, self.data.datetime._tz),
+                            np.asarray(self.data.high.array[:end]),
+                            np.asarray(self.data.low.array[:end]),
+                            np.asarray(self.data.close.array[:end]))
+        for line, values in zip(self.lines, lines):
+            array = line.array
+            for i in range(start, end):
+                array[i] = values[i]
 
     def buy(self):
         pivot_buy1 = (self.ha.lines.ha_close[0] > self.lines.s1[0]) and \
@@ -89,4 +159,4 @@ class MyPivotPoint(bt.Indicator):
     def stop_sell(self):
         return ((self.ha.lines.ha_close[0] > self.lines.s1[0]) and
                 (self.ha.lines.ha_close[-1] < self.lines.s1[0]) and
-                (self.ha.lines.ha_close[-2] < self.lines.s1[0])) 
\ No newline at end of file
+                (self.ha.lines.ha_close[-2] < self.lines.s1[0])) 
\ No newline at end of file
@@ -0,0 +1,724 @@
+# indicators\precompute.py
+# Whole-series versions of the HeikinAshiStrategy indicators, computed once per backtest with NumPy/TA-Lib.
+# Every function follows the bar by bar (next) implementation of the backtrader/bt.talib indicator it replaces,
+# so the strategy reads the same values from the precomputed columns as from indicator lines on completed bars.
+#
+# EXPERIMENTAL: main.py and the live bot replay the 30m bars, the indicators are recalculated on the forming
+# bar with every 5m candle and a signal can fire within a bar. The precomputed columns only change when a bar
+# completes; of the intrabar states only the forming bar's high and low are reproduced (partial_bars, used to
+# size the orders), and the TaPatterns buffer is fed once per bar instead of once per call (ta_signal).
+# Precomputed and vectorized backtests therefore trade differently from the replayed backtest, use them to
+# compare parameter sets with each other, not to predict the replayed or live results.
+#
+# Lines hold NaN until the minimum period backtrader gives them; operations on lines (comparisons,
+# crossovers, And/Or) take that minimum period explicitly, since a line can get a value before its
+# inputs have one (bt.talib output lines carry the minimum period of their inputs only).
+
+import hashlib
+import math
+import operator
+import os
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import talib
+from talib import abstract
+import backtrader as bt
+from numpy.lib.stride_tricks import sliding_window_view
+from indicators.heikin_patterns_01 import pattern_signals
+from indicators.pivot_point import pivot_lines
+from indicators.ta_patterns_02 import TaPatterns, pattern_lookback, ta_patterns
+
+
+# Columns added to the 30m feed, the strategy reads its signals from these lines
+SIGNAL_COLUMNS = (
+    'mas_buy', 'mas_sell', 'mas_stop_buy', 'mas_stop_sell',
+    'hmo_buy1', 'hmo_sell1',
+    'dma_osc_buy', 'dma_osc_sell',
+    'kama_osc_buy1', 'kama_osc_sell1',
+    'sma_buy', 'sma_sell',
+    'mama_buy', 'mama_sell',
+    'apo_buy', 'apo_sell',
+    'ad_osc_buy1', 'ad_osc_sell1',
+    'stoch_buy1', 'stoch_sell1',
+    'cmo_buy', 'cmo_sell',
+    'high_volatility',
+    'adx_buy', 'adx_sell',
+    'volume_filter',
+    'mfi_buy', 'mfi_sell',
+)
+LINE_COLUMNS = ('ha_open', 'ha_high', 'ha_low', 'ha_close', 'DIplus', 'DIminus', 'adxr', 'pivot_buy', 'pivot_sell',
+                'ta_signal', 'ta_strong_buy', 'ta_strong_sell', 'ready')
+PRECOMPUTED_COLUMNS = LINE_COLUMNS + SIGNAL_COLUMNS
+PRECOMPUTED_NOTE = ("Precomputed indicators are experimental: signals come from completed 30m bars, "
+                    "the results differ from the replayed backtest")
+
+# Columns added to the base feed: high and low of the forming bar, as a replayed data1 shows them
+PARTIAL_COLUMNS = ('partial_high', 'partial_low')
+
+# TA-Lib functions whose value on a bar only depends on the last lookback + 1 bars (window sums and extremes):
+# one call on the whole series gives the bar by bar values of bt.talib, up to the rounding of the running sums
+WINDOW_FUNCTIONS = ('SMA', 'WMA', 'MFI', 'APO', 'STOCHF')
+WINDOW_MATYPES = (talib.MA_Type.SMA, talib.MA_Type.WMA)  # moving averages of the *matype arguments that qualify
+
+# Aggregated bars are cached next to the candle cache of data_feed.py
+BARS_CACHE_DIR = os.path.join('data_cache', 'bars')
+
+
+# Helpers
+
+def nan_array(length):
+    return np.full(length, np.nan)
+
+
+def first_valid(*arrays):
+    ''' Index of the first bar where all the arrays have a value'''
+    valid = np.ones(len(arrays[0]), dtype=bool)
+    for array in arrays:
+        valid &= ~np.isnan(array)
+    index = np.flatnonzero(valid)
+    return int(index[0]) if len(index) else len(valid)
+
+
+def shift(x, ago):
+    ''' x[-ago] as seen from every bar (NaN where there is no such bar yet)'''
+    out = nan_array(len(x))
+    out[ago:] = x[:len(x) - ago]
+    return out
+
+
+def compare(op, a, b, minperiod=1):
+    ''' Line comparison: NaN before the minimum period, 1.0/0.0 after (NaN compares false)'''
+    with np.errstate(invalid='ignore'):
+        out = op(a, b).astype(np.float64)
+    out[:minperiod - 1] = np.nan
+    return out
+
+
+def truth(x):
+    ''' Truth value of line values in Python, where NaN is true'''
+    return x != 0
+
+
+def py_or(a, b):
+    ''' Value of the Python expression "a or b" for every bar'''
+    return np.where(truth(a), a, b)
+
+
+def py_and(a, b):
+    ''' Value of the Python expression "a and b" for every bar'''
+    return np.where(truth(a), b, a)
+
+
+def logic(flogic, *args, minperiod=1):
+    ''' bt.And/bt.Or: NaN before the minimum period, 1.0/0.0 after'''
+    out = flogic(*[truth(arg) for arg in args]).astype(np.float64)
+    out[:minperiod - 1] = np.nan
+    return out
+
+
+def talib_minperiod(name, *input_minperiods, **kwargs):
+    ''' Minimum period of a bt.talib indicator (its output lines only carry the inputs' one)'''
+    function = abstract.Function(name)
+    function.set_function_args(**kwargs)
+    return max(function.lookback + 1, *input_minperiods)
+
+
+def hma_minperiod(period):
+    return period + int(pow(period, 0.5)) - 1
+
+
+def windowed(name, kwargs):
+    ''' True if the TA-Lib function "name" only reads the last lookback + 1 bars with these arguments'''
+    return name in WINDOW_FUNCTIONS and all(value in WINDOW_MATYPES
+                                            for key, value in kwargs.items() if key.endswith('matype'))
+
+
+def talib_line(name, *inputs, **kwargs):
+    ''' Run a TA-Lib function the way bt.talib does in next mode.
+    Functions with an unstable period see the whole history on every bar, the others only
+    the last lookback + 1 bars, which changes the result of the path dependent ones (ADOSC, ADXR...):
+    those are run bar by bar on their window, the rest with one call on the whole series.'''
+    function = abstract.Function(name)
+    function.set_function_args(**kwargs)
+    tafunc = getattr(talib, name)
+    inputs = [np.ascontiguousarray(x, dtype=np.float64) for x in inputs]
+
+    if 'Function has an unstable period' in function.function_flags or windowed(name, kwargs):
+        return tafunc(*inputs, **kwargs)
+
+    size = function.lookback + 1
+    outputs = [nan_array(len(inputs[0])) for _ in function.output_names]
+    start = first_valid(*inputs) + size - 1
+    for i in range(start, len(inputs[0])):
+        out = tafunc(*[x[i - size + 1:i + 1] for x in inputs], **kwargs)
+        if len(outputs) == 1:
+            outputs[0][i] = out[-1]
+        else:
+            for line, o in zip(outputs, out):
+                line[i] = o[-1]
+    return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+
+# backtrader indicators
+
+def heikin_ashi(open_, high, low, close):
+    ''' bt.indicators.HeikinAshi, ha_open is seeded with (open + close) / 2 on the first bar.
+    ha_high and ha_low need the previous bar and stay NaN on the first one.'''
+    ha_close = (open_ + high + low + close) / 4.0
+    ha_open = nan_array(len(close))
+    if len(close):
+        ha_open[0] = (open_[0] + close[0]) / 2.0
+    for i in range(1, len(close)):
+        ha_open[i] = (ha_open[i - 1] + ha_close[i - 1]) / 2.0
+    ha_high = np.maximum(np.maximum(high, ha_open), ha_close)
+    ha_low = np.minimum(np.minimum(low, ha_open), ha_close)
+    ha_high[:1] = ha_low[:1] = np.nan
+    return ha_open, ha_high, ha_low, ha_close
+
+
+def sma(x, period):
+    ''' bt.indicators.SMA: fsum of the window / period'''
+    out = nan_array(len(x))
+    start = first_valid(x)
+    if len(x) - start >= period:
+        windows = sliding_window_view(x[start:], period)
+        out[start + period - 1:] = [math.fsum(window) / period for window in windows]
+    return out
+
+
+def sum_n(x, period):
+    out = nan_array(len(x))
+    start = first_valid(x)
+    if len(x) - start >= period:
+        windows = sliding_window_view(x[start:], period)
+        out[start + period - 1:] = [math.fsum(window) for window in windows]
+    return out
+
+
+def wma(x, period):
+    ''' bt.indicators.WMA: linear weights 1..period'''
+    out = nan_array(len(x))
+    start = first_valid(x)
+    coef = 2.0 / (period * (period + 1.0))
+    weights = tuple(float(w) for w in range(1, period + 1))
+    if len(x) - start >= period:
+        windows = sliding_window_view(x[start:], period)
+        out[start + period - 1:] = [coef * math.fsum(map(operator.mul, window, weights)) for window in windows]
+    return out
+
+
+def exp_smoothing(x, period, alpha):
+    ''' bt ExponentialSmoothing: seeded with the SMA of the first period values'''
+    out = nan_array(len(x))
+    start = first_valid(x) + period - 1
+    if start < len(x):
+        alpha1 = 1.0 - alpha
+        prev = out[start] = math.fsum(x[start - period + 1:start + 1]) / period
+        for i in range(start + 1, len(x)):
+            prev = out[i] = prev * alpha1 + x[i] * alpha
+    return out
+
+
+def ema(x, period):
+    return exp_smoothing(x, period, 2.0 / (1.0 + period))
+
+
+def smma(x, period):
+    return exp_smoothing(x, period, 1.0 / period)
+
+
+def hma(x, period):
+    ''' bt.indicators.HullMovingAverage'''
+    return wma(2.0 * wma(x, period // 2) - wma(x, period), int(pow(period, 0.5)))
+
+
+def zero_lag(x, period, gainlimit):
+    ''' bt.indicators.ZeroLagIndicator: EMA with the error correcting gain that best fits the price'''
+    average = ema(x, period)
+    alpha = 2.0 / (1.0 + period)
+    alpha1 = 1.0 - alpha
+    gains = np.arange(-gainlimit, gainlimit + 1) / 10
+
+    ec = nan_array(len(x))
+    start = first_valid(average)
+    if start < len(x):
+        ec[start] = average[start]  # no previous ec yet, seeded with the EMA
+    for i in range(start + 1, len(x)):
+        candidates = alpha * (average[i] + gains * (x[i] - ec[i - 1])) + alpha1 * ec[i - 1]
+        ec[i] = candidates[np.argmin(np.abs(x[i] - candidates))]
+    return ec
+
+
+def dma(x, period, gainlimit, hperiod):
+    ''' bt.indicators.DicksonMovingAverage'''
+    return (zero_lag(x, period, gainlimit) + hma(x, hperiod)) / 2.0
+
+
+def kama(x, period, fast, slow):
+    ''' bt.indicators.AdaptiveMovingAverage (not the TA-Lib one)'''
+    direction = x - shift(x, period)
+    volatility = sum_n(np.abs(x - shift(x, 1)), period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        er = np.abs(direction / volatility)
+    fast = 2.0 / (fast + 1.0)
+    slow = 2.0 / (slow + 1.0)
+    sc = (er * (fast - slow) + slow) ** 2
+
+    out = nan_array(len(x))
+    start = max(first_valid(x) + period - 1, first_valid(sc))
+    if start < len(x):
+        prev = out[start] = math.fsum(x[start - period + 1:start + 1]) / period
+        for i in range(start + 1, len(x)):
+            prev = out[i] = prev * (1.0 - sc[i]) + x[i] * sc[i]
+    return out
+
+
+def crossover(a, b, minperiod=1):
+    ''' bt.indicators.CrossOver: +1 up cross, -1 down cross, 0 otherwise.
+    "minperiod" is the larger minimum period of the two inputs.'''
+    length = len(a)
+    out = nan_array(length)
+    start = minperiod - 1
+    if start + 1 >= length:
+        return out
+    diff = a[start:] - b[start:]
+    # last non zero difference (NaN counts as non zero), forward filled from the seed value
+    marks = np.where(truth(diff), np.arange(len(diff)), 0)
+    nzd = diff[np.maximum.accumulate(marks)]
+    with np.errstate(invalid='ignore'):
+        up = (nzd[:-1] < 0.0) & (a[start + 1:] > b[start + 1:])
+        down = (nzd[:-1] > 0.0) & (a[start + 1:] < b[start + 1:])
+    out[start + 1:] = up.astype(np.float64) - down.astype(np.float64)
+    return out
+
+
+def directional_movement(high, low, close, period):
+    ''' bt.indicators.DirectionalMovementIndex: DIplus, DIminus and adx'''
+    prev_close = shift(close, 1)
+    tr = np.maximum(high, prev_close) - np.minimum(low, prev_close)
+    tr[0] = np.nan
+    atr = smma(tr, period)
+
+    upmove = high - shift(high, 1)
+    downmove = shift(low, 1) - low
+    with np.errstate(invalid='ignore'):
+        plus_dm = np.where((upmove > downmove) & (upmove > 0.0), upmove, 0.0)
+        minus_dm = np.where((downmove > upmove) & (downmove > 0.0), downmove, 0.0)
+    plus_dm[0] = minus_dm[0] = np.nan
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        di_plus = 100.0 * smma(plus_dm, period) / atr
+        di_minus = 100.0 * smma(minus_dm, period) / atr
+        dx = np.abs(di_plus - di_minus) / (di_plus + di_minus)
+    adx = 100.0 * smma(dx, period)
+    return di_plus, di_minus, adx
+
+
+# Strategy building blocks
+
+def heikin_patterns(ha_open, ha_high, ha_low, ha_close):
+    ''' indicators.heikin_patterns_01.HeikinPatterns: signal and stop_signal lines, one pattern_signals pass
+    over the whole series'''
+    o, h, l, c = ha_open, ha_high, ha_low, ha_close
+    with np.errstate(invalid='ignore'):
+        buy_signal, sell_signal, stop_buy_signal, stop_sell_signal = pattern_signals(
+            o, h, l, c, shift(o, 1), shift(h, 1), shift(l, 1), shift(c, 1), shift(o, 2), shift(c, 2))
+
+    signal = np.where(buy_signal, 1.0, np.where(sell_signal, -1.0, 0.0))
+    stop_signal = np.where(stop_buy_signal, 1.0, np.where(stop_sell_signal, -1.0, 0.0))
+    signal[:4] = stop_signal[:4] = np.nan  # next() returns early while len(data) < 5
+    return signal, stop_signal
+
+
+def movav_minperiods(fast_ema, slow_ema, hma_length, kama_period, dma_period, dma_hperiod):
+    ''' Minimum periods inside MovAverages, "movav" being the indicator's own'''
+    fma = talib_minperiod('EMA', 1, timeperiod=fast_ema)
+    sma = talib_minperiod('EMA', 1, timeperiod=slow_ema)
+    hull = hma_minperiod(hma_length)
+    dickson = max(dma_period, hma_minperiod(dma_hperiod))
+    kaufman = talib_minperiod('KAMA', 1, timeperiod=kama_period)
+    mp = dict(ema2_cross=max(fma, sma) + 1, ema_cross=sma + 1, hma=hull, hma_cross=hull + 1,
+              dma=dickson, dma_cross=dickson + 1, hma_dma_cross=max(dickson, hull) + 1, kama=kaufman,
+              kama_cross=2)  # the cross sees the KAMA output line, whose minimum period is 1
+    mp['movav'] = max(mp.values())
+    return mp
+
+
+def movav_signals(close, fast_ema, slow_ema, hma_length, kama_period, dma_period, dma_gainlimit, dma_hperiod):
+    ''' indicators.movavs.MovAverages: signal and stop_signal lines'''
+    length = len(close)
+    eq = operator.eq
+    mp = movav_minperiods(fast_ema, slow_ema, hma_length, kama_period, dma_period, dma_hperiod)
+
+    fma = talib_line('EMA', close, timeperiod=fast_ema)
+    slow = talib_line('EMA', close, timeperiod=slow_ema)
+    ema2_cross = crossover(fma, slow, mp['ema2_cross'] - 1)
+    ema_cross = crossover(close, slow, mp['ema_cross'] - 1)
+    ema_mp = max(mp['ema2_cross'], mp['ema_cross'])
+    ema_buy = logic(np.logical_or, ema2_cross == 1, ema_cross == 1, minperiod=ema_mp)
+    ema_sell = logic(np.logical_or, ema2_cross == -1, ema_cross == -1, minperiod=ema_mp)
+
+    hull = hma(close, hma_length)
+    hma_cross = crossover(close, hull, mp['hma'])
+    hma_buy1 = compare(eq, hma_cross, 1, mp['hma_cross'])
+    hma_sell1 = compare(eq, hma_cross, -1, mp['hma_cross'])
+
+    dickson = dma(close, dma_period, dma_gainlimit, dma_hperiod)
+    dma_cross = crossover(close, dickson, mp['dma'])
+    dma_buy = compare(eq, dma_cross, 1, mp['dma_cross'])
+    dma_sell = compare(eq, dma_cross, -1, mp['dma_cross'])
+
+    kaufman = talib_line('KAMA', close, timeperiod=kama_period)
+    kama_cross = crossover(close, kaufman, mp['kama_cross'] - 1)
+    kama_buy1 = compare(eq, kama_cross, 1, mp['kama_cross'])
+    kama_sell1 = compare(eq, kama_cross, -1, mp['kama_cross'])
+
+    def turn_up(x):
+        with np.errstate(invalid='ignore'):
+            return ((shift(x, 4) > shift(x, 3)) & (shift(x, 3) >= shift(x, 2)) &
+                    (shift(x, 2) <= shift(x, 1)) & (shift(x, 1) < x)).astype(np.float64)
+
+    def turn_down(x):
+        with np.errstate(invalid='ignore'):
+            return ((shift(x, 4) < shift(x, 3)) & (shift(x, 3) <= shift(x, 2)) &
+                    (shift(x, 2) >= shift(x, 1)) & (shift(x, 1) > x)).astype(np.float64)
+
+    hma_buy = py_or(hma_buy1, turn_up(hull))
+    hma_sell = py_or(hma_sell1, turn_down(hull))
+    kama_buy = py_or(kama_buy1, turn_up(kaufman))
+    kama_sell = py_or(kama_sell1, turn_down(kaufman))
+
+    def movav(ema_side, hma_side, hma1_side, dma_side, kama_side, kama1_side):
+        ema_ = py_or(ema_side, shift(ema_side, 1))
+        dma_ = py_or(dma_side, shift(dma_side, 1))
+        hma_ = py_or(hma_side, shift(hma1_side, 1))
+        kama_ = py_or(kama_side, shift(kama1_side, 1))
+        return py_and(py_and(ema_, hma_), py_or(dma_, kama_))
+
+    movav_buy = movav(ema_buy, hma_buy, hma_buy1, dma_buy, kama_buy, kama_buy1)
+    movav_sell = movav(ema_sell, hma_sell, hma_sell1, dma_sell, kama_sell, kama_sell1)
+    movav_stop_buy = py_and(ema_sell, hma_sell1)
+    movav_stop_sell = py_and(ema_buy, hma_buy1)
+
+    signal = np.where(movav_buy == 1, 1.0, np.where(movav_sell == 1, -1.0, 0.0))
+    stop_signal = np.where(movav_stop_buy == 1, 1.0, np.where(movav_stop_sell == 1, -1.0, 0.0))
+
+    # MovAverages.next only runs once all of its sub indicators are ready, and skips the first 4 bars
+    start = max(mp['movav'] - 1, 4)
+    signal[:min(start, length)] = np.nan
+    stop_signal[:min(start, length)] = np.nan
+    return signal, stop_signal
+
+
+def pivot_signals(datetimes, high, low, close, ha_close, calls):
+    ''' indicators.pivot_point.MyPivotPoint: buy() and sell() for every bar.
+    "calls" is how many times the strategy runs the indicator on each bar (once per base candle),
+    the levels come from the indicator's batch mode on the UTC days of the bars.'''
+    days = datetimes.astype('datetime64[D]').astype(np.int64)
+    return pivot_crossings(ha_close, *pivot_lines(days, high, low, close, calls)[1:])
+
+
+def pivot_crossings(ha_close, s1, s2, r1, r2):
+    ''' MyPivotPoint buy() and sell() from the Heikin Ashi closes and the s1, s2, r1, r2 levels (arrays or floats)'''
+    c0, c1, c2, c3 = ha_close, shift(ha_close, 1), shift(ha_close, 2), shift(ha_close, 3)
+    with np.errstate(invalid='ignore'):
+        buy1 = (c0 > s1) & (c1 < s1) & (c2 >= s1) & (c3 >= s1) & (c1 < c0)
+        buy2 = (c0 > s2) & (c1 < s2) & (c2 >= s2)
+        sell1 = (c0 < r1) & (c1 > r1) & (c2 <= r1) & (c3 <= r1)
+        sell2 = (c0 < r2) & (c1 > r2) & (c2 <= r2)
+    return (buy1 | buy2).astype(np.float64), (sell1 | sell2).astype(np.float64)
+
+
+class IndicatorCache:
+    ''' LRU cache of indicator arrays for one dataset, shared by the backtests run in a process.
+    Entries are keyed by the dataset fingerprint, the indicator name and only the parameters that
+    indicator depends on, so parameter sets that differ in one gene recompute one indicator.'''
+    def __init__(self, dataset_key, maxsize=512):
+        self.dataset_key = dataset_key
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name, args, compute):
+        ''' Cached result of compute() for indicator "name" with parameters "args"'''
+        key = (self.dataset_key, name, args)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        self.misses += 1
+        value = compute()
+        for array in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(array, np.ndarray):
+                array.setflags(write=False)  # shared between backtests
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return value
+
+
+def precompute_indicators(bars, params, cache=None):
+    ''' Compute every indicator line HeikinAshiStrategy reads from the 30m data.
+    "bars" is the 30m frame from aggregate_bars, "params" the strategy params (anything with attribute access).
+    With an IndicatorCache for these bars, indicators already computed for the same parameters are reused.
+    Returns a copy of the frame with the PRECOMPUTED_COLUMNS added.'''
+    p = params
+    o, h, l, c, v = (bars[name].to_numpy(dtype=np.float64) for name in ('open', 'high', 'low', 'close', 'volume'))
+    gt, lt, eq = operator.gt, operator.lt, operator.eq
+    cols = {}
+    # Minimum periods of the indicators the strategy creates, the strategy starts once the largest is reached
+    minperiods = [2]  # HeikinAshi, HeikinPatterns and MyPivotPoint
+
+    def cached(name, args, compute):
+        return compute() if cache is None else cache.get(name, args, compute)
+
+    ha_open, ha_high, ha_low, ha_close = cached('heikin_ashi', (), lambda: heikin_ashi(o, h, l, c))
+    cols.update(ha_open=ha_open, ha_high=ha_high, ha_low=ha_low, ha_close=ha_close)
+
+    # Moving averages
+    movav_args = (p.fast_ema, p.slow_ema, p.hma_length, p.kama_period, p.dma_period, p.dma_gainlimit, p.dma_hperiod)
+    signal, stop_signal = cached('movav', movav_args, lambda: movav_signals(c, *movav_args))
+    movav_mp = movav_minperiods(p.fast_ema, p.slow_ema, p.hma_length, p.kama_period, p.dma_period, p.dma_hperiod)
+    minperiods.append(movav_mp['movav'])
+    cols.update(mas_buy=compare(eq, signal, 1), mas_sell=compare(eq, signal, -1),
+                mas_stop_buy=compare(eq, stop_signal, 1), mas_stop_sell=compare(eq, stop_signal, -1))
+
+    # Hull MA, Dickson MA and KAMA oscillators
+    hmo_mp = hma_minperiod(p.hma_length)
+    hmo = cached('hmo', (p.hma_length,), lambda: c - hma(c, p.hma_length))
+    cols.update(hmo_buy1=compare(gt, hmo, 0.0, hmo_mp), hmo_sell1=compare(lt, hmo, 0.0, hmo_mp))
+    dma_osc_mp = hma_minperiod(p.dma_hperiod)  # the oscillator line only waits for the Hull part
+    dma_osc = cached('dma_osc', (p.dma_period, p.dma_gainlimit, p.dma_hperiod),
+                     lambda: c - dma(c, p.dma_period, p.dma_gainlimit, p.dma_hperiod))
+    cols.update(dma_osc_buy=compare(gt, dma_osc, 0.0, dma_osc_mp), dma_osc_sell=compare(lt, dma_osc, 0.0, dma_osc_mp))
+    kama_osc_mp = p.kama_period + 1
+    kama_osc = cached('kama_osc', (p.kama_period,), lambda: c - kama(c, p.kama_period, 5, 15))
+    cols.update(kama_osc_buy1=compare(gt, kama_osc, 0.0, kama_osc_mp),
+                kama_osc_sell1=compare(lt, kama_osc, 0.0, kama_osc_mp))
+    minperiods += [hmo_mp, movav_mp['dma'], kama_osc_mp]
+
+    # SMA
+    simple_ma_mp = talib_minperiod('SMA', 1, timeperiod=p.sma_length * 10)
+    sma_cross = cached('sma_cross', (p.sma_length,),
+                       lambda: crossover(ha_close, talib_line('SMA', c, timeperiod=p.sma_length * 10), simple_ma_mp))
+    cols.update(sma_buy=compare(eq, sma_cross, 1, simple_ma_mp + 1), sma_sell=compare(eq, sma_cross, -1, simple_ma_mp + 1))
+    minperiods.append(simple_ma_mp + 1)
+
+    # MAMA
+    mama_kwargs = dict(fastlimit=(p.mama_fastlimit / 10), slowlimit=(p.mama_slowlimit / 100))
+    mama_cross = cached('mama_cross', (p.mama_fastlimit, p.mama_slowlimit),
+                        lambda: crossover(*talib_line('MAMA', ha_close, **mama_kwargs)))
+    cols.update(mama_buy=compare(gt, mama_cross, 0, 2), mama_sell=compare(lt, mama_cross, 0, 2))
+    minperiods.append(talib_minperiod('MAMA', 1, **mama_kwargs))
+
+    # Absolute Price Oscillator
+    apo_kwargs = dict(fastperiod=p.apo_fast, slowperiod=p.apo_slow, matype=p.apo_matype)
+    apo = cached('apo', (p.apo_fast, p.apo_slow, p.apo_matype), lambda: talib_line('APO', ha_close, **apo_kwargs))
+    cols.update(apo_buy=compare(gt, apo, 0), apo_sell=compare(lt, apo, 0))
+    minperiods.append(talib_minperiod('APO', 1, **apo_kwargs))
+
+    # Chaikin A/D Oscillator
+    ad_kwargs = dict(fastperiod=p.fast_ad, slowperiod=p.slow_ad)
+    ad_osc = cached('ad_osc', (p.fast_ad, p.slow_ad), lambda: talib_line('ADOSC', h, l, c, v, **ad_kwargs))
+    cols.update(ad_osc_buy1=compare(gt, ad_osc, 0.0), ad_osc_sell1=compare(lt, ad_osc, 0.0))
+    minperiods.append(talib_minperiod('ADOSC', 1, **ad_kwargs))
+
+    # Stochastic oscillator
+    stoch_kwargs = dict(fastk_period=p.fastk_period, fastd_period=p.fastd_period, fastd_matype=p.fastd_matype)
+    stoch_k, stoch_d = cached('stoch', (p.fastk_period, p.fastd_period, p.fastd_matype),
+                              lambda: talib_line('STOCHF', ha_high, ha_low, ha_close, **stoch_kwargs))
+    cols.update(stoch_buy1=compare(gt, stoch_k, stoch_d, 2), stoch_sell1=compare(lt, stoch_k, stoch_d, 2))
+    minperiods.append(talib_minperiod('STOCHF', 2, **stoch_kwargs))
+
+    # CMO, on the first HA line (ha_open) like bt.talib.CMO(self.ha)
+    cmo = cached('cmo', (p.cmo_period,), lambda: talib_line('CMO', ha_open, timeperiod=p.cmo_period))
+    cols.update(cmo_buy=compare(gt, cmo, p.cmo_threshold, 2), cmo_sell=compare(lt, cmo, -p.cmo_threshold, 2))
+    minperiods.append(talib_minperiod('CMO', 2, timeperiod=p.cmo_period))
+
+    # ATR
+    natr = cached('natr', (p.atr_period,), lambda: talib_line('NATR', h, l, c, timeperiod=p.atr_period))
+    cols.update(high_volatility=compare(gt, natr, p.atr_threshold / 100))
+    minperiods.append(talib_minperiod('NATR', 1, timeperiod=p.atr_period))
+
+    # ADX
+    di_mp = p.dmi_length + 1
+    di_plus, di_minus = cached('dmi', (p.dmi_length,), lambda: directional_movement(h, l, c, p.dmi_length)[:2])
+    adxr = cached('adxr', (p.dmi_length,), lambda: talib_line('ADXR', h, l, c, timeperiod=p.dmi_length))
+    cols.update(DIplus=di_plus, DIminus=di_minus, adxr=adxr)
+    cols.update(adx_buy=logic(np.logical_and, compare(gt, di_plus, di_minus), compare(gt, adxr, p.dmi_threshold), minperiod=di_mp),
+                adx_sell=logic(np.logical_and, compare(lt, di_plus, di_minus), compare(gt, adxr, p.dmi_threshold), minperiod=di_mp))
+    minperiods += [2 * p.dmi_length, talib_minperiod('ADXR', 1, timeperiod=p.dmi_length)]
+
+    # Volume filter
+    volume_averages = cached('volume_sma', (p.slow_ema,), lambda: sma(v, p.slow_ema)) * (p.volume_factor_perc / 10)
+    cols.update(volume_filter=compare(gt, v, volume_averages, p.slow_ema))
+    minperiods.append(p.slow_ema)
+
+    # MFI
+    mfi_mp = talib_minperiod('MFI', 2, timeperiod=p.mfi_period)
+    mfi_cross_mp = mfi_mp + p.mfi_smooth  # crossover of the MFI and its SMA
+    mfi = cached('mfi', (p.mfi_period,), lambda: talib_line('MFI', ha_high, ha_low, ha_close, v, timeperiod=p.mfi_period))
+    mfi_cross = cached('mfi_cross', (p.mfi_period, p.mfi_smooth),
+                       lambda: crossover(mfi, sma(mfi, p.mfi_smooth), mfi_cross_mp - 1))
+    cols.update(mfi_buy=logic(np.logical_or, mfi_cross == 1, mfi < p.mfi_level, minperiod=mfi_cross_mp),
+                mfi_sell=logic(np.logical_or, mfi_cross == -1, mfi > 100 - p.mfi_level, minperiod=mfi_cross_mp))
+    minperiods.append(mfi_cross_mp)
+
+    # Pivot Point levels
+    def pivot():
+        calls = np.r_[bars['candles'].to_numpy()[1:], 1]  # base candles seen while each bar is the latest one
+        return pivot_signals(bars.index.values, h, l, c, ha_close, calls)
+    pivot_buy, pivot_sell = cached('pivot', (), pivot)
+    cols.update(pivot_buy=pivot_buy, pivot_sell=pivot_sell)
+
+    # TA-Lib candlestick patterns, only built when the strategy uses them.
+    # Unlike the pivot levels, ta_signal is the signal with one buffer feed per bar (TaPatterns in runonce):
+    # TaPatterns feeds its buffer on every call, and the 5m calls between two completed bars would change the
+    # signal from candle to candle, which a 30m column cannot hold. The precomputed and vectorized backtests
+    # therefore give different TaPatterns signals than TaPatterns on a feed called several times per bar.
+    if p.use_ta_patterns:
+        patterns, strong_patterns = TaPatterns.params.patterns, TaPatterns.params.strong_patterns
+        lookback = max(pattern_lookback(pattern, penetration) for pattern, penetration in patterns + strong_patterns)
+        ta_signal, ta_strong_buy, ta_strong_sell = cached(
+            'ta_patterns', (), lambda: ta_patterns(o, h, l, c, patterns, strong_patterns, TaPatterns.params.buffer_length, lookback))
+        minperiods.append(lookback + 1)
+    else:
+        ta_signal = ta_strong_buy = ta_strong_sell = nan_array(len(c))
+    cols.update(ta_signal=ta_signal, ta_strong_buy=ta_strong_buy, ta_strong_sell=ta_strong_sell)
+
+    cols['ready'] = (np.arange(len(c)) >= max(minperiods) - 1).astype(np.float64)
+
+    frame = bars.copy()
+    for name in PRECOMPUTED_COLUMNS:
+        frame[name] = cols[name]
+    return frame
+
+
+def precompute_bars(data, params, compression=30, cache=None):
+    ''' aggregate_bars and precompute_indicators in one step, the bars are built once per cache'''
+    return precompute_indicators(cached_bars(data, compression, cache)[0], params, cache)
+
+
+def with_partial_bars(data, compression=30, cache=None):
+    ''' Copy of the base frame with the PARTIAL_COLUMNS, for PartialBarData'''
+    partials = cached_bars(data, compression, cache)[1]
+    return data.assign(partial_high=partials['high'], partial_low=partials['low'])
+
+
+def cached_bars(data, compression=30, cache=None):
+    ''' load_bars, kept in the IndicatorCache when there is one'''
+    if cache is None:
+        return load_bars(data, compression)
+    return cache.get('bars', (compression,), lambda: load_bars(data, compression))
+
+
+def load_bars(data, compression=30, cache_dir=BARS_CACHE_DIR):
+    ''' aggregate_bars and partial_bars of the base frame, read from the disk cache if the same candles
+    were aggregated before (by another backtest process or an earlier run)'''
+    digest = hashlib.sha1()
+    digest.update(data.index.values.astype('datetime64[ms]').astype(np.int64).tobytes())
+    digest.update(np.ascontiguousarray(data[['open', 'high', 'low', 'close', 'volume']].to_numpy(dtype=np.float64)).tobytes())
+    filename = os.path.join(cache_dir, f'{digest.hexdigest()}_{compression}m.pkl')
+    if os.path.isfile(filename):
+        try:
+            return pd.read_pickle(filename)
+        except Exception as e:
+            print(f"Ignoring unreadable bar cache {filename}: {e}")
+
+    result = aggregate_bars(data, compression), partial_bars(data, compression)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Every process writes its own temp file, the last rename wins and readers never see a partial file
+    fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, prefix=os.path.basename(filename) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pd.to_pickle(result, f)
+        os.replace(tmp_filename, filename)
+    except OSError as e:
+        print(f"Could not write the bar cache {filename}: {e}")
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    return result
+
+
+def bar_bins(data, compression=30):
+    ''' Bar number of every base candle, bars group the candles like backtrader's resampler (right edge included)'''
+    stamps = data.index.values.astype('datetime64[ns]').astype(np.int64)
+    width = compression * 60 * 1_000_000_000
+    return -(-stamps // width)
+
+
+def partial_bars(data, compression=30):
+    ''' High and low of the forming bar after every base candle, what a replayed data1 holds at that candle'''
+    groups = data[['high', 'low']].groupby(bar_bins(data, compression), sort=False)
+    return pd.DataFrame({
+        'high': groups['high'].cummax().to_numpy(),
+        'low': groups['low'].cummin().to_numpy(),
+    }, index=data.index)
+
+
+def aggregate_bars(data, compression=30):
+    ''' Build completed bars of "compression" minutes from the base OHLCV frame.
+    Bars group the candles like backtrader's resampler (right edge included) and carry the
+    timestamp of their last candle, so they reach the strategy together with that candle.
+    "candles" is the number of base candles in each bar.'''
+    bins = bar_bins(data, compression)
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    ends = np.r_[starts[1:], len(bins)] - 1
+
+    bars = pd.DataFrame({
+        'open': data['open'].to_numpy()[starts],
+        'high': np.maximum.reduceat(data['high'].to_numpy(), starts),
+        'low': np.minimum.reduceat(data['low'].to_numpy(), starts),
+        'close': data['close'].to_numpy()[ends],
+        'volume': np.add.reduceat(data['volume'].to_numpy(), starts),
+        'candles': ends - starts + 1,
+    }, index=data.index[ends])
+    return bars
+
+
+class PrecomputedData(bt.feeds.PandasData):
+    ''' 30m feed carrying the precomputed indicator columns as extra lines'''
+    lines = PRECOMPUTED_COLUMNS
+    params = tuple((name, -1) for name in PRECOMPUTED_COLUMNS)
+
+
+class PartialBarData(bt.feeds.PandasData):
+    ''' Base feed that also carries the high and low of the forming bar (with_partial_bars)'''
+    lines = PARTIAL_COLUMNS
+    params = tuple((name, -1) for name in PARTIAL_COLUMNS)
+
+
+class PrecomputedPivot:
+    ''' Stand-in for MyPivotPoint that answers buy()/sell() from the precomputed columns'''
+    def __init__(self, data):
+        self.data = data
+
+    def buy(self):
+        return self.data.pivot_buy[0]
+
+    def sell(self):
+        return self.data.pivot_sell[0]
+
+
+class PrecomputedTaPatterns:
+    ''' Stand-in for TaPatterns that answers its signal methods from the precomputed columns.
+    ta_signal uses one buffer feed per bar, not one per call like TaPatterns (see precompute_indicators).'''
+    def __init__(self, data, threshold=0):
+        self.data = data
+        self.threshold = threshold
+
+    def strong_buy(self):
+        return self.data.ta_strong_buy[0] == 1
+
+    def strong_sell(self):
+        return self.data.ta_strong_sell[0] == 1
+
+    def signal_buy(self):
+        return (self.data.ta_signal[0] > self.threshold) or self.strong_buy()
+
+    def signal_sell(self):
+        return (self.data.ta_signal[0] < -self.threshold) or self.strong_sell()
@@ -0,0 +1,60 @@
+# indicators\registry.py
+
+# Shared indicator instances for a strategy and the indicators it builds.
+# The strategy owns an IndicatorRegistry, its sub-indicators reach it with shared_indicator(self, ...),
+# so the same indicator on the same inputs with the same params is built, and computed, once per bar.
+
+import backtrader as bt
+from backtrader.lineseries import LineSeriesStub
+
+
+class IndicatorRegistry:
+    ''' One indicator instance per (type, inputs, params).
+    Params are compared with the indicator's defaults filled in, other keyword arguments (plot options)
+    only apply to the first request. Inputs are compared by identity, a line and the stub backtrader wraps
+    it in when an indicator gets it as data count as the same input.'''
+
+    def __init__(self):
+        self.instances = {}
+
+    def get(self, indicator, *datas, **kwargs):
+        params = dict(indicator.params._getitems())
+        params.update((name, value) for name, value in kwargs.items() if name in params)
+        key = (indicator, tuple(id(self.source(data)) for data in datas), tuple(params.items()))
+        if key not in self.instances:
+            # The inputs are kept with the instance, so their ids are not reused while the key lives
+            self.instances[key] = (datas, indicator(*datas, **kwargs))
+        return self.instances[key][1]
+
+    @staticmethod
+    def source(data):
+        return data.lines[0] if isinstance(data, LineSeriesStub) else data
+
+    def __len__(self):
+        return len(self.instances)
+
+
+def find_registry(owner):
+    ''' IndicatorRegistry of the strategy that (directly or through other indicators) owns "owner", or None'''
+    while owner is not None:
+        registry = getattr(owner, 'registry', None)
+        if isinstance(registry, IndicatorRegistry):
+            return registry
+        owner = getattr(owner, '_owner', None)
+    return None
+
+
+def shared_indicator(owner, indicator, *datas, **kwargs):
+    ''' indicator(*datas, **kwargs) from the registry of the strategy running "owner",
+    built directly when there is no registry (the indicator used outside such a strategy).
+    A shared instance belongs to its first requester and is computed before the later ones. An indicator
+    getting another's instance takes its minimum period like it would for a sub-indicator of its own,
+    so request after addminperiod.'''
+    registry = find_registry(owner)
+    if registry is None:
+        return indicator(*datas, **kwargs)
+    instance = registry.get(indicator, *datas, **kwargs)
+    if isinstance(owner, bt.Indicator) and instance._owner is not owner:
+        for line in owner.lines:
+            line.updateminperiod(instance._minperiod)
+    return instance
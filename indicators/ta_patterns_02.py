@@ -3,39 +3,70 @@
 import backtrader as bt
 from matplotlib.pyplot import plot
 import numpy as np
+import talib
+from talib import abstract
 from collections import deque
 
-class CustomIndicator(bt.Indicator):
-    lines = ('custom_indicator',)
-    plotinfo = dict(plot=False)  # Do not plot 'custom_indicator'
 
-    def __init__(self, pattern, data, penetration=None, buffer_length=3):
-        self.pattern = pattern
-        self.data = data
-        self.penetration = penetration
-        self.buffer = deque(maxlen=buffer_length)
-        super().__init__()
-
-        # Call the TA-Lib function with the data
-        if self.penetration is not None:
-            self.pattern_value = self.pattern(self.data.open, self.data.high, self.data.low, self.data.close, penetration=self.penetration)
-        else:
-            self.pattern_value = self.pattern(self.data.open, self.data.high, self.data.low, self.data.close)
-
-    def next(self):
-        # Assign the latest result to the line object if it's not NaN
-        if not np.isnan(self.pattern_value[-1]) :
-            self.lines.custom_indicator[0] = self.pattern_value[-1]
-            self.buffer.append(self.lines.custom_indicator[0])  # Add the value to the buffer
-            # if (self.pattern_value[-1] != 0):
-            #     # Print the recognized pattern and its value
-            #     print(f"{bt.num2date(self.data.datetime[0])}\t pattern: {self.pattern.__name__}, Value: {self.lines.custom_indicator[0]}")
+def pattern_name(pattern):
+    ''' TA-Lib function name of a pattern given as a bt.talib indicator (bt.talib.CDLDOJI) or by name'''
+    return getattr(pattern, '__name__', pattern)
+
+
+def pattern_lookback(pattern, penetration=None):
+    function = abstract.Function(pattern_name(pattern))
+    if penetration is not None:
+        function.set_function_args(penetration=penetration)
+    return function.lookback
+
+
+def pattern_bank(open_, high, low, close, patterns):
+    ''' Every CDL function of "patterns" ((pattern, penetration) pairs) called once on the whole OHLC arrays.
+    Returns an int16 matrix with one row per bar and one column per pattern (TA-Lib gives 0, +-80, +-100 or +-200).
+    Bars before a pattern's lookback hold 0. A pattern listed twice is computed once and fills both columns.'''
+    inputs = [np.ascontiguousarray(x, dtype=np.float64) for x in (open_, high, low, close)]
+    bank = np.empty((len(inputs[0]), len(patterns)), dtype=np.int16)
+    computed = {}
+    for column, (pattern, penetration) in enumerate(patterns):
+        key = (pattern_name(pattern), penetration)
+        if key not in computed:
+            kwargs = {} if penetration is None else dict(penetration=penetration)
+            computed[key] = getattr(talib, key[0])(*inputs, **kwargs)
+        bank[:, column] = computed[key]
+    return bank
+
+
+def buffer_sums(bank, buffer_length=3):
+    ''' Sum of the bank over the "buffer_length" bars before every bar (all patterns), from a cumulative sum'''
+    totals = np.concatenate(([0], np.cumsum(bank.sum(axis=1, dtype=np.int64))))
+    bars = np.arange(len(bank))
+    return totals[bars] - totals[np.maximum(bars - buffer_length, 0)]
+
+
+def ta_patterns(open_, high, low, close, patterns, strong_patterns, buffer_length=3, lookback=None):
+    ''' TaPatterns signal, strong_bull and strong_bear lines for the whole series, one indicator call per bar
+    (runonce, or a feed whose bars each reach the strategy once).
+    signal: pattern values of the previous "buffer_length" bars summed over "patterns".
+    strong_bull/strong_bear: 1.0 where one of "strong_patterns" gives +100/-100 on the bar.
+    NaN until the longest lookback (of all the patterns if not given) has passed, like the indicator's lines.'''
+    signal = buffer_sums(pattern_bank(open_, high, low, close, patterns), buffer_length).astype(np.float64)
+    strong = pattern_bank(open_, high, low, close, strong_patterns)
+    strong_buy = (strong == 100).any(axis=1).astype(np.float64)
+    strong_sell = (strong == -100).any(axis=1).astype(np.float64)
+    if lookback is None:
+        lookback = max(pattern_lookback(pattern, penetration) for pattern, penetration in patterns + strong_patterns)
+    for line in (signal, strong_buy, strong_sell):
+        line[:lookback] = np.nan
+    return signal, strong_buy, strong_sell
 
-    def get_buffer_sum(self):
-        return sum(self.buffer)
 
 class TaPatterns(bt.Indicator):
-    lines = ('signal',)
+    ''' Sum of the TA-Lib candlestick patterns of the last calls, computed by pattern_bank: one TA-Lib call per
+    pattern on the bars the signal needs (next) or on the whole series (once), no indicator per pattern.
+    Every call adds the previous bar's pattern sum to a buffer of "buffer_length" calls, so when the
+    strategy runs several times per bar (a 30m data1 with 5m data0, replayed or resampled) the signal
+    changes within the bar. With one call per bar it is the sum of the previous "buffer_length" bars.'''
+    lines = ('signal', 'strong_bull', 'strong_bear')
 
     params = dict(
         patterns=[(bt.talib.CDLTRISTAR, None),
@@ -83,39 +114,60 @@ class TaPatterns(bt.Indicator):
                 (bt.talib.CDLBELTHOLD, None),
                 (bt.talib.CDLADVANCEBLOCK, None),
                 (bt.talib.CDLABANDONEDBABY, 0.5)],        
+        strong_patterns=[(bt.talib.CDLKICKING, None),
+                (bt.talib.CDLHAMMER, None),
+                (bt.talib.CDLPIERCING, None),
+                (bt.talib.CDLENGULFING, None),
+                (bt.talib.CDLINVERTEDHAMMER, None)],
+        buffer_length=3,  # bars summed into the signal
         threshold=0
     )
 
     def __init__(self):
         super().__init__()
-        self.patterns = [CustomIndicator(pattern=pattern, data=self.data, penetration=penetration) for pattern, penetration in self.params.patterns]
-
-        self.kicking = bt.talib.CDLKICKING(self.data.open, self.data.high, self.data.low, self.data.close)
-        self.hammer = bt.talib.CDLHAMMER(self.data.open, self.data.high, self.data.low, self.data.close)
-        self.piercing = bt.talib.CDLPIERCING(self.data.open, self.data.high, self.data.low, self.data.close)
-        self.engulfing = bt.talib.CDLENGULFING(self.data.open, self.data.high, self.data.low, self.data.close)
-        self.inv_hammer = bt.talib.CDLINVERTEDHAMMER(self.data.open, self.data.high, self.data.low, self.data.close)
-
+        patterns = self.params.patterns + self.params.strong_patterns
+        self.lookback = max(pattern_lookback(pattern, penetration) for pattern, penetration in patterns)
+        self.addminperiod(self.lookback + 1)
+        # Bars passed to TA-Lib: the current one, the previous one and the lookback before it
+        self.window = self.lookback + 2
+        self.buffer = deque(maxlen=self.params.buffer_length)  # previous bar's pattern sum at each call
+        self.previous_bar = None  # (bar count, pattern sum of the bar before it), the same on every call of a bar
+
+    def ohlc(self, size):
+        size = min(size, len(self.data))
+        return [np.array(line.get(size=size)) for line in (self.data.open, self.data.high, self.data.low, self.data.close)]
+
+    def add_call(self):
+        # The previous bar is complete, its sum only changes when a new bar starts
+        if self.previous_bar is None or self.previous_bar[0] != len(self.data):
+            bank = pattern_bank(*self.ohlc(self.window), self.params.patterns)
+            self.previous_bar = len(self.data), int(bank[-2].sum()) if len(bank) > 1 else 0
+        self.buffer.append(self.previous_bar[1])
+
+    def prenext(self):
+        self.add_call()
 
     def next(self):
-        # Sum up the actual pattern values
-        self.lines.signal[0] = sum(ci.get_buffer_sum() for ci in self.patterns)
-        # if self.lines.signal[0] != 0:
-        #     print(f"Signal: {self.lines.signal[0]}")
+        self.add_call()
+        strong = pattern_bank(*self.ohlc(self.lookback + 1), self.params.strong_patterns)[-1]
+        self.lines.signal[0] = sum(self.buffer)
+        self.lines.strong_bull[0] = float((strong == 100).any())
+        self.lines.strong_bear[0] = float((strong == -100).any())
+
+    def once(self, start, end):
+        ohlc = [np.array(line.array[:end]) for line in (self.data.open, self.data.high, self.data.low, self.data.close)]
+        values = ta_patterns(*ohlc, self.params.patterns, self.params.strong_patterns, self.params.buffer_length,
+                             self.lookback)
+        for line, value in zip(self.lines, values):
+            dst = line.array
+            for i in range(start, end):
+                dst[i] = value[i]
 
     def strong_buy(self):
-        return self.kicking[0] == 100 or \
-               self.hammer[0] == 100 or \
-               self.piercing[0] == 100 or \
-               self.engulfing[0] == 100 or \
-               self.inv_hammer[0] == 100
+        return self.lines.strong_bull[0] == 1
     
     def strong_sell(self):
-        return self.kicking[0] == -100 or \
-               self.hammer[0] == -100 or \
-               self.piercing[0] == -100 or \
-               self.engulfing[0] == -100 or \
-               self.inv_hammer[0] == -100
+        return self.lines.strong_bear[0] == 1
 
     def signal_buy(self):
         return (self.lines.signal[0] > self.params.threshold) or self.strong_buy()
@@ -0,0 +1,460 @@
+# live_runner.py
+# Event-driven live trading of HeikinAshiStrategy on asyncio, without the Cerebro polling loop.
+# Closed 5m candles come from the Binance USD-M futures kline websocket (or a replay of cached candles),
+# every closed candle updates the forming 30m bar, the strategy's entry/exit conditions are evaluated on it
+# with the NumPy indicator code of the backtests, and the orders go out through the async ccxt client.
+#
+#   python live_runner.py                          # live trading with the strategy defaults
+#   python live_runner.py --optimized --notify     # best_params.json, Telegram notifications
+#   python live_runner.py --dry-run                # live candles, paper orders
+#   python live_runner.py --replay 5 --speed 0.05  # last 5 cached days, paper orders
+
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from types import SimpleNamespace
+import datetime as dt
+import aiohttp
+import backtrader as bt
+import ccxt.async_support as ccxt_async
+import numpy as np
+import pandas as pd
+import pytz
+
+from data_feed import BinanceFuturesData
+from GMT30_strat02_btest import HeikinAshiStrategy
+from indicators.pivot_point import DailyPivot
+from indicators.precompute import aggregate_bars, pivot_crossings, precompute_indicators
+from trade_stats import TradeStats
+from vector_backtest import strategy_conditions, ta_pattern_threshold
+
+SYMBOL = 'GMTUSDT'
+TIMEFRAME = '5m'  # base candles
+CANDLE_MS = 5 * 60 * 1000
+COMPRESSION = 30  # minutes of the signal bars (data1)
+LEVERAGE = 10.0
+COMMISSION = 0.0004
+WINDOW_BARS = 500  # 30m bars the indicators are computed on, about 10 days
+FUTURES_WS = 'wss://fstream.binance.com/ws'
+RECONNECT_DELAY = 5
+OHLCV = ('open', 'high', 'low', 'close', 'volume')
+kiev_tz = pytz.timezone('Europe/Kiev')
+
+
+def load_params(optimized=False, filename='best_params.json'):
+    ''' HeikinAshiStrategy params, with the GA genes from "filename" if optimized'''
+    p = HeikinAshiStrategy.params()
+    if optimized:
+        with open(filename, 'r') as f:
+            best_params = json.load(f)
+        # best_params follows the order of the strategy params
+        for name, value in zip(HeikinAshiStrategy.params._getkeys(), best_params):
+            setattr(p, name, value)
+    return p
+
+
+def closed_candles(frame, now_ms=None):
+    ''' ccxt OHLCV rows of the candles in "frame" that are closed at "now_ms"'''
+    now_ms = now_ms if now_ms is not None else time.time() * 1000
+    stamps = frame.index.values.astype('datetime64[ms]').astype(np.int64)
+    rows = frame[list(OHLCV)].to_numpy().tolist()
+    return [[int(stamp)] + row for stamp, row in zip(stamps, rows) if stamp + CANDLE_MS <= now_ms]
+
+
+async def fetch_candles(exchange, since, until, symbol=SYMBOL):
+    ''' Closed candles with open times from "since" to "until" (ms) through the REST API'''
+    rows = []
+    while since <= until:
+        page = await exchange.fetch_ohlcv(symbol, timeframe=TIMEFRAME, since=since, limit=1000)
+        page = [row for row in page if since <= row[0] <= until]
+        if not page:
+            break
+        rows += page
+        since = page[-1][0] + CANDLE_MS
+    return rows
+
+
+async def binance_klines(exchange, since=None, symbol=SYMBOL):
+    ''' Closed candles from the kline websocket as (ccxt OHLCV row, perf_counter time received).
+    Candles missed while the stream was down are fetched through REST when it is back, so the rows stay
+    continuous from "since" (open time of the first candle wanted) on.'''
+    url = f'{FUTURES_WS}/{symbol.lower()}@kline_{TIMEFRAME}'
+    expected = since
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.ws_connect(url, heartbeat=30) as ws:
+                    async for message in ws:
+                        if message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+                        if message.type != aiohttp.WSMsgType.TEXT:
+                            continue
+                        kline = json.loads(message.data)['k']
+                        if not kline['x']:  # the candle is still open
+                            continue
+                        received = time.perf_counter()
+                        row = [kline['t']] + [float(kline[key]) for key in ('o', 'h', 'l', 'c', 'v')]
+                        if expected is not None and row[0] > expected:
+                            for missed in await fetch_candles(exchange, expected, row[0] - CANDLE_MS, symbol):
+                                yield missed, time.perf_counter()
+                        if expected is None or row[0] >= expected:
+                            expected = row[0] + CANDLE_MS
+                            yield row, received
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Kline stream error: {e}")
+            print(f"Kline stream closed, reconnecting in {RECONNECT_DELAY} s")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+async def replay_klines(rows, speed=0.0):
+    ''' Local stand-in for binance_klines: the candles of "rows", "speed" seconds apart'''
+    for row in rows:
+        yield row, time.perf_counter()
+        await asyncio.sleep(speed)
+
+
+class SignalEngine:
+    ''' HeikinAshiStrategy's conditions on the forming 30m bar after every closed candle, like the replayed
+    data1 of live_trading.py. The last WINDOW_BARS bars of candles are kept and the indicators are computed
+    on them with precompute_indicators, the bar by bar equivalents of the strategy's indicators.
+    MyPivotPoint runs once per candle in a replay, so its levels are kept candle by candle with a DailyPivot
+    on the forming bar, with the days in the timezone "tz" like the live feed.
+    No other indicator state is kept: signals() recomputes every indicator over the bounded window after each
+    candle, about 65 ms per candle with the default window (live case of benchmark.py), a small fraction of
+    the 5 minutes until the next candle closes.'''
+
+    def __init__(self, params, window_bars=WINDOW_BARS, tz=kiev_tz):
+        self.p = params
+        self.candles = deque(maxlen=window_bars * COMPRESSION * 60 * 1000 // CANDLE_MS)
+        self.tz = tz
+        self.pivot = DailyPivot()
+        self.levels = (np.nan,) * 5
+        self.bar = None  # forming bar number, bars group the candles like bar_bins
+        self.bar_high = self.bar_low = None
+
+    def warm_up(self, rows):
+        for row in rows:
+            self.track(row)
+        self.candles.extend(rows)
+
+    def add(self, row):
+        ''' Add a closed candle, returns the signals of the bar it belongs to (None until there are 2 bars)'''
+        self.track(row)
+        self.candles.append(row)
+        return self.signals()
+
+    def track(self, row):
+        ''' Run the pivot levels on the forming bar with this candle, what MyPivotPoint sees on data1'''
+        stamp, _, high, low, close, _ = row
+        bar = -(-int(stamp) // (COMPRESSION * 60 * 1000))
+        if bar != self.bar:
+            self.bar, self.bar_high, self.bar_low = bar, high, low
+        else:
+            self.bar_high, self.bar_low = max(self.bar_high, high), min(self.bar_low, low)
+        dt_num = bt.date2num(dt.datetime.fromtimestamp(stamp / 1000, dt.timezone.utc))
+        self.levels = self.pivot.update(bar, dt_num, self.bar_high, self.bar_low, close, self.tz)
+
+    def signals(self):
+        records = np.array(self.candles, dtype=np.float64)
+        frame = pd.DataFrame(records[:, 1:], columns=OHLCV,
+                             index=pd.to_datetime(records[:, 0].astype(np.int64), unit='ms', utc=True))
+        bars = aggregate_bars(frame, COMPRESSION).iloc[1:]  # the first bar can miss candles that left the window
+        if len(bars) < 2:
+            return None
+        bars = precompute_indicators(bars, self.p)
+        pivot_buy, pivot_sell = pivot_crossings(bars['ha_close'].to_numpy()[-4:], *self.levels[1:])
+        bars.iloc[-1, bars.columns.get_indexer(['pivot_buy', 'pivot_sell'])] = pivot_buy[-1], pivot_sell[-1]
+        buy, sell, stop_buy, stop_sell = strategy_conditions(bars, ta_threshold=ta_pattern_threshold(self.p))
+        last = bars.iloc[-1]
+        return SimpleNamespace(
+            time=frame.index[-1], ready=bool(last['ready']),
+            buy=bool(buy[-1]), sell=bool(sell[-1]), stop_buy=bool(stop_buy[-1]), stop_sell=bool(stop_sell[-1]),
+            high=last['high'], low=last['low'], close=last['close'], volume=last['volume'],
+            ha_open=last['ha_open'], ha_high=last['ha_high'], ha_low=last['ha_low'], ha_close=last['ha_close'])
+
+
+class ExchangeBroker:
+    ''' Market orders, balance and position on Binance USD-M futures through the async ccxt client'''
+
+    def __init__(self, exchange, symbol=SYMBOL, leverage=LEVERAGE):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.leverage = leverage
+
+    async def start(self):
+        await self.exchange.load_markets()
+        try:
+            await self.exchange.set_leverage(int(self.leverage), self.symbol)
+        except ccxt_async.BaseError as e:
+            print(f"Could not set the leverage: {e}")
+
+    def mark(self, price):
+        pass  # the exchange marks the position itself
+
+    async def refresh(self):
+        ''' Account value (USDT wallet + unrealized PnL) and signed position size'''
+        balance, positions = await asyncio.gather(self.exchange.fetch_balance(),
+                                                  self.exchange.fetch_positions([self.symbol]))
+        size = 0.0
+        for position in positions:
+            contracts = position.get('contracts') or 0.0
+            size += contracts if position.get('side') == 'long' else -contracts
+        return float(balance['total'].get('USDT', 0.0)), size
+
+    async def market_order(self, side, amount, reduce_only=False):
+        ''' Send a market order, returns the fill: price, amount and fee'''
+        amount = float(self.exchange.amount_to_precision(self.symbol, amount))
+        order = await self.exchange.create_order(self.symbol, 'market', side, amount,
+                                                 params={'reduceOnly': True} if reduce_only else {})
+        fee = (order.get('fee') or {}).get('cost') or 0.0
+        return SimpleNamespace(price=order.get('average') or order.get('price'),
+                               amount=order.get('filled') or amount, fee=fee)
+
+    async def close(self):
+        await self.exchange.close()
+
+
+class PaperBroker:
+    ''' Stand-in for ExchangeBroker in replays and dry runs: fills market orders at the last close with a
+    percentage commission, the value is the cash plus the PnL of the open position'''
+
+    def __init__(self, cash=100.0, leverage=LEVERAGE, commission=COMMISSION):
+        self.cash = cash
+        self.leverage = leverage
+        self.commission = commission
+        self.size = 0.0
+        self.price = 0.0
+        self.last = 0.0
+
+    async def start(self):
+        pass
+
+    def mark(self, price):
+        self.last = price
+
+    async def refresh(self):
+        return self.cash + self.size * (self.last - self.price), self.size
+
+    async def market_order(self, side, amount, reduce_only=False):
+        change = amount if side == 'buy' else -amount
+        fee = abs(change) * self.last * self.commission
+        if self.size and (self.size > 0) != (change > 0):
+            self.cash += -change * (self.last - self.price)  # closing part
+        if not self.size:
+            self.price = self.last
+        self.size += change
+        self.cash -= fee
+        return SimpleNamespace(price=self.last, amount=amount, fee=fee)
+
+    async def close(self):
+        pass
+
+
+class LiveRunner:
+    ''' HeikinAshiStrategy.next on every closed candle: entries sized on the forming bar, exits on the opposite
+    or stop signals and the stop-loss. Orders are sent as soon as the candle's signals are known; the account
+    value and position are refreshed in the background afterwards, so a decision never waits for them.'''
+
+    def __init__(self, engine, broker, params, notifier=None, plot_file=None):
+        self.engine = engine
+        self.broker = broker
+        self.p = params
+        self.notifier = notifier
+        self.plot_file = plot_file
+        self.trade_stats = TradeStats(params.num_past_trades)
+        self.value = 0.0
+        self.position = 0.0
+        self.entry_price = 0.0
+        self.day = None
+        self.day_value = None
+        self.daily_trades = 0
+        self.tasks = set()
+
+    async def run(self, klines):
+        await self.broker.start()
+        self.value, self.position = await self.broker.refresh()
+        self.notify(f"STARTING LIVE TRADING!\nPortfolio value: {self.value:.2f} $")
+        async for row, received in klines:
+            await self.on_candle(row, received)
+
+    async def on_candle(self, row, received):
+        self.broker.mark(row[4])
+        # The indicators take a few ms of NumPy/TA-Lib, off the event loop
+        signals = await asyncio.to_thread(self.engine.add, row)
+        if signals is None:
+            return
+        self.write_plot(signals)
+        self.daily_summary(signals.time)
+        if signals.ready:
+            decided = time.perf_counter()
+            orders = self.decide(signals)
+            for side, amount, reduce_only, reason in orders:
+                fill = await self.broker.market_order(side, amount, reduce_only)
+                self.on_fill(side, fill, reduce_only, reason, signals.time)
+            if orders:
+                sent = time.perf_counter()
+                print(f"{signals.time.astimezone(kiev_tz)}  signals {1000 * (decided - received):.1f} ms, "
+                      f"orders {1000 * (sent - decided):.1f} ms")
+        self.background(self.refresh())
+
+    def decide(self, s):
+        ''' Orders of HeikinAshiStrategy.next for the signals "s": (side, amount, reduce only, reason)'''
+        p = self.p
+        if self.position == 0 and (s.buy or s.sell):
+            if p.use_kelly:
+                trade_amount1 = p.trade_coef / 2
+                free_money = self.value * (trade_amount1 + (trade_amount1 * self.trade_stats.kelly_coef))
+            else:
+                free_money = self.value * p.trade_coef
+            # Sized on the high (long) or low (short) of the forming bar
+            price = s.high if s.buy else s.low
+            size = int(LEVERAGE * (free_money // price))
+            if not size:
+                return []
+            return [('buy', size, False, 'LONG') if s.buy else ('sell', size, False, 'SHORT')]
+
+        if (self.position > 0 and (s.sell or s.stop_buy)) or (self.position < 0 and (s.buy or s.stop_sell)):
+            return [self.close_order('CLOSED')]
+
+        if p.sl_percent != 0:
+            sl_value = p.sl_percent / 100
+            if ((self.position > 0) and ((self.entry_price * (1 - sl_value)) > s.close)) or \
+                    ((self.position < 0) and ((self.entry_price * (1 + sl_value)) < s.close)):
+                return [self.close_order('STOP-LOSS')]
+        return []
+
+    def close_order(self, reason):
+        return ('sell' if self.position > 0 else 'buy', abs(self.position), True, reason)
+
+    def on_fill(self, side, fill, reduce_only, reason, bar_time):
+        change = fill.amount if side == 'buy' else -fill.amount
+        if reduce_only:
+            pnl = -change * (fill.price - self.entry_price) - fill.fee
+            self.trade_stats.add(pnl)
+            self.daily_trades += 1
+            self.position = 0.0
+            text = f"{reason} at {fill.price:.4f}, net profit: {pnl:.2f} $"
+        else:
+            self.position += change
+            self.entry_price = fill.price
+            text = f"---- {reason} ---- size = {fill.amount:.2f} at price = {fill.price:.4f}"
+        print(f"{bar_time.astimezone(kiev_tz)}  {text}")
+        self.notify(f"{bar_time.astimezone(kiev_tz)}\n{text}\nPortfolio value: {self.value:.2f} $")
+
+    async def refresh(self):
+        try:
+            self.value, self.position = await self.broker.refresh()
+        except ccxt_async.BaseError as e:
+            print(f"Could not refresh the account: {e}")
+
+    def daily_summary(self, bar_time):
+        day = bar_time.astimezone(kiev_tz).date()
+        if self.day is not None and day != self.day:
+            self.notify(f"Daily PnL: {self.value - self.day_value:.2f}\n"
+                        f"Number of trades today: {self.daily_trades}\n"
+                        f"Current portfolio value: {self.value:.2f}")
+            self.daily_trades = 0
+        if day != self.day:
+            self.day, self.day_value = day, self.value
+
+    def write_plot(self, s):
+        ''' Heikin Ashi bar for plot_live.py, like the live strategy's data.csv'''
+        if self.plot_file is not None:
+            self.plot_file.write(f'{s.time.astimezone(kiev_tz)},{s.ha_open},{s.ha_high},{s.ha_low},{s.ha_close},{s.volume}\n')
+            self.plot_file.flush()
+
+    def notify(self, text):
+        if self.notifier is not None:
+            self.notifier.notify(text)  # queued, TG_Notifier sends it from its own thread
+
+    def background(self, coroutine):
+        ''' Run "coroutine" without waiting for it, errors are printed'''
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Background task failed: {task.exception()}")
+
+    async def stop(self):
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.broker.close()
+
+
+def create_exchange(keys_file=None):
+    ''' Async binanceusdm client, authenticated with the keys of "keys_file" (params.json) if given'''
+    config = {'enableRateLimit': True, 'options': {'defaultType': 'future'}}
+    if keys_file is not None:
+        with open(keys_file, 'r') as f:
+            keys = json.load(f)
+        config.update(apiKey=keys["binance"]["apikey"], secret=keys["binance"]["secret"])
+    return ccxt_async.binanceusdm(config)
+
+
+async def main(args):
+    p = load_params(args.optimized)
+    engine = SignalEngine(p, args.window_bars)
+    warm_up_days = args.window_bars * COMPRESSION // (24 * 60) + 1
+    exchange = None
+    notifier = None
+    if args.notify:
+        import api_config
+        import TGnotify
+        notifier = TGnotify.TG_Notifier(api_config.TG_BOT_API, api_config.TG_BOT_ID)
+
+    if args.replay:
+        records = BinanceFuturesData.load_cache(SYMBOL, TIMEFRAME)
+        rows = closed_candles(BinanceFuturesData._to_frame(records))[-(warm_up_days + args.replay) * 288:]
+        if len(rows) <= warm_up_days * 288:
+            print(f"The data cache holds less than {warm_up_days + args.replay} days of {SYMBOL} {TIMEFRAME} candles")
+            return
+        engine.warm_up(rows[:-args.replay * 288])
+        klines = replay_klines(rows[-args.replay * 288:], args.speed)
+        broker = PaperBroker(args.cash)
+    else:
+        exchange = create_exchange(None if args.dry_run else args.keys)
+        start = dt.datetime.now(tz=pytz.utc) - dt.timedelta(days=warm_up_days)
+        history = await asyncio.to_thread(BinanceFuturesData.fetch_data, SYMBOL, start, None, TIMEFRAME)
+        rows = closed_candles(history)
+        engine.warm_up(rows)
+        klines = binance_klines(exchange, since=rows[-1][0] + CANDLE_MS if rows else None)
+        broker = PaperBroker(args.cash) if args.dry_run else ExchangeBroker(exchange)
+
+    runner = LiveRunner(engine, broker, p, notifier,
+                        plot_file=open(args.plot_file, 'w') if args.plot_file else None)
+    if runner.plot_file is not None:
+        runner.plot_file.write('datetime,open,high,low,close,volume\n')
+    try:
+        await runner.run(klines)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("Interrupted by user")
+    finally:
+        runner.notify("LIVE TRADING STOPPED!")
+        await runner.stop()
+        if exchange is not None and exchange is not getattr(broker, 'exchange', None):
+            await exchange.close()
+        if notifier is not None:
+            await asyncio.to_thread(notifier.close)
+        if runner.plot_file is not None:
+            runner.plot_file.close()
+        print(f"Portfolio value: {runner.value:.2f} $, position: {runner.position}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run HeikinAshiStrategy live on the Binance kline stream.')
+    parser.add_argument('--optimized', action='store_true', help='Use the parameters in best_params.json')
+    parser.add_argument('--keys', default='params.json', help='File with the Binance API keys')
+    parser.add_argument('--dry-run', action='store_true', help='Live candles, paper orders')
+    parser.add_argument('--replay', type=int, default=0, metavar='DAYS',
+                        help='Replay the last DAYS of cached candles with paper orders')
+    parser.add_argument('--speed', type=float, default=0.0, help='Seconds between replayed candles')
+    parser.add_argument('--cash', type=float, default=100.0, help='Starting cash of the paper broker')
+    parser.add_argument('--window-bars', type=int, default=WINDOW_BARS, help='30m bars the indicators see')
+    parser.add_argument('--notify', action='store_true', help='Send Telegram notifications')
+    parser.add_argument('--plot-file', default='data.csv', help='Heikin Ashi bars for plot_live.py, "" for none')
+    asyncio.run(main(parser.parse_args()))
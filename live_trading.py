@@ -46,7 +46,7 @@ if optimized:
             best_params = json.load(f)
     except (FileNotFoundError, json.JSONDecodeError) as e:
         print(f"Error loading best parameters: {e}")
-        asyncio.run(notifier.send_message(f"Error loading best parameters: {e}"))
+        notifier.notify(f"Error loading best parameters: {e}")
         # Use the default parameters from the strategy
         best_params = (
             HeikinAshiStrategy.params.fast_ema,
@@ -195,10 +195,10 @@ server_time = store.exchange.fetch_time()
 local_time = time.time() * 1000  # convert to milliseconds
 time_difference = round(server_time - local_time)
 print(f"Time difference between local machine and Binance server: {time_difference} ms")
-asyncio.run(notifier.send_message(
+notifier.notify(
     f"STARTING LIVE TRADING!\n"
     f"\n"
-    f"Time difference with Binance server: {time_difference} ms"))
+    f"Time difference with Binance server: {time_difference} ms")
 
 
 # create a timezone object for your timezone
@@ -241,15 +241,15 @@ try:
 
 except (KeyboardInterrupt, SystemExit, StopIteration, InterruptedError):
     print("Interrupted by user")
-    asyncio.run(notifier.send_message(f"LIVE TRADING STOPTED!\n"
-                                      f"___________________________\n"
-                                      f"Interrupted by user"))
+    notifier.notify(f"LIVE TRADING STOPTED!\n"
+                    f"___________________________\n"
+                    f"Interrupted by user")
     
 except (subprocess.CalledProcessError, subprocess.TimeoutExpired, subprocess.SubprocessError):
     print("Strategy execution timed out")
-    asyncio.run(notifier.send_message(f"LIVE TRADING STOPTED!\n"
-                                      f"___________________________\n"
-                                      f"Strategy execution stopped"))
+    notifier.notify(f"LIVE TRADING STOPTED!\n"
+                    f"___________________________\n"
+                    f"Strategy execution stopped")
     
 finally:
     # This code will be executed whether an exception occurs or not
@@ -261,6 +261,6 @@ finally:
     print()
 
     # Closing the notifier connections
-    asyncio.run(notifier.close())
+    notifier.close()
 
     cerebro.plot()
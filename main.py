@@ -11,6 +11,7 @@ from deap import base, creator, tools, algorithms
 import datetime as dt
 from tabulate import tabulate
 from trade_list_analyzer import trade_list
+from profile_analyzer import HotPathProfiler
 import numpy as np
 import multiprocessing
 from concurrent.futures import ProcessPoolExecutor
@@ -27,6 +28,7 @@ from datetime import datetime
 
 from data_feed import BinanceFuturesData
 from GMT30_strat02_btest import HeikinAshiStrategy
+from indicators.precompute import PRECOMPUTED_NOTE, PartialBarData, PrecomputedData, precompute_bars, with_partial_bars
 from optimizer_01 import main
 
 import warnings
@@ -43,14 +45,25 @@ end_date = dt.datetime.strptime("2023-07-25 00:00:00", "%Y-%m-%d %H:%M:%S")
 timeframe =  'Minutes' # 'Hours' #  
 compression = 5
 use_optimization = False
-
-
+concurrent_download = False  # Fetch missing history with parallel paginated requests (opt-in, changes the request pacing)
+precomputed_indicators = False  # EXPERIMENTAL: compute the indicators once on completed 30m bars instead of on replayed data (no intrabar signals, results differ from the replay)
+vectorized_backtest = False  # Evaluate GA individuals with vector_backtest.py (results of the precomputed Cerebro run, needs precomputed_indicators)
+prune_max_drawdown = None  # Stop a GA backtest once its drawdown passes this many %, e.g. 50 (None = off)
+prune_min_value = None  # Stop a GA backtest once its value drops below this many USDT, e.g. 40 (None = off)
+sample_fraction = None  # Score GA individuals on this recent share of the range first, e.g. 0.2 (None = off)
+promote_fraction = 0.3  # Share of the sample-scored individuals that is backtested on the full range
+remote_address = None  # e.g. 6000 (localhost only) or ('192.168.1.10', 6000): run the GA backtests on distributed.py workers instead of a local Pool
+remote_authkey = os.environ.get('GMT_REMOTE_AUTHKEY', '').encode() or None  # Shared secret of the coordinator and its workers, required with remote_address
+steady_state = False  # Asynchronous steady-state GA: breed a new individual as soon as any backtest finishes
+profile_backtest = False  # Time the strategy's next, check_*_condition and indicator next/once calls (profile_report.csv)
+batch_size = None  # e.g. 10: send GA individuals to the workers in batches for vector_backtest.run_vector_backtest_batch, fewer pool tasks (vectorized only)
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description='Run backtest and get the "best_params".')
 parser.add_argument('--use_optimization', type=bool, default=False, help='Whether to use optimization')
 parser.add_argument("--start_date", help="Start date in YYYY-MM-DD HH:MM:SS format")
 parser.add_argument("--end_date", help="End date in YYYY-MM-DD HH:MM:SS format")
+parser.add_argument('--resume', action='store_true', help='Continue the optimization from its last checkpoint')
 
 args = parser.parse_args()
 
@@ -112,15 +125,27 @@ if __name__ == '__main__':
     # Ensure multiprocessing is supported
     multiprocessing.freeze_support()    
 
+    if vectorized_backtest and not precomputed_indicators:
+        # The GA would score individuals on completed bars and the final backtest would replay the data
+        raise ValueError("vectorized_backtest gives the precomputed Cerebro results, set precomputed_indicators too")
+    if precomputed_indicators:
+        print(PRECOMPUTED_NOTE)
+
     # Convert the specified timeframe to a Binance-compatible timeframe
     bt_timeframe, compression, binance_timeframe = convert_to_binance_timeframe(compression, timeframe)    
     
     # Fetch the data for the specified symbol and time range    
-    fetched_data = BinanceFuturesData.fetch_data(symbol, start_date, end_date, binance_timeframe)
+    fetched_data = BinanceFuturesData.fetch_data(symbol, start_date, end_date, binance_timeframe,
+                                                 concurrent=concurrent_download)
 
     if use_optimization:
         # Use the optimizer to find the best parameters for the strategy
-        best_params = main(symbol, start_date, end_date, bt_timeframe, compression, fetched_data)
+        best_params = main(symbol, start_date, end_date, bt_timeframe, compression, fetched_data,
+                           precomputed=precomputed_indicators, vectorized=vectorized_backtest,
+                           max_drawdown=prune_max_drawdown, min_value=prune_min_value,
+                           sample_fraction=sample_fraction, promote_fraction=promote_fraction,
+                           resume=args.resume, remote_address=remote_address, remote_authkey=remote_authkey,
+                           steady_state=steady_state, batch_size=batch_size)
     else:
         # Use the default parameters from the strategy
         best_params = (
@@ -168,22 +193,50 @@ if __name__ == '__main__':
     cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
     # cerebro.addanalyzer(bt.analyzers.Calmar, _name='calmar_ratio')
     cerebro.addanalyzer(trade_list, _name='trade_list')
+    if profile_backtest:
+        cerebro.addanalyzer(HotPathProfiler, _name='profiler')
 
     # Pass the fetched data to the BinanceFuturesData class
-    data_feed = BinanceFuturesData(
-        dataname=fetched_data,
-        fromdate=start_date,
-        todate=end_date,
-        timeframe=bt_timeframe,
-        compression=compression
-    )    
+    if precomputed_indicators:
+        # The base feed also carries the high and low of the forming 30m bar
+        data_feed = PartialBarData(
+            dataname=with_partial_bars(fetched_data, 30),
+            fromdate=start_date,
+            todate=end_date,
+            timeframe=bt_timeframe,
+            compression=compression
+        )
+    else:
+        data_feed = BinanceFuturesData(
+            dataname=fetched_data,
+            fromdate=start_date,
+            todate=end_date,
+            timeframe=bt_timeframe,
+            compression=compression
+        )    
 
     # Add the datafeed    
     cerebro.adddata(data_feed)
     data_feed.plotinfo.plot = False
     
-    # # Add resampling    
-    data1 = cerebro.replaydata(data_feed, timeframe=bt_timeframe, compression=30, name='data1')
+    if precomputed_indicators:
+        # best_params follows the order of the strategy params
+        params = HeikinAshiStrategy.params()
+        for name, value in zip(HeikinAshiStrategy.params._getkeys(), best_params):
+            setattr(params, name, value)
+        bars = precompute_bars(fetched_data, params, 30)
+        data1 = PrecomputedData(
+            dataname=bars,
+            fromdate=start_date,
+            todate=end_date,
+            timeframe=bt_timeframe,
+            compression=30,
+        )
+        cerebro.adddata(data1, name='data1')
+        data1.plotinfo.plot = False
+    else:
+        # # Add resampling    
+        data1 = cerebro.replaydata(data_feed, timeframe=bt_timeframe, compression=30, name='data1')
         
     # Set the starting cash and commission
     starting_cash = 100
@@ -228,6 +281,7 @@ if __name__ == '__main__':
         apo_fast=best_params[26],
         apo_slow=best_params[27],
         apo_matype=best_params[28],
+        precomputed=precomputed_indicators,
         
         
 
@@ -305,6 +359,14 @@ if __name__ == '__main__':
     print()
     print()
 
+    if profile_backtest:
+        profile = strat.analyzers.profiler.get_analysis()
+        strat.analyzers.profiler.write_report('profile_report.csv')
+        print(f"Profiled {profile['bars']} bars in {profile['seconds']:.2f} s ({profile['bars_per_second']:.0f} bars/s), "
+              f"full report in profile_report.csv")
+        print(tabulate(profile['rows'][:25], headers="keys", tablefmt="psql", floatfmt=".4f"))
+        print()
+
     # Print out the best parameters
     print("Best parameters found by GA:", best_params)
     print()   
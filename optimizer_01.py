@@ -1,15 +1,293 @@
 # optimizer_01.py
 
+import contextlib
 import datetime
+import math
 import multiprocessing
-from multiprocessing import Pool
+import queue
+from functools import partial
+from multiprocessing import Pool, shared_memory
 from deap import base, creator, tools, algorithms
 import random
 import numpy as np
-from data_feed import BinanceFuturesData
+from data_feed import BinanceFuturesData, timeframe_minutes
+from distributed import RemotePool, host_lock
 from GMT30_strat02_btest import HeikinAshiStrategy
+from indicators.precompute import PRECOMPUTED_NOTE, IndicatorCache, PartialBarData, PrecomputedData, precompute_bars, with_partial_bars
+from vector_backtest import date_range_slice, run_vector_backtest, run_vector_backtest_batch
 import backtrader as bt
 import pickle
+import hashlib
+import glob
+import os
+import tempfile
+import time
+import pandas as pd
+
+
+# OHLCV columns published to the worker processes; column 0 of the shared block is the timestamp in ms
+DATA_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+# Seconds the steady-state GA waits for a backtest before it submits the waiting individuals again
+TASK_TIMEOUT = 3600
+
+# Genes of an individual: the first HeikinAshiStrategy params, in order
+GA_PARAMS = 29
+
+# Per-process state set up once by init_worker
+worker_state = {}
+
+# Fitness of a pruned backtest: the worst value in the direction of every objective (final value, drawdown,
+# SQN, rtot), so every run that went to the end dominates it, however bad (SQN has no lower bound and rtot
+# can be -inf)
+PRUNED_FITNESS = (float('-inf'), float('inf'), float('-inf'), float('-inf'))
+
+# GA state written after every generation, main(resume=True) continues from it
+CHECKPOINT_FILE = 'ga_checkpoint.pkl'
+
+# Sources that decide the fitness of an individual, their hash is part of the cached results' key
+CODE_FILES = ('GMT30_strat02_btest.py', 'optimizer_01.py', 'vector_backtest.py', 'trade_stats.py', 'indicators/*.py')
+_code_version = None
+
+
+def code_version():
+    ''' Hash of the CODE_FILES, so results cached for an earlier version of the strategy are not reused'''
+    global _code_version
+    if _code_version is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha1()
+        for pattern in CODE_FILES:
+            for path in sorted(glob.glob(os.path.join(root, pattern))):
+                digest.update(os.path.relpath(path, root).replace(os.sep, '/').encode())
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def save_pickle(obj, filename):
+    ''' Pickle "obj" to a temp file of this process next to "filename", then rename it over "filename",
+    so an interrupted write or another run saving the same file at once never leaves a broken file'''
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', prefix=os.path.basename(filename) + '.',
+                                        suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def publish_data(fetched_data, name=None):
+    ''' Copy the fetched OHLCV frame once into a shared memory block (named "name" if given) that workers can
+    attach to. Row 0 is a header holding the number of candles, it is written last.'''
+    values = np.zeros((len(fetched_data) + 1, len(DATA_COLUMNS) + 1), dtype=np.float64)
+    values[1:, 0] = fetched_data.index.values.astype('datetime64[ms]').astype(np.int64)
+    values[1:, 1:] = fetched_data[DATA_COLUMNS].to_numpy(dtype=np.float64)
+
+    shm = shared_memory.SharedMemory(name=name, create=True, size=values.nbytes)
+    block = np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)
+    block[1:] = values[1:]
+    block[0, 0] = len(fetched_data)
+    return shm
+
+
+def dataset_fingerprint(fetched_data, start_date, end_date, bt_timeframe, compression, precomputed=False,
+                        vectorized=False, max_drawdown=None, min_value=None):
+    ''' Hash of the OHLCV values, backtest settings and strategy code, used to key cached results to one dataset'''
+    digest = hashlib.sha1()
+    digest.update(code_version().encode())
+    digest.update(fetched_data.index.values.astype('datetime64[ms]').astype(np.int64).tobytes())
+    digest.update(np.ascontiguousarray(fetched_data[DATA_COLUMNS].to_numpy(dtype=np.float64)).tobytes())
+    digest.update(repr((str(start_date), str(end_date), bt_timeframe, compression)).encode())
+    if precomputed:
+        digest.update(b'precomputed')  # completed 30m bars give different results than replaydata
+    if vectorized:
+        digest.update(b'vectorized')
+    if precomputed or vectorized:
+        digest.update(b'partial_bars')  # orders sized on the forming bar's high/low
+    if max_drawdown is not None or min_value is not None:
+        digest.update(repr(('pruning', max_drawdown, min_value)).encode())
+    return digest.hexdigest()
+
+
+def sample_start_date(fetched_data, start_date, end_date, fraction):
+    ''' Start of the last "fraction" of the backtest window, as a naive UTC datetime like the settings in main.py'''
+    window = fetched_data.index[date_range_slice(fetched_data.index, start_date, end_date)]
+    sample_start = window[-1] - fraction * (window[-1] - window[0])
+    return sample_start.tz_convert('UTC').tz_localize(None).to_pydatetime()
+
+
+def attach_data(shm_name, length=None):
+    ''' Attach to the shared OHLCV block and wrap it in a DataFrame without copying the prices.
+    Without "length" the number of candles is read from the header, waiting until the publisher has written it.'''
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    header = np.ndarray((len(DATA_COLUMNS) + 1,), dtype=np.float64, buffer=shm.buf)
+    deadline = time.monotonic() + 60
+    while length is None:
+        if header[0]:
+            length = int(header[0])
+        elif time.monotonic() > deadline:
+            shm.close()
+            raise TimeoutError(f"The shared data block {shm_name} was never filled in")
+        else:
+            time.sleep(0.05)
+    values = np.ndarray((length + 1, len(DATA_COLUMNS) + 1), dtype=np.float64, buffer=shm.buf)[1:]
+    index = pd.to_datetime(values[:, 0].astype(np.int64), unit='ms', utc=True)
+    index.name = 'datetime'
+    fetched_data = pd.DataFrame(values[:, 1:], index=index, columns=DATA_COLUMNS, copy=False)
+    return shm, fetched_data
+
+
+def init_worker(shm_name, length, start_date, end_date, bt_timeframe, compression, precomputed=False,
+                vectorized=False, max_drawdown=None, min_value=None, sample_start=None):
+    ''' Pool initializer: attach to the published data once per worker process'''
+    shm, fetched_data = attach_data(shm_name, length)
+    setup_worker(fetched_data, start_date, end_date, bt_timeframe, compression, precomputed, vectorized,
+                 max_drawdown, min_value, sample_start)
+    worker_state['shm'] = shm  # keep a reference so the block stays mapped
+
+
+def init_remote_worker(symbol, dataset_key, start_date, end_date, bt_timeframe, compression, precomputed=False,
+                       vectorized=False, max_drawdown=None, min_value=None, sample_start=None):
+    ''' RemotePool initializer: attach to the candles of this optimization published on this host, or load them
+    from the host's data cache, check they are the coordinator's and publish them for the other worker processes'''
+    name = 'gmt_' + dataset_key[:24]  # one block per dataset and host
+    with host_lock() or contextlib.nullcontext():
+        try:
+            shm, fetched_data = attach_data(name)
+        except FileNotFoundError:
+            binance_timeframe = next(name for name, minutes in timeframe_minutes.items() if minutes == compression)
+            fetched_data = BinanceFuturesData.fetch_data(symbol, start_date, end_date, binance_timeframe)
+            if dataset_fingerprint(fetched_data, start_date, end_date, bt_timeframe, compression) != dataset_key:
+                raise ValueError(f"The cached {symbol} {binance_timeframe} candles or the strategy code "
+                                 f"({code_version()[:8]}) differ from the coordinator's")
+            try:
+                published = publish_data(fetched_data, name)
+            except FileExistsError:
+                published = None  # another process of this host was faster
+            if published is not None:
+                # The block of the previous optimization is not needed by new workers, the attached ones keep it mapped
+                previous = worker_state.pop('published', None)
+                if previous is not None:
+                    previous.unlink()
+                worker_state['published'] = published
+            shm, fetched_data = attach_data(name)
+    setup_worker(fetched_data, start_date, end_date, bt_timeframe, compression, precomputed, vectorized,
+                 max_drawdown, min_value, sample_start)
+    worker_state['shm'] = shm  # keep a reference so the block stays mapped
+
+
+def setup_worker(fetched_data, start_date, end_date, bt_timeframe, compression, precomputed=False,
+                 vectorized=False, max_drawdown=None, min_value=None, sample_start=None):
+    worker_state.update(
+        fetched_data=fetched_data,
+        start_date=start_date,
+        end_date=end_date,
+        sample_start=sample_start,
+        bt_timeframe=bt_timeframe,
+        compression=compression,
+        precomputed=precomputed,
+        vectorized=vectorized,
+        max_drawdown=max_drawdown,
+        min_value=min_value,
+        # Indicator arrays computed for earlier individuals, reused when their parameters come up again
+        indicator_cache=IndicatorCache(dataset_fingerprint(fetched_data, start_date, end_date, bt_timeframe,
+                                                           compression)),
+    )
+
+
+class FitnessCache:
+    ''' Memo of evaluated parameter vectors for one dataset, persisted to disk between runs'''
+    cache_dir = 'fitness_cache'
+
+    def __init__(self, dataset_key):
+        self.filename = os.path.join(self.cache_dir, f'{dataset_key}.pkl')
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.isfile(self.filename):
+            try:
+                with open(self.filename, 'rb') as f:
+                    self.results = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError) as e:
+                print(f"Ignoring unreadable fitness cache {self.filename}: {e}")
+
+    def save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        save_pickle(self.results, self.filename)
+
+    def map(self, mapper, func, individuals):
+        ''' Evaluate only the parameter vectors not seen before (once each), then answer all from the cache'''
+        keys = [tuple(ind) for ind in individuals]
+        pending = list(dict.fromkeys(key for key in keys if key not in self.results))
+        self.misses += len(pending)
+        self.hits += len(keys) - len(pending)
+
+        if pending:
+            for key, fitness in zip(pending, mapper(func, pending)):
+                self.results[key] = fitness
+            self.save()
+
+        return [self.results[key] for key in keys]
+
+
+class SuccessiveHalving:
+    ''' Multi-fidelity map: new parameter vectors are first backtested on a short recent sample of the window,
+    then only the best "promote" fraction of them, picked by NSGA-II front and crowding distance, is backtested
+    on the full window. The others get PRUNED_FITNESS for this generation.'''
+    def __init__(self, full_cache, sample_cache, promote=0.3):
+        self.full_cache = full_cache
+        self.sample_cache = sample_cache
+        self.promote = promote
+        self.promoted = 0
+        self.dropped = 0
+
+    def map(self, mapper, func, individuals):
+        keys = [tuple(ind) for ind in individuals]
+        pending = list(dict.fromkeys(key for key in keys if key not in self.full_cache.results))
+
+        if pending:
+            candidates = []
+            for key, fitness in zip(pending, self.sample_cache.map(mapper, partial(func, sample=True), pending)):
+                candidate = creator.Individual(key)
+                candidate.fitness.values = fitness
+                candidates.append(candidate)
+            count = max(1, math.ceil(self.promote * len(candidates)))
+            promoted = [tuple(candidate) for candidate in tools.selNSGA2(candidates, count)]
+            self.promoted += len(promoted)
+            self.dropped += len(pending) - len(promoted)
+            self.full_cache.map(mapper, func, promoted)
+
+        return [self.full_cache.results.get(key, PRUNED_FITNESS) for key in keys]
+
+
+class PruneBacktest(bt.Analyzer):
+    ''' Stops the run once the drawdown (%) goes past max_drawdown or the value drops below min_value'''
+    params = (
+        ('max_drawdown', None),
+        ('min_value', None),
+    )
+
+    def start(self):
+        self.peak = float('-inf')
+        self.pruned = False
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        if self.pruned:
+            return
+        self.peak = max(self.peak, value)
+        drawdown = 100.0 * (self.peak - value) / self.peak
+        if (self.p.min_value is not None and value < self.p.min_value) or \
+                (self.p.max_drawdown is not None and drawdown > self.p.max_drawdown):
+            self.pruned = True
+            self.strategy.env.runstop()
+
+    def get_analysis(self):
+        return dict(pruned=self.pruned)
 
 
 def run_backtest(fast_ema, slow_ema, hma_length, atr_period, atr_threshold, dmi_length, dmi_threshold,
@@ -17,7 +295,8 @@ def run_backtest(fast_ema, slow_ema, hma_length, atr_period, atr_threshold, dmi_
                 sl_percent, kama_period, dma_period, dma_gainlimit, dma_hperiod, fast_ad, slow_ad, 
                 fastk_period, fastd_period, fastd_matype, mama_fastlimit, mama_slowlimit,
                 apo_fast, apo_slow, apo_matype,
-                fetched_data, start_date, end_date, bt_timeframe, compression):
+                fetched_data, start_date, end_date, bt_timeframe, compression, precomputed=False,
+                indicator_cache=None, max_drawdown=None, min_value=None):
     cerebro = bt.Cerebro(quicknotify=True)    
 
     cerebro.addobserver(bt.observers.DrawDown, plot=False)
@@ -25,38 +304,31 @@ def run_backtest(fast_ema, slow_ema, hma_length, atr_period, atr_threshold, dmi_
     cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
     cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
     cerebro.addanalyzer(bt.analyzers.SQN, _name='sqn')
+    if max_drawdown is not None or min_value is not None:
+        cerebro.addanalyzer(PruneBacktest, _name='prune', max_drawdown=max_drawdown, min_value=min_value)
 
-    data_feed = BinanceFuturesData(
-        dataname=fetched_data,
-        fromdate=start_date,
-        todate=end_date,
-        timeframe=bt.TimeFrame.Minutes,
-        compression=compression,
-    )    
+    if precomputed:
+        # The base feed also carries the high and low of the forming 30m bar
+        data_feed = PartialBarData(
+            dataname=with_partial_bars(fetched_data, 30, indicator_cache),
+            fromdate=start_date,
+            todate=end_date,
+            timeframe=bt.TimeFrame.Minutes,
+            compression=compression,
+        )
+    else:
+        data_feed = BinanceFuturesData(
+            dataname=fetched_data,
+            fromdate=start_date,
+            todate=end_date,
+            timeframe=bt.TimeFrame.Minutes,
+            compression=compression,
+        )    
 
     cerebro.adddata(data_feed)
     data_feed.plotinfo.plot = False
     
-    # # Add resampling    
-    data1 = cerebro.replaydata(data_feed, timeframe=bt_timeframe, compression=30, name='data1')
-    
-    # data2 = cerebro.resampledata(data1, timeframe=bt.TimeFrame.Days, compression=1, name='data2')
-    # data2.plotinfo.plot = False
-
-    # Set the starting cash and commission
-    starting_cash = 100
-    cerebro.broker.setcash(starting_cash)
-    cerebro.broker.setcommission(
-        automargin=True,         
-        leverage=10.0, 
-        commission=0.0004, 
-        commtype=bt.CommInfoBase.COMM_PERC,
-        stocklike=True,        
-    )  
-       
-
-    cerebro.addstrategy(
-        HeikinAshiStrategy,
+    strategy_params = dict(
         fast_ema=fast_ema,
         slow_ema=slow_ema,
         hma_length=hma_length,
@@ -86,8 +358,43 @@ def run_backtest(fast_ema, slow_ema, hma_length, atr_period, atr_threshold, dmi_
         apo_fast=apo_fast,
         apo_slow=apo_slow,
         apo_matype=apo_matype,
-
     )
+
+    if precomputed:
+        # All indicators are computed up front on completed 30m bars and read by the strategy from data1's columns
+        params = HeikinAshiStrategy.params()
+        for name, value in strategy_params.items():
+            setattr(params, name, value)
+        bars = precompute_bars(fetched_data, params, 30, indicator_cache)
+        data1 = PrecomputedData(
+            dataname=bars,
+            fromdate=start_date,
+            todate=end_date,
+            timeframe=bt_timeframe,
+            compression=30,
+        )
+        cerebro.adddata(data1, name='data1')
+        data1.plotinfo.plot = False
+    else:
+        # # Add resampling    
+        data1 = cerebro.replaydata(data_feed, timeframe=bt_timeframe, compression=30, name='data1')
+    
+    # data2 = cerebro.resampledata(data1, timeframe=bt.TimeFrame.Days, compression=1, name='data2')
+    # data2.plotinfo.plot = False
+
+    # Set the starting cash and commission
+    starting_cash = 100
+    cerebro.broker.setcash(starting_cash)
+    cerebro.broker.setcommission(
+        automargin=True,         
+        leverage=10.0, 
+        commission=0.0004, 
+        commtype=bt.CommInfoBase.COMM_PERC,
+        stocklike=True,        
+    )  
+       
+
+    cerebro.addstrategy(HeikinAshiStrategy, precomputed=precomputed, **strategy_params)
         
     results = cerebro.run(quicknotify=True, tradehistory=True, runonce=False)
     final_value = cerebro.broker.getvalue()
@@ -127,10 +434,35 @@ apo_fast_range = range(5, 15)
 apo_slow_range = range(5, 30)
 apo_matype_range = range(0, 8)
 
-def evaluate(params, fetched_data, start_date, end_date, bt_timeframe, compression):
-    assert len(params) == 29, "params should have exactly 26 elements"
-    final_value, results = run_backtest(*params, fetched_data, start_date, end_date, bt_timeframe, compression
-                                        )  # capture both final_value and results
+def vector_params(params):
+    ''' Strategy params object of an individual, for vector_backtest.py'''
+    strategy_params = HeikinAshiStrategy.params()
+    for name, value in zip(HeikinAshiStrategy.params._getkeys(), params):
+        setattr(strategy_params, name, value)
+    return strategy_params
+
+
+def evaluate(params, fetched_data, start_date, end_date, bt_timeframe, compression, precomputed=False,
+             vectorized=False, indicator_cache=None, max_drawdown=None, min_value=None):
+    assert len(params) == GA_PARAMS, f"params should have exactly {GA_PARAMS} elements"
+    if vectorized:
+        # Same results as the precomputed Cerebro run, from vector_backtest.py without the event loop
+        result = run_vector_backtest(fetched_data, vector_params(params), start_date, end_date,
+                                     indicator_cache=indicator_cache, max_drawdown=max_drawdown, min_value=min_value)
+        if result is None:
+            print("Pruned", PRUNED_FITNESS)
+            return PRUNED_FITNESS
+        final_value, drawdown, sqn, net_profit = result
+        print(final_value, drawdown, sqn, net_profit)
+        return final_value, drawdown, sqn, net_profit
+
+    final_value, results = run_backtest(*params, fetched_data, start_date, end_date, bt_timeframe, compression,
+                                        precomputed=precomputed, indicator_cache=indicator_cache,
+                                        max_drawdown=max_drawdown, min_value=min_value)  # capture both final_value and results
+    if hasattr(results[0].analyzers, 'prune') and results[0].analyzers.prune.get_analysis()['pruned']:
+        # Stopped early, the analyzers only cover part of the date range
+        print("Pruned", PRUNED_FITNESS)
+        return PRUNED_FITNESS
     drawdown = results[0].analyzers.drawdown.get_analysis()['max']['drawdown']  # get maximum drawdown
     sqn = results[0].analyzers.sqn.get_analysis()['sqn']  # get sqn    
     net_profit = results[0].analyzers.returns.get_analysis()['rtot']
@@ -155,6 +487,40 @@ def evaluate(params, fetched_data, start_date, end_date, bt_timeframe, compressi
     # return final_value, drawdown, sqn, average_pnl, won_total, net_profit  # return profit, drawdown, sqn, won_total, net_profit
     return final_value, drawdown, sqn, net_profit  # return profit, drawdown, sqn, won_total, net_profit
 
+def evaluate_worker(params, sample=False):
+    ''' Evaluate an individual on the data attached by init_worker, so tasks only carry the parameters.
+    With "sample" only the recent part of the window starting at sample_start is backtested.'''
+    start_date = worker_state['sample_start'] if sample else worker_state['start_date']
+    return evaluate(params, worker_state['fetched_data'], start_date, worker_state['end_date'],
+                    worker_state['bt_timeframe'], worker_state['compression'], worker_state['precomputed'],
+                    worker_state['vectorized'], worker_state['indicator_cache'], worker_state['max_drawdown'],
+                    worker_state['min_value'])
+
+def evaluate_batch(population, fetched_data, start_date, end_date, indicator_cache=None, max_drawdown=None,
+                   min_value=None):
+    ''' Vectorized evaluation of a list of individuals with run_vector_backtest_batch'''
+    results = run_vector_backtest_batch(fetched_data, [vector_params(params) for params in population],
+                                        start_date, end_date, indicator_cache=indicator_cache,
+                                        max_drawdown=max_drawdown, min_value=min_value)
+    fitnesses = [PRUNED_FITNESS if result is None else result for result in results]
+    for fitness in fitnesses:
+        print(*fitness)
+    return fitnesses
+
+def evaluate_batch_worker(population, sample=False):
+    ''' evaluate_worker for a batch of individuals, returns their fitness tuples'''
+    start_date = worker_state['sample_start'] if sample else worker_state['start_date']
+    return evaluate_batch(population, worker_state['fetched_data'], start_date, worker_state['end_date'],
+                          worker_state['indicator_cache'], worker_state['max_drawdown'], worker_state['min_value'])
+
+def batch_map(mapper, batch_size):
+    ''' map() for evaluate_batch_worker: "mapper" gets the individuals in batches of batch_size'''
+    def map_batches(func, individuals):
+        individuals = list(individuals)
+        batches = [individuals[i:i + batch_size] for i in range(0, len(individuals), batch_size)]
+        return [fitness for fitnesses in mapper(func, batches) for fitness in fitnesses]
+    return map_batches
+
 # Genetic Algorithm
 # creator.create("FitnessMax", base.Fitness, weights=(1.0, -0.6, 0.8, 0.7, 0.5, 0.8)) # 6 objectives: maximize profit, minimize drawdown, maximize sqn, 
 #                                                                                     # maximize average_pnl, maximize won_total, maximize net_profit
@@ -227,17 +593,252 @@ toolbox.register("mutate", custom_mutate, indpb=0.25)
 toolbox.register("select", tools.selNSGA2)  # use NSGA-II selection for multi-objective optimization
 toolbox.register("evaluate", evaluate)
 
-def main(symbol, start_date, end_date, bt_timeframe, compression, fetched_data):
+def save_checkpoint(filename, dataset_key, generation, population, halloffame, logbook):
+    checkpoint = dict(
+        dataset_key=dataset_key,
+        generation=generation,
+        population=population,
+        halloffame=halloffame,
+        logbook=logbook,
+        random_state=random.getstate(),
+        numpy_state=np.random.get_state(),
+    )
+    save_pickle(checkpoint, filename)
+
+
+def load_checkpoint(filename, dataset_key):
+    ''' Checkpoint of an earlier run on the same data and settings, or None'''
+    if not os.path.isfile(filename):
+        print(f"No checkpoint {filename}, starting a new optimization")
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            checkpoint = pickle.load(f)
+    except (EOFError, pickle.UnpicklingError) as e:
+        print(f"Ignoring unreadable checkpoint {filename}: {e}")
+        return None
+    if checkpoint['dataset_key'] != dataset_key:
+        print(f"Checkpoint {filename} was made for other data or settings, starting a new optimization")
+        return None
+    return checkpoint
+
+
+def ea_simple(population, toolbox, cxpb, mutpb, ngen, stats=None, halloffame=None, verbose=__debug__,
+              checkpoint_file=None, dataset_key=None, checkpoint=None):
+    ''' algorithms.eaSimple, with the state saved to "checkpoint_file" after every generation.
+    With a loaded "checkpoint" (and its population and halloffame passed in) the RNG states are restored and
+    the run continues after its generation, so a resumed run produces the same generations as an uninterrupted one.'''
+    if checkpoint is not None:
+        logbook = checkpoint['logbook']
+        start_gen = checkpoint['generation'] + 1
+        random.setstate(checkpoint['random_state'])
+        np.random.set_state(checkpoint['numpy_state'])
+        print(f"Resuming from generation {start_gen} of {ngen}")
+    else:
+        logbook = tools.Logbook()
+        logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
+
+        invalid_ind = [ind for ind in population if not ind.fitness.valid]
+        fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
+        for ind, fit in zip(invalid_ind, fitnesses):
+            ind.fitness.values = fit
+
+        if halloffame is not None:
+            halloffame.update(population)
+
+        record = stats.compile(population) if stats else {}
+        logbook.record(gen=0, nevals=len(invalid_ind), **record)
+        if verbose:
+            print(logbook.stream)
+        if checkpoint_file:
+            save_checkpoint(checkpoint_file, dataset_key, 0, population, halloffame, logbook)
+        start_gen = 1
+
+    for gen in range(start_gen, ngen + 1):
+        offspring = toolbox.select(population, len(population))
+        offspring = algorithms.varAnd(offspring, toolbox, cxpb, mutpb)
+
+        invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
+        fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
+        for ind, fit in zip(invalid_ind, fitnesses):
+            ind.fitness.values = fit
+
+        if halloffame is not None:
+            halloffame.update(offspring)
+
+        population[:] = offspring
+
+        record = stats.compile(population) if stats else {}
+        logbook.record(gen=gen, nevals=len(invalid_ind), **record)
+        if verbose:
+            print(logbook.stream)
+        if checkpoint_file:
+            save_checkpoint(checkpoint_file, dataset_key, gen, population, halloffame, logbook)
+
+    return population, logbook
+
+
+def breed(archive, toolbox, cxpb, mutpb):
+    ''' One new offspring from two random members of the archive, bred with varAnd until it differs from them'''
+    while True:
+        parents = [toolbox.clone(ind) for ind in random.sample(archive, 2)]
+        child = algorithms.varAnd(parents, toolbox, cxpb, mutpb)[0]
+        if not child.fitness.valid:
+            return child
+
+
+def ea_steady_state(population, toolbox, cxpb, mutpb, ngen, pool, func, fitness_cache, in_flight, stats=None,
+                    halloffame=None, verbose=__debug__, checkpoint_file=None, dataset_key=None, checkpoint=None,
+                    task_timeout=None):
+    ''' Asynchronous steady-state counterpart of ea_simple with the same budget of (ngen + 1) * len(population)
+    backtests. Every finished backtest joins the archive, which toolbox.select trims back to len(population),
+    and a new offspring bred from the archive is submitted right away, keeping "in_flight" backtests queued on
+    the pool so no worker waits for the slowest individual of a generation.
+    The logbook and the checkpoint are written after every len(population) finished backtests.
+    When no backtest finishes for "task_timeout" seconds (the pool's worker_timeout, or TASK_TIMEOUT) the
+    waiting individuals are submitted again, in case their worker died; a second timeout raises RuntimeError.'''
+    size = len(population)
+    total = (ngen + 1) * size
+    results = queue.Queue()
+    pending = 0
+    waiting = {}  # id of every submitted individual without a result yet: individual
+    if task_timeout is None:
+        task_timeout = getattr(pool, 'worker_timeout', TASK_TIMEOUT)
+
+    def send(ind):
+        pool.apply_async(func, (tuple(ind),), callback=lambda fitness: results.put((ind, fitness)),
+                         error_callback=lambda error: results.put((None, error)))
+
+    def submit(ind):
+        nonlocal pending
+        pending += 1
+        waiting[id(ind)] = ind
+        key = tuple(ind)
+        if key in fitness_cache.results:
+            fitness_cache.hits += 1
+            results.put((ind, fitness_cache.results[key]))
+        else:
+            fitness_cache.misses += 1
+            send(ind)
+
+    if checkpoint is not None:
+        archive = population
+        logbook = checkpoint['logbook']
+        evaluated = (checkpoint['generation'] + 1) * size
+        random.setstate(checkpoint['random_state'])
+        np.random.set_state(checkpoint['numpy_state'])
+        print(f"Resuming after {evaluated} of {total} backtests")
+    else:
+        archive = []
+        logbook = tools.Logbook()
+        logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
+        evaluated = 0
+        for ind in population:
+            submit(ind)
+    submitted = evaluated + pending
+    resubmitted = False
+
+    while True:
+        while submitted < total and pending < in_flight and len(archive) >= 2:
+            submit(breed(archive, toolbox, cxpb, mutpb))
+            submitted += 1
+        if not pending:
+            break
+
+        try:
+            ind, fitness = results.get(timeout=task_timeout)
+        except queue.Empty:
+            if resubmitted:
+                raise RuntimeError(f"No backtest finished in {2 * task_timeout:.0f} s, {len(waiting)} individual(s) "
+                                   f"still waiting: the pool has lost its workers")
+            print(f"No backtest finished in {task_timeout:.0f} s, submitting the {len(waiting)} waiting individual(s) again")
+            for ind in waiting.values():
+                send(ind)
+            resubmitted = True
+            continue
+        if ind is None:
+            raise fitness
+        if waiting.pop(id(ind), None) is None:
+            continue  # second result of a resubmitted individual
+        pending -= 1
+        resubmitted = False
+        ind.fitness.values = fitness
+        fitness_cache.results[tuple(ind)] = fitness
+        evaluated += 1
+
+        archive.append(ind)
+        if halloffame is not None:
+            halloffame.update([ind])
+        if len(archive) > size:
+            archive[:] = toolbox.select(archive, size)
+
+        if evaluated % size == 0:
+            gen = evaluated // size - 1
+            record = stats.compile(archive) if stats else {}
+            logbook.record(gen=gen, nevals=size, **record)
+            if verbose:
+                print(logbook.stream)
+            fitness_cache.save()
+            if checkpoint_file:
+                save_checkpoint(checkpoint_file, dataset_key, gen, archive, halloffame, logbook)
+
+    fitness_cache.save()
+    return archive, logbook
+
+
+def main(symbol, start_date, end_date, bt_timeframe, compression, fetched_data, precomputed=False, vectorized=False,
+         max_drawdown=None, min_value=None, sample_fraction=None, promote_fraction=0.3, resume=False,
+         remote_address=None, remote_authkey=None, steady_state=False, batch_size=None):
+    if steady_state and sample_fraction:
+        raise ValueError("Successive halving ranks whole generations, it can't be used with the steady-state GA")
+    if vectorized and not precomputed:
+        raise ValueError("The vectorized backtest gives the precomputed Cerebro results, it needs precomputed=True")
+    if precomputed:
+        print(PRECOMPUTED_NOTE)
+    if batch_size and (steady_state or not vectorized):
+        raise ValueError("Batch evaluation needs the vectorized backtest and the generational GA")
+    if remote_address and not remote_authkey:
+        raise ValueError("Distributed evaluation needs a remote_authkey (GMT_REMOTE_AUTHKEY), workers run what the coordinator sends")
     random.seed(42)
     np.random.seed(42)
     multiprocessing.set_start_method("spawn")
 
-    toolbox.register("evaluate", evaluate, fetched_data=fetched_data, start_date=start_date, end_date=end_date,
-                     bt_timeframe=bt_timeframe, compression=compression)
+    if batch_size:
+        # Every task is a batch of individuals for run_vector_backtest_batch, which simulates them one by one
+        toolbox.register("evaluate", evaluate_batch_worker)
+    else:
+        toolbox.register("evaluate", evaluate_worker)
+
+    # Multi-fidelity evaluation: individuals are ranked on the last "sample_fraction" of the window first
+    sample_start = sample_start_date(fetched_data, start_date, end_date, sample_fraction) if sample_fraction else None
+    settings = (start_date, end_date, bt_timeframe, compression, precomputed, vectorized, max_drawdown, min_value,
+                sample_start)
+
+    if remote_address:
+        # Backtests run on distributed.py workers, which load the same candles from their own data cache
+        shm = None
+        pool = RemotePool(remote_address, remote_authkey, initializer=init_remote_worker,
+                          initargs=(symbol, dataset_fingerprint(fetched_data, start_date, end_date, bt_timeframe,
+                                                                compression)) + settings)
+    else:
+        # Publish the data once, workers attach to it in the pool initializer
+        shm = publish_data(fetched_data)
+
+        # Use a multiprocessing Pool for the map function
+        pool = Pool(initializer=init_worker, initargs=(shm.name, len(fetched_data)) + settings)
+    mapper = batch_map(pool.map, batch_size) if batch_size else pool.map
 
-    # Use a multiprocessing Pool for the map function
-    pool = Pool()
-    toolbox.register("map", pool.map)
+    # Duplicate genomes are answered from the fitness cache instead of being re-simulated
+    dataset_key = dataset_fingerprint(fetched_data, start_date, end_date, bt_timeframe, compression,
+                                      precomputed, vectorized, max_drawdown, min_value)
+    fitness_cache = FitnessCache(dataset_key)
+    if sample_fraction:
+        sample_cache = FitnessCache(dataset_fingerprint(fetched_data, sample_start, end_date, bt_timeframe,
+                                                        compression, precomputed, vectorized, max_drawdown, min_value))
+        halving = SuccessiveHalving(fitness_cache, sample_cache, promote_fraction)
+        toolbox.register("map", halving.map, mapper)
+    else:
+        toolbox.register("map", fitness_cache.map, mapper)
     pop = toolbox.population(n=50)
     hof = tools.HallOfFame(40)
     stats = tools.Statistics(lambda ind: ind.fitness.values)
@@ -245,15 +846,36 @@ def main(symbol, start_date, end_date, bt_timeframe, compression, fetched_data):
     stats.register("min", np.min)
     stats.register("max", np.max)
 
+    # The fitness caches are saved after every evaluation, the checkpoint holds the rest of the GA state
+    checkpoint_key = repr((dataset_key, sample_start, promote_fraction if sample_fraction else None, steady_state))
+    checkpoint = load_checkpoint(CHECKPOINT_FILE, checkpoint_key) if resume else None
+    if checkpoint is not None:
+        pop, hof = checkpoint['population'], checkpoint['halloffame']
+
     try:
-        pop, logbook = algorithms.eaSimple(pop, toolbox, cxpb=0.55, mutpb=0.25, ngen=45, 
-                                            stats=stats, halloffame=hof, verbose=True)
+        if steady_state:
+            # Local workers get two queued backtests each, remote ones are fed from a population-sized queue
+            in_flight = len(pop) if remote_address else 2 * multiprocessing.cpu_count()
+            pop, logbook = ea_steady_state(pop, toolbox, cxpb=0.55, mutpb=0.25, ngen=45, pool=pool,
+                                           func=evaluate_worker, fitness_cache=fitness_cache, in_flight=in_flight,
+                                           stats=stats, halloffame=hof, verbose=True,
+                                           checkpoint_file=CHECKPOINT_FILE, dataset_key=checkpoint_key,
+                                           checkpoint=checkpoint)
+        else:
+            pop, logbook = ea_simple(pop, toolbox, cxpb=0.55, mutpb=0.25, ngen=45,
+                                     stats=stats, halloffame=hof, verbose=True,
+                                     checkpoint_file=CHECKPOINT_FILE, dataset_key=checkpoint_key,
+                                     checkpoint=checkpoint)
         
         # Save best individuals and their fitness to a file
         best_individuals = [(ind, ind.fitness.values) for ind in hof]
         with open('best_individuals.pkl', 'wb') as f:
             pickle.dump(best_individuals, f)
 
+        print(f"Fitness cache: {fitness_cache.hits} hits, {fitness_cache.misses} backtests")
+        if sample_fraction:
+            print(f"Sample backtests: {sample_cache.misses}, promoted to the full window: {halving.promoted}, "
+                  f"dropped: {halving.dropped}")
         print("Best parameters found by GA:", hof[0])
         return hof[0]
     
@@ -267,6 +889,9 @@ def main(symbol, start_date, end_date, bt_timeframe, compression, fetched_data):
         # Make sure to close the pool when you're done with it
         pool.close()
         pool.join()
+        if shm is not None:
+            shm.close()
+            shm.unlink()
 
     if len(hof) > 0:
         best_params = hof[0]
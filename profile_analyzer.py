@@ -0,0 +1,104 @@
+# profile_analyzer.py
+
+# Hot path profiler for backtests: time spent in the strategy's next, its check_*_condition methods
+# and the next/once of every indicator it builds (nested ones included)
+
+import csv
+import time
+from collections import defaultdict
+import backtrader as bt
+from backtrader.lineiterator import LineIterator
+
+
+class HotPathProfiler(bt.Analyzer):
+    ''' Wraps the methods of the running strategy and its indicators with timers when the backtest starts.
+    Timings are grouped by class and method, so calls and total time add up every instance of an indicator.
+    An indicator's next does not include the indicators it owns, they are timed on their own rows.
+    "total" is the inclusive time of a method, "self" leaves out the timed methods it calls (the strategy's
+    next calls its check_*_condition methods), so the "self" shares add up to at most 100%.'''
+
+    def start(self):
+        self.timings = defaultdict(lambda: [0, 0.0, 0.0])  # label: [calls, seconds, self seconds]
+        self.nested = []  # time of the timed calls made by each timed call in progress
+        self.wrapped = set()
+
+        strategy_name = type(self.strategy).__name__
+        self._wrap(self.strategy, 'next', f'{strategy_name}.next')
+        for name in dir(type(self.strategy)):
+            if name.startswith('check_') and name.endswith('_condition'):
+                self._wrap(self.strategy, name, f'{strategy_name}.{name}')
+
+        for indicator in self._indicators(self.strategy):
+            for method in ('next', 'once'):
+                self._wrap(indicator, method, f'{self._label(indicator)}.{method}')
+
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+        self.bars = len(self.strategy.data0)
+
+    def _indicators(self, owner):
+        # Line operations (LinesOperation, LineOwnOperation) own no indicators
+        for indicator in getattr(owner, '_lineiterators', {}).get(LineIterator.IndType, []):
+            if id(indicator) not in self.wrapped:
+                self.wrapped.add(id(indicator))
+                yield indicator
+                yield from self._indicators(indicator)
+
+    @staticmethod
+    def _label(indicator):
+        name = type(indicator).__name__
+        if type(indicator).__module__.endswith('talib'):
+            return f'talib.{name}'
+        return name
+
+    def _wrap(self, obj, method, label):
+        func = getattr(obj, method)
+        timing = self.timings[label]
+
+        def timed(*args, **kwargs):
+            self.nested.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                timing[0] += 1
+                timing[1] += elapsed
+                timing[2] += elapsed - self.nested.pop()
+                if self.nested:
+                    self.nested[-1] += elapsed
+
+        setattr(obj, method, timed)
+
+    def rows(self, sort_by='self'):
+        ''' One row per timed method, sorted by "sort_by" (any row key) in descending order.
+        "share" is the self time in % of the backtest.'''
+        rows = []
+        for label, (calls, seconds, self_seconds) in self.timings.items():
+            if not calls:
+                continue
+            rows.append(dict(
+                name=label,
+                calls=calls,
+                total=seconds,
+                self=self_seconds,
+                per_call_us=1e6 * seconds / calls,
+                share=100 * self_seconds / self.elapsed if self.elapsed else 0.0,
+            ))
+        return sorted(rows, key=lambda row: row[sort_by], reverse=sort_by != 'name')
+
+    def get_analysis(self):
+        return dict(
+            bars=self.bars,
+            seconds=self.elapsed,
+            bars_per_second=self.bars / self.elapsed if self.elapsed else 0.0,
+            rows=self.rows(),
+        )
+
+    def write_report(self, filename='profile_report.csv', sort_by='self'):
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['name', 'calls', 'total', 'self', 'per_call_us', 'share'])
+            writer.writeheader()
+            writer.writerows(self.rows(sort_by))
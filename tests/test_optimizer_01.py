@@ -0,0 +1,31 @@
+# tests/test_optimizer_01.py
+# Run with: python -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deap import creator, tools
+
+from optimizer_01 import PRUNED_FITNESS
+
+
+def make_individual(fitness):
+    individual = creator.Individual([0])
+    individual.fitness.values = fitness
+    return individual
+
+
+def test_pruned_fitness_is_dominated_by_bad_completed_runs():
+    # Completed runs that lost nearly everything, with a very negative SQN and rtot -inf
+    for completed in [(0.5, 99.9, -341.0, float('-inf')), (-3.0, 250.0, -1e6, -50.0), (100.0, 0.0, 0.0, 0.0)]:
+        assert make_individual(completed).fitness.dominates(make_individual(PRUNED_FITNESS).fitness)
+
+
+def test_nsga2_ranks_pruned_individuals_last():
+    completed = [make_individual((0.5, 99.9, -341.0, float('-inf'))), make_individual((120.0, 10.0, 1.5, 0.2))]
+    pruned = [make_individual(PRUNED_FITNESS) for _ in range(2)]
+    fronts = tools.sortNondominated(pruned + completed, len(pruned + completed))
+    assert set(map(id, fronts[-1])) == set(map(id, pruned))
+    assert set(map(id, tools.selNSGA2(pruned + completed, 2))) == set(map(id, completed))
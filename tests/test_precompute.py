@@ -0,0 +1,110 @@
+# tests/test_precompute.py
+# Run with: python -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backtrader as bt
+import numpy as np
+import pytest
+import talib
+from talib import abstract
+
+from benchmark import synthetic_ohlcv
+from indicators.precompute import aggregate_bars, heikin_ashi, partial_bars, talib_line, windowed
+
+
+class Recorder(bt.Strategy):
+    ''' data1 OHLCV and Heikin Ashi lines on every base candle'''
+    def __init__(self):
+        self.ha = bt.indicators.HeikinAshi(self.data1)
+        self.rows = []
+
+    def next(self):
+        self.rows.append([len(self.data1)] + [line[0] for line in (
+            self.data1.open, self.data1.high, self.data1.low, self.data1.close, self.data1.volume,
+            self.ha.ha_open, self.ha.ha_high, self.ha.ha_low, self.ha.ha_close)])
+
+
+@pytest.fixture(scope='module')
+def replay():
+    ''' (candles, recorded rows) of a replayed 30m feed over seeded 5m candles, as main.py runs the backtest'''
+    candles = synthetic_ohlcv(3, seed=2).tz_localize(None)
+    cerebro = bt.Cerebro(stdstats=False)
+    data = bt.feeds.PandasData(dataname=candles, timeframe=bt.TimeFrame.Minutes, compression=5)
+    cerebro.adddata(data)
+    cerebro.replaydata(data, timeframe=bt.TimeFrame.Minutes, compression=30)
+    cerebro.addstrategy(Recorder)
+    rows = np.array(cerebro.run()[0].rows, dtype=np.float64)
+    # The strategy starts on the first candle that reaches it, align the candles with the rows
+    return candles.iloc[len(candles) - len(rows):], rows
+
+
+def test_partial_bars_follow_replay(replay):
+    # The forming bar's high and low after every candle, used to size the orders
+    candles, rows = replay
+    partials = partial_bars(candles).iloc[-len(rows):]
+    np.testing.assert_allclose(partials['high'].to_numpy(), rows[:, 2])
+    np.testing.assert_allclose(partials['low'].to_numpy(), rows[:, 3])
+
+
+def test_completed_bars_match_replay(replay):
+    # At the last candle of a bar the replayed data1 holds the bar aggregate_bars builds
+    candles, rows = replay
+    closes = np.flatnonzero(np.r_[rows[1:, 0] != rows[:-1, 0], True])
+    bars = aggregate_bars(candles)
+    assert len(closes) > 100
+    np.testing.assert_allclose(bars[['open', 'high', 'low', 'close', 'volume']].to_numpy()[-len(closes):],
+                               rows[closes, 1:6])
+
+
+def test_heikin_ashi_at_bar_close_matches_replay(replay):
+    # The indicators follow the completed bars: at a bar's last candle they equal the replayed ones, once the
+    # seed of ha_open (taken from the first candle of the first replayed bar) has faded away. Within a bar the
+    # replayed indicators (and the signals read from them) move with every candle, the precomputed columns
+    # do not, which is why precomputed backtests give different trades.
+    candles, rows = replay
+    closes = np.flatnonzero(np.r_[rows[1:, 0] != rows[:-1, 0], True])
+    bars = aggregate_bars(candles)
+    ha = np.column_stack(heikin_ashi(*(bars[name].to_numpy() for name in ('open', 'high', 'low', 'close'))))
+    warmup = 30
+    np.testing.assert_allclose(ha[-len(closes):][warmup:], rows[closes, 6:][warmup:])
+
+
+def bar_by_bar(name, *inputs, **kwargs):
+    ''' bt.talib in next mode for a function without an unstable period: the last lookback + 1 bars per call'''
+    function = abstract.Function(name)
+    function.set_function_args(**kwargs)
+    size = function.lookback + 1
+    outputs = [np.full(len(inputs[0]), np.nan) for _ in function.output_names]
+    for i in range(size - 1, len(inputs[0])):
+        out = getattr(talib, name)(*[x[i - size + 1:i + 1] for x in inputs], **kwargs)
+        for line, o in zip(outputs, out if len(outputs) > 1 else (out,)):
+            line[i] = o[-1]
+    return outputs
+
+
+@pytest.mark.parametrize('name, inputs, kwargs', [
+    ('SMA', 'c', dict(timeperiod=50)),
+    ('WMA', 'c', dict(timeperiod=20)),
+    ('MFI', 'hlcv', dict(timeperiod=14)),
+    ('APO', 'c', dict(fastperiod=5, slowperiod=20, matype=talib.MA_Type.SMA)),
+    ('STOCHF', 'hlc', dict(fastk_period=14, fastd_period=3, fastd_matype=talib.MA_Type.WMA)),
+])
+def test_windowed_functions_run_on_the_whole_series(name, inputs, kwargs):
+    # One TA-Lib call gives the bar by bar values, up to the rounding of its running sums
+    bars = aggregate_bars(synthetic_ohlcv(10, seed=1))
+    arrays = [bars[dict(h='high', l='low', c='close', v='volume')[key]].to_numpy() for key in inputs]
+    assert windowed(name, kwargs)
+    lines = talib_line(name, *arrays, **kwargs)
+    for line, reference in zip(lines if isinstance(lines, tuple) else (lines,), bar_by_bar(name, *arrays, **kwargs)):
+        np.testing.assert_allclose(line, reference, rtol=1e-10, atol=1e-10)
+
+
+def test_path_dependent_functions_are_not_windowed():
+    # Smoothed over their whole history without TA-Lib's unstable flag: a window gives other values
+    assert not windowed('ADOSC', dict(fastperiod=3, slowperiod=10))
+    assert not windowed('ADXR', dict(timeperiod=14))
+    assert not windowed('APO', dict(fastperiod=5, slowperiod=20, matype=talib.MA_Type.EMA))
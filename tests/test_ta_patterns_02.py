@@ -0,0 +1,98 @@
+# tests/test_ta_patterns_02.py
+# Run with: python -m pytest tests
+
+import os
+import sys
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators.ta_patterns_02 import TaPatterns
+
+
+class PatternBuffer(bt.Indicator):
+    ''' One pattern of the previous TaPatterns: a TA-Lib indicator and a buffer fed on every call'''
+    lines = ('value',)
+
+    def __init__(self, pattern, penetration, buffer_length):
+        kwargs = {} if penetration is None else dict(penetration=penetration)
+        self.pattern = pattern(self.data.open, self.data.high, self.data.low, self.data.close, **kwargs)
+        self.buffer = deque(maxlen=buffer_length)
+
+    def next(self):
+        if not np.isnan(self.pattern[-1]):
+            self.buffer.append(self.pattern[-1])
+
+
+class ReferencePatterns(bt.Indicator):
+    ''' Previous TaPatterns implementation, one indicator per pattern'''
+    lines = ('signal', 'strong_bull', 'strong_bear')
+
+    def __init__(self):
+        p = TaPatterns.params
+        self.buffers = [PatternBuffer(self.data, pattern, penetration, p.buffer_length)
+                        for pattern, penetration in p.patterns]
+        self.strong = [pattern(self.data.open, self.data.high, self.data.low, self.data.close)
+                       for pattern, _ in p.strong_patterns]
+
+    def next(self):
+        self.lines.signal[0] = sum(sum(b.buffer) for b in self.buffers)
+        self.lines.strong_bull[0] = float(any(s[0] == 100 for s in self.strong))
+        self.lines.strong_bear[0] = float(any(s[0] == -100 for s in self.strong))
+
+
+class Recorder(bt.Strategy):
+    def __init__(self):
+        data = self.datas[-1]
+        self.indicators = [TaPatterns(data), ReferencePatterns(data)]
+        self.rows = []
+
+    def next(self):
+        self.rows.append([[line[0] for line in indicator.lines] for indicator in self.indicators])
+
+
+def candles(days=4, seed=3):
+    rng = np.random.default_rng(seed)
+    n = days * 288
+    close = 0.2 * np.exp(np.cumsum(rng.normal(0, 0.006, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    return pd.DataFrame({
+        'open': open_,
+        'high': np.maximum(open_, close) * (1 + rng.uniform(0, 0.004, n)),
+        'low': np.minimum(open_, close) * (1 - rng.uniform(0, 0.004, n)),
+        'close': close,
+        'volume': rng.uniform(1e5, 1e6, n),
+    }, index=pd.date_range('2023-06-01', periods=n, freq='5min', name='datetime'))
+
+
+def run(setup, runonce=False):
+    cerebro = bt.Cerebro(stdstats=False)
+    data = bt.feeds.PandasData(dataname=candles(), timeframe=bt.TimeFrame.Minutes, compression=5)
+    if setup == 'single':
+        cerebro.adddata(data)
+    else:
+        cerebro.adddata(data)
+        getattr(cerebro, setup)(data, timeframe=bt.TimeFrame.Minutes, compression=30)
+    cerebro.addstrategy(Recorder)
+    rows = np.array(cerebro.run(runonce=runonce)[0].rows, dtype=np.float64)
+    return rows[:, 0], rows[:, 1]
+
+
+@pytest.mark.parametrize('setup', ['replaydata', 'resampledata', 'single'])
+def test_signal_follows_every_call(setup):
+    # data1 of the strategy is a 30m feed over 5m candles: the signal moves on every call within a bar
+    new, reference = run(setup)
+    assert len(new) > 100
+    np.testing.assert_array_equal(new, reference)
+
+
+def test_runonce_sums_the_previous_bars():
+    # One call per bar: once() over the whole series gives the lines next() builds call by call
+    batch, _ = run('single', runonce=True)
+    new, _ = run('single')
+    np.testing.assert_array_equal(batch, new)
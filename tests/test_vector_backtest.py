@@ -0,0 +1,52 @@
+# tests/test_vector_backtest.py
+# Run with: python -m pytest tests
+
+import contextlib
+import datetime as dt
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backtrader as bt
+import pytest
+
+import optimizer_01
+from benchmark import DEFAULT_PARAMS, date_range, synthetic_ohlcv
+from vector_backtest import run_vector_backtest
+
+
+INDIVIDUALS = 6
+
+
+@pytest.fixture(scope='module')
+def runs():
+    ''' (Cerebro result, vector result, closed trades) of the default and random individuals on a seeded fixture'''
+    data = synthetic_ohlcv(10, seed=5)
+    start_date, end_date = date_range(data)
+    random.seed(7)
+    population = [DEFAULT_PARAMS] + [list(optimizer_01.toolbox.individual()) for _ in range(INDIVIDUALS - 1)]
+    results = []
+    for params in population:
+        with contextlib.redirect_stdout(io.StringIO()):
+            final_value, strategies = optimizer_01.run_backtest(*params, data, start_date, end_date,
+                                                                bt.TimeFrame.Minutes, 5, precomputed=True)
+        analyzers = strategies[0].analyzers
+        cerebro = (final_value, analyzers.drawdown.get_analysis()['max']['drawdown'],
+                   analyzers.sqn.get_analysis()['sqn'], analyzers.returns.get_analysis()['rtot'])
+        vector = run_vector_backtest(data, optimizer_01.vector_params(params), start_date, end_date)
+        results.append((cerebro, vector, analyzers.sqn.get_analysis()['trades']))
+    return results
+
+
+@pytest.mark.parametrize('index', range(INDIVIDUALS))
+def test_vector_backtest_matches_precomputed_cerebro(runs, index):
+    cerebro, vector, _ = runs[index]
+    assert vector == cerebro  # final value, max drawdown, SQN and rtot
+
+
+def test_fixture_trades(runs):
+    # The comparison means little if the individuals never open a position
+    assert sum(trades for _, _, trades in runs) >= 10
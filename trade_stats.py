@@ -0,0 +1,54 @@
+# trade_stats.py
+
+# Rolling statistics of the last closed trades for the position sizing (Kelly criterion).
+# Updated once per closed trade (notify_trade), read on every bar without walking the trades.
+
+from collections import deque
+
+
+class TradeStats:
+    ''' Win rate, win/loss ratio and Kelly coefficient of the last "num_past_trades" closed trades.
+    Running sums and counts of the wins and losses are updated when a trade is added and when the oldest
+    one drops out of the window, the Kelly values are computed once per trade and read in O(1).'''
+
+    def __init__(self, num_past_trades):
+        self.num_past_trades = num_past_trades
+        self.trades = deque(maxlen=num_past_trades)  # net profit of the trades in the window
+        self.win_sum = 0.0
+        self.win_count = 0
+        self.loss_sum = 0.0
+        self.loss_count = 0
+        self._update()
+
+    def __len__(self):
+        return len(self.trades)
+
+    def add(self, pnl):
+        ''' Record the net profit of a closed trade'''
+        if not self.num_past_trades:
+            return  # empty window
+        if len(self.trades) == self.num_past_trades:
+            self._count(self.trades[0], -1)
+        self.trades.append(pnl)
+        self._count(pnl, 1)
+        self._update()
+
+    def _count(self, pnl, sign):
+        # Trades without profit or loss only count in the win rate's denominator
+        if pnl > 0:
+            self.win_count += sign
+            self.win_sum = self.win_sum + sign * pnl if self.win_count else 0.0  # no float residue once empty
+        elif pnl < 0:
+            self.loss_count += sign
+            self.loss_sum = self.loss_sum + sign * pnl if self.loss_count else 0.0
+
+    def _update(self):
+        average_win = self.win_sum / self.win_count if self.win_count else 0.0
+        average_loss = abs(self.loss_sum) / self.loss_count if self.loss_count else 0.0
+        self.win_rate = self.win_count / len(self.trades) if self.trades else 0.0
+        self.win_loss_ratio = average_win / average_loss if average_loss != 0 else 1.0
+        if len(self.trades) == self.num_past_trades:
+            kelly_coef = (self.win_rate - ((1 - self.win_rate) / self.win_loss_ratio)) if self.win_loss_ratio != 0.0 else 0.5
+        else:
+            kelly_coef = 0.5
+        self.kelly_coef = max(kelly_coef, 0.0)
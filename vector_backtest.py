@@ -0,0 +1,342 @@
+# vector_backtest.py
+# Backtest of HeikinAshiStrategy without the Cerebro event loop, for the optimizer.
+# The entry/exit conditions are evaluated for every 30m bar at once from the precomputed indicator
+# columns, then one loop over the 5m bars replays the strategy's next() and backtrader's BackBroker
+# accounting (market orders filled at the next open, the submit-time margin check, 10x leverage with
+# shortcash, percentage commission). Orders are sized on the high/low of the forming 30m bar (partial_bars). The results are those of the precomputed Cerebro run
+# (run_backtest with precomputed=True): final value, max drawdown, SQN and rtot.
+
+import math
+import numpy as np
+import pandas as pd
+from indicators.precompute import (IndicatorCache, cached_bars, heikin_ashi, heikin_patterns, precompute_bars, shift,
+                                   truth)
+from trade_stats import TradeStats
+
+# Prices the 5m loop reads, one value per 5m bar
+FEED_COLUMNS = ('open0', 'close0', 'partial_high', 'partial_low', 'ha_close')
+
+
+def to_utc(date):
+    ''' Timestamp in UTC, naive dates are taken as UTC like backtrader's fromdate/todate'''
+    date = pd.Timestamp(date)
+    return date.tz_localize('UTC') if date.tzinfo is None else date.tz_convert('UTC')
+
+
+def date_range_slice(index, start_date=None, end_date=None):
+    ''' Rows of the index a feed with fromdate/todate delivers (both ends included)'''
+    lo = index.searchsorted(to_utc(start_date), side='left') if start_date is not None else 0
+    hi = index.searchsorted(to_utc(end_date), side='right') if end_date is not None else len(index)
+    return slice(lo, hi)
+
+
+def bar_patterns(bars):
+    ''' HeikinPatterns signal and stop_signal, it runs on the delivered bars with its own HeikinAshi'''
+    return heikin_patterns(*heikin_ashi(*(bars[name].to_numpy() for name in ('open', 'high', 'low', 'close'))))
+
+
+def ta_pattern_threshold(p):
+    ''' Threshold the strategy gives TaPatterns, None if it does not use them'''
+    return p.ta_threshold * 100 if p.use_ta_patterns else None
+
+
+def strategy_conditions(bars, patterns=None, ta_threshold=None):
+    ''' check_buy_condition, check_sell_condition and the two stop conditions for every 30m bar.
+    "bars" is the frame from precompute_indicators, restricted to the bars the feed delivers,
+    "patterns" the result of bar_patterns for these bars if it is already known,
+    "ta_threshold" the TaPatterns threshold if the strategy uses them (use_ta_patterns).
+    Line values are used the way the strategy's and/or expressions use them, so NaN counts as true.'''
+    col = {name: bars[name].to_numpy() for name in bars.columns}
+    t = {name: truth(values) for name, values in col.items()}
+
+    signal, stop_signal = bar_patterns(bars) if patterns is None else patterns
+    pattern_buy1, pattern_sell1 = signal == 1, signal == -1
+    pattern_stop_buy1, pattern_stop_sell1 = stop_signal == 1, stop_signal == -1
+
+    stoch_buy1_1 = truth(shift(col['stoch_buy1'], 1))
+    stoch_sell1_1 = truth(shift(col['stoch_sell1'], 1))
+    adxr, adxr_1, adxr_2 = col['adxr'], shift(col['adxr'], 1), shift(col['adxr'], 2)
+    with np.errstate(invalid='ignore'):
+        adx_growing = (adxr_1 < adxr) & (adxr_2 <= adxr_1)
+        di_minus_rising = shift(col['DIminus'], 1) < col['DIminus']
+        di_plus_rising = col['DIplus'] > shift(col['DIplus'], 1)
+        if ta_threshold is None:
+            ta_buy = ta_sell = False
+        else:
+            ta_buy = (col['ta_signal'] > ta_threshold) | (col['ta_strong_buy'] == 1)
+            ta_sell = (col['ta_signal'] < -ta_threshold) | (col['ta_strong_sell'] == 1)
+
+    buy = ((t['mas_buy'] | t['pivot_buy'] | t['mama_buy'] | t['sma_buy'] | ta_buy) & t['apo_buy'] &
+           (t['cmo_buy'] | t['adx_buy']) & t['mfi_buy'] & t['dma_osc_buy'] &
+           t['high_volatility'] & (t['ad_osc_buy1'] | t['volume_filter']) & t['hmo_buy1'] &
+           (t['stoch_buy1'] | stoch_buy1_1))
+    sell = ((t['mas_sell'] | t['pivot_sell'] | t['mama_sell'] | t['sma_sell'] | ta_sell) & t['apo_sell'] &
+            (t['cmo_sell'] | t['adx_sell']) & t['mfi_sell'] & t['dma_osc_sell'] &
+            t['high_volatility'] & (t['ad_osc_sell1'] | t['volume_filter']) & t['hmo_sell1'] &
+            (t['stoch_sell1'] | stoch_sell1_1))
+
+    stop_buy = (((pattern_stop_buy1 | pattern_sell1 | t['mas_stop_buy'] | t['mama_sell']) &
+                 t['mfi_sell'] & (t['ad_osc_sell1'] | t['volume_filter']) &
+                 ((di_minus_rising & adx_growing) | t['stoch_sell1'] | stoch_sell1_1)) |
+                t['pivot_sell'] | t['sma_sell'])
+    stop_sell = (((pattern_stop_sell1 | pattern_buy1 | t['mas_stop_sell'] | t['mama_buy']) &
+                  t['mfi_buy'] & (t['ad_osc_sell1'] | t['volume_filter']) &
+                  ((di_plus_rising & adx_growing) | t['stoch_buy1'] | stoch_buy1_1)) |
+                 t['pivot_buy'] | t['sma_buy'])
+
+    return buy, sell, stop_buy & ~buy, stop_sell & ~sell
+
+
+def position_update(size, price, change, exec_price):
+    ''' backtrader Position.update: new size and price, plus the opened and closed parts of "change"'''
+    new_size = size + change
+    if not new_size:
+        return new_size, 0.0, 0, change
+    if not size:
+        return new_size, exec_price, change, 0
+    if (size > 0) == (change > 0):  # increased position
+        return new_size, (price * size + change * exec_price) / new_size, change, 0
+    if (size > 0) == (new_size > 0):  # reduced position
+        return new_size, price, 0, change
+    return new_size, exec_price, new_size, -size  # reversed position
+
+
+def trade_update(trade, size, price, commission):
+    ''' backtrader Trade.update for trade = [size, price, pnl, commission], returns pnlcomm once the trade is closed'''
+    oldsize = trade[0]
+    trade[0] += size
+    trade[3] += commission
+    if abs(trade[0]) > abs(oldsize):
+        trade[1] = (oldsize * trade[1] + size * price) / trade[0]
+    else:
+        trade[2] += -size * (price - trade[1])
+    if oldsize and not trade[0]:
+        pnlcomm = trade[2] - trade[3]
+        trade[:] = [0, 0.0, 0.0, 0.0]
+        return pnlcomm
+    return None
+
+
+def system_quality(pnls):
+    ''' bt.analyzers.SQN on the net profit of the closed trades'''
+    if len(pnls) <= 1:
+        return 0
+    pnl_av = math.fsum(pnls) / len(pnls)
+    pnl_stddev = math.sqrt(math.fsum([pow(pnl - pnl_av, 2.0) for pnl in pnls]) / len(pnls))
+    try:
+        return math.sqrt(len(pnls)) * pnl_av / pnl_stddev
+    except ZeroDivisionError:
+        return None
+
+
+def run_vector_backtest(fetched_data, params, start_date=None, end_date=None,
+                        starting_cash=100, leverage=10.0, commission=0.0004, indicator_cache=None,
+                        max_drawdown=None, min_value=None):
+    ''' Backtest HeikinAshiStrategy on the 5m frame "fetched_data" with "params" (strategy params, attribute access).
+    "indicator_cache" is an optional IndicatorCache for fetched_data (indicators/precompute.py).
+    Returns final_value, max drawdown (%), SQN and rtot like the analyzers used by optimizer_01.evaluate,
+    or None if the run was pruned: its drawdown went past "max_drawdown" (%) or its value below "min_value".'''
+    p = params
+    if indicator_cache is None:
+        indicator_cache = IndicatorCache(None)  # the bars are read once for the indicators and the feed
+    bars = precompute_bars(fetched_data, p, 30, indicator_cache)
+    rows0 = date_range_slice(fetched_data.index, start_date, end_date)
+    data0 = fetched_data.iloc[rows0]
+    bars = bars.iloc[date_range_slice(bars.index, start_date, end_date)]
+
+    if len(bars) == 0:
+        return float(starting_cash), 0.0, 0, 0.0  # no 30m bar delivered, the strategy never trades
+    buy, sell, stop_buy, stop_sell = strategy_conditions(bars, ta_threshold=ta_pattern_threshold(p))
+
+    bar1, started = align_bars(data0, bars)
+    # ... and all the indicators are ready
+    active = started & (bars['ready'].to_numpy()[bar1] != 0)
+
+    partials = cached_bars(fetched_data, 30, indicator_cache)[1].iloc[rows0]
+    return simulate(p, feed_lists(data0, bars, bar1, partials), active.tolist(), buy[bar1].tolist(), sell[bar1].tolist(),
+                    stop_buy[bar1].tolist(), stop_sell[bar1].tolist(), starting_cash, leverage, commission,
+                    max_drawdown, min_value)
+
+
+def run_vector_backtest_batch(fetched_data, params_list, start_date=None, end_date=None,
+                              starting_cash=100, leverage=10.0, commission=0.0004, indicator_cache=None,
+                              max_drawdown=None, min_value=None):
+    ''' run_vector_backtest for a list of parameter sets, returns the list of their results.
+    The 30m bars with their Heikin Ashi and pivot levels, the HeikinPatterns signals and the 5m/30m alignment
+    are computed once for all sets; indicators are shared through the IndicatorCache by every set with the same
+    parameters. The order and accounting loop (simulate) is path dependent and still runs once per set, so
+    this only saves the shared setup: the indicators take most of the time and a batch is not much faster
+    than separate run_vector_backtest calls with the same IndicatorCache.'''
+    if not params_list:
+        return []
+    if indicator_cache is None:
+        indicator_cache = IndicatorCache(None)  # share the indicators within this batch
+    rows0 = date_range_slice(fetched_data.index, start_date, end_date)
+    data0 = fetched_data.iloc[rows0]
+    frames = [precompute_bars(fetched_data, p, 30, indicator_cache) for p in params_list]
+    rows = date_range_slice(frames[0].index, start_date, end_date)
+    frames = [bars.iloc[rows] for bars in frames]
+    bars = frames[0]
+
+    if len(bars) == 0:
+        return [(float(starting_cash), 0.0, 0, 0.0)] * len(params_list)
+    patterns = bar_patterns(bars)
+    # (sets, conditions, 30m bars) and (sets, 30m bars)
+    conditions = np.array([strategy_conditions(frame, patterns, ta_pattern_threshold(p)) for frame, p in zip(frames, params_list)])
+    ready = np.array([frame['ready'].to_numpy() for frame in frames]) != 0
+
+    bar1, started = align_bars(data0, bars)
+    conditions = conditions[:, :, bar1]
+    active = started & ready[:, bar1]
+    feed = feed_lists(data0, bars, bar1, cached_bars(fetched_data, 30, indicator_cache)[1].iloc[rows0])
+
+    return [simulate(p, feed, active[row].tolist(), *(condition.tolist() for condition in conditions[row]),
+                     starting_cash, leverage, commission, max_drawdown, min_value)
+            for row, p in enumerate(params_list)]
+
+
+def align_bars(data0, bars):
+    ''' 30m bar seen by every 5m bar (the latest one stamped at or before it), and the 5m bars where
+    next() can run as soon as data1 has 2 bars (HeikinAshi) and data0 has 5'''
+    index1 = np.searchsorted(bars.index.values, data0.index.values, side='right') - 1
+    return np.maximum(index1, 0), (index1 >= 1) & (np.arange(len(data0)) >= 4)
+
+
+def feed_lists(data0, bars, bar1, partials):
+    return dict(
+        open0=data0['open'].to_numpy().tolist(),
+        close0=data0['close'].to_numpy().tolist(),
+        partial_high=partials['high'].to_numpy().tolist(),
+        partial_low=partials['low'].to_numpy().tolist(),
+        ha_close=bars['ha_close'].to_numpy()[bar1].tolist(),
+    )
+
+
+def simulate(p, feed, active, buy, sell, stop_buy, stop_sell, starting_cash=100, leverage=10.0, commission=0.0004,
+             max_drawdown=None, min_value=None):
+    ''' The 5m loop of run_vector_backtest for one parameter set, "feed" comes from feed_lists and the
+    signals are lists with one value per 5m bar'''
+    open0, close0, partial_high, partial_low, ha_close = (feed[name] for name in FEED_COLUMNS)
+
+    sl_value = p.sl_percent / 100
+    cash = float(starting_cash)
+    size, price = 0, 0.0
+    long_entry_price = short_entry_price = 0
+    trade_stats = TradeStats(p.num_past_trades)
+    trade = [0, 0.0, 0.0, 0.0]  # open trade: size, price, pnl, commission
+    closed_trades = []
+    orders = []  # (is buy order, signed size, price at creation) submitted in the previous bar
+    # Broker state after each bar that had executions: bar, cash, position size, position price
+    states = [(0, cash, size, price)]
+    pruning = max_drawdown is not None or min_value is not None
+    peak = float('-inf')
+
+    for i in range(len(close0)):
+        if orders:
+            # Margin check of the new orders, pseudo-executed at their creation price (BackBroker.check_submitted)
+            check_cash, check_size, check_price = cash, size, price
+            accepted = []
+            for order in orders:
+                check_size, check_price, opened, closed = position_update(check_size, check_price, order[1], order[2])
+                if closed:
+                    closedvalue = -closed * order[2]
+                    check_cash += (closedvalue / leverage if closedvalue > 0 else closedvalue)
+                    check_cash -= abs(closed) * commission * order[2]
+                if opened:
+                    openedvalue = opened * order[2]
+                    check_cash -= (openedvalue / leverage if openedvalue > 0 else openedvalue)
+                    check_cash -= abs(opened) * commission * order[2]
+                if check_cash >= 0.0:
+                    accepted.append(order)
+
+            # Market orders are filled at the open of this bar
+            exec_price = open0[i]
+            for is_buy, order_size, _ in accepted:
+                new_size, new_price, opened, closed = position_update(size, price, order_size, exec_price)
+                if closed:
+                    pnl = -closed * (exec_price - price)
+                    closedvalue = -closed * price
+                    cash += (closedvalue / leverage if closedvalue > 0 else closedvalue) + pnl
+                    closedcomm = abs(closed) * commission * exec_price
+                    cash -= closedcomm
+                if opened:
+                    openedvalue = opened * exec_price
+                    opened_cash = cash - (openedvalue / leverage if openedvalue > 0 else openedvalue)
+                    openedcomm = abs(opened) * commission * exec_price
+                    opened_cash -= openedcomm
+                    if opened_cash < 0.0:
+                        opened = 0  # margin: only the closing part is executed
+                    else:
+                        cash = opened_cash
+                if closed + opened:
+                    size, price = position_update(size, price, closed + opened, exec_price)[:2]
+                if closed:
+                    pnlcomm = trade_update(trade, closed, exec_price, closedcomm)
+                    if pnlcomm is not None:
+                        closed_trades.append(pnlcomm)
+                        trade_stats.add(pnlcomm)
+                if opened:
+                    trade_update(trade, opened, exec_price, openedcomm)
+                if closed + opened == order_size:  # completed, notify_order records the entry price
+                    if is_buy:
+                        long_entry_price = exec_price
+                    else:
+                        short_entry_price = exec_price
+            states.append((i, cash, size, price))
+            orders = []
+
+        if pruning:
+            # Same value and drawdown as below, checked bar by bar so a hopeless run stops here
+            dvalue = size * close0[i]
+            unrealized = size * (close0[i] - price)
+            value = cash + ((dvalue - unrealized) / leverage + unrealized if dvalue > 0 else dvalue)
+            peak = max(peak, value)
+            if (min_value is not None and value < min_value) or \
+                    (max_drawdown is not None and 100.0 * (peak - value) / peak > max_drawdown):
+                return None
+
+        if not active[i] or close0[i] == 0:
+            continue
+
+        # HeikinAshiStrategy.next
+        in_position = size
+        if in_position == 0 and (buy[i] or sell[i]):
+            if p.use_kelly:
+                trade_amount1 = p.trade_coef / 2
+                free_money = cash * (trade_amount1 + (trade_amount1 * trade_stats.kelly_coef))
+            else:
+                free_money = cash * p.trade_coef
+            if buy[i]:
+                order_size = int(leverage * (free_money // partial_high[i]))
+                if order_size:
+                    orders.append((True, order_size, close0[i]))
+            else:
+                order_size = int(leverage * (free_money // partial_low[i]))
+                if order_size:
+                    orders.append((False, -order_size, close0[i]))
+        elif (in_position > 0 and (sell[i] or stop_buy[i])) or (in_position < 0 and (buy[i] or stop_sell[i])):
+            orders.append((in_position < 0, -in_position, close0[i]))
+
+        if p.sl_percent != 0:
+            if ((in_position > 0) and (ha_close[i] <= (long_entry_price * (1 - sl_value)))) or \
+                ((in_position < 0) and (ha_close[i] >= (short_entry_price * (1 + sl_value)))):
+                orders.append((in_position < 0, -in_position, close0[i]))
+
+    # Portfolio value after every bar (BackBroker._get_value), longs only tie up 1/leverage of their cost
+    state_bars, state_cash, state_size, state_price = (np.array(column) for column in zip(*states))
+    state = np.searchsorted(state_bars, np.arange(len(close0)), side='right') - 1
+    cash_, size_, price_ = state_cash[state], state_size[state].astype(np.float64), state_price[state]
+    close = np.array(close0)
+    dvalue = size_ * close
+    unrealized = size_ * (close - price_)
+    values = cash_ + np.where(dvalue > 0, (dvalue - unrealized) / leverage + unrealized, dvalue)
+
+    final_value = float(values[-1]) if len(values) else cash
+    if len(values):
+        peak = np.maximum.accumulate(values)
+        drawdown = max(0.0, float(np.max(100.0 * (peak - values) / peak)))
+    else:
+        drawdown = 0.0
+    ratio = final_value / starting_cash
+    rtot = float('-inf') if ratio < 0.0 else math.log(ratio)
+    return final_value, drawdown, system_quality(closed_trades), rtot